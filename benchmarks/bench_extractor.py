@@ -0,0 +1,115 @@
+"""Benchmark the IBU_HOTEL extractor against the previous xpath + regex path.
+
+Usage:
+    python benchmarks/bench_extractor.py [--hotels 300] [--repeat 20] [--tricky]
+
+Builds a synthetic hotel list page of a realistic size and reports the
+best time per page for the old extraction path and for each decoder the
+extractor can use in this environment.
+"""
+
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+from unittest.mock import patch
+
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hotel_scraper import extractor  # noqa: E402
+from hotel_scraper.extractor import extract_ibu_hotel, HotelListSchema  # noqa: E402
+
+
+def build_page(hotel_count, tricky=False):
+    """Return the body of a hotel list page with ``hotel_count`` hotels.
+
+    With ``tricky``, promotion labels contain ``};``, which the old regex
+    mistakes for the end of the payload.
+    """
+    label = "Deal };" if tricky else "Deal"
+    hotels = []
+    for i in range(hotel_count):
+        hotels.append({
+            "hotelBasicInfo": {
+                "hotelName": f"Hotel {i}", "hotelId": i, "price": 50 + i % 200,
+                "hotelImg": f"https://ak-d.tripcdn.com/images/{i}.jpg",
+                "hotelAddress": "1 Example Street " * 4, "tags": ["free wifi"] * 10,
+            },
+            "commentInfo": {"commentScore": "4.5", "commentDescription": "Very good " * 10},
+            "positionInfo": {
+                "positionName": "City Centre", "cityName": "London",
+                "coordinate": {"lat": 51.5 + i / 1e4, "lng": -0.12},
+            },
+            "roomInfo": {"physicalRoomName": "Double Room", "bedInfo": {"beds": ["double"] * 3}},
+            "promotionInfo": {"labels": [{"text": label, "color": "#fff"}] * 5},
+        })
+    payload = {
+        "initData": {
+            "firstPageList": {"hotelList": hotels},
+            "seoData": {"content": "<p>" + "Hotels in London. " * 2000 + "</p>"},
+            "filters": [{"id": n, "name": f"Filter {n}", "items": list(range(20))} for n in range(200)],
+        },
+    }
+    script = "window.IBU_HOTEL = " + json.dumps(payload) + ";"
+    return ("<html><head>" + "<meta name='x' content='y'>" * 200 +
+            "<script>" + script + "</script></head><body>" +
+            "<div class='hotel'>listing</div>" * 2000 + "</body></html>").encode()
+
+
+def legacy_extract(body):
+    """The extraction path the spider used before the shared extractor."""
+    response = HtmlResponse(url="https://uk.trip.com/hotels/list?city=1", body=body, encoding="utf-8")
+    script_data = response.xpath("//script[contains(text(), 'window.IBU_HOTEL')]/text()").get()
+    json_match = re.search(r'window.IBU_HOTEL\s*=\s*(\{.*?\});', script_data, re.DOTALL)
+    try:
+        return json.loads(json_match.group(1))
+    except ValueError:
+        return None
+
+
+def timed(func, body, repeat):
+    """Return the best time of ``repeat`` calls and the last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = func(body)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hotels", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tricky", action="store_true", help="put '};' inside string values")
+    args = parser.parse_args()
+
+    body = build_page(args.hotels, args.tricky)
+    print(f"Page size: {len(body) / 1024:.0f} KiB, {args.hotels} hotels")
+
+    seconds, result = timed(legacy_extract, body, args.repeat)
+    status = "ok" if result is not None else "truncated payload, decode failed"
+    print(f"{'xpath + regex + json.loads':32} {seconds * 1000:8.2f} ms  ({status})")
+
+    paths = [("extractor (stdlib raw_decode)", {}, None)]
+    if extractor.orjson is not None:
+        paths.append(("extractor (orjson)", {}, extractor.orjson))
+    if extractor.msgspec is not None:
+        paths.append(("extractor (msgspec schema)", extractor._typed_decoders, extractor.orjson))
+
+    for label, typed, fast in paths:
+        with patch.object(extractor, "_typed_decoders", typed), patch.object(extractor, "orjson", fast):
+            seconds, result = timed(lambda b: extract_ibu_hotel(b, HotelListSchema), body, args.repeat)
+        count = len(result["initData"]["firstPageList"]["hotelList"])
+        print(f"{label:32} {seconds * 1000:8.2f} ms  ({count} hotels)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Benchmark nearby-hotel queries over a large synthetic hotels table.
+
+Usage:
+    python benchmarks/bench_geo.py [--hotels 2000000] [--queries 200] [--radius-km 2]
+        [--database-url sqlite:///geo.db]
+
+Loads synthetic hotels clustered around a few hundred city centres, then
+reports the mean and p99 time of ``geo.nearby`` against a full scan of the
+coordinates with a vectorized haversine, which is the best a query without
+the geohash index can do. Results of both are checked to agree. The
+database defaults to a temporary SQLite file.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHUNK = 50000
+
+
+def synthetic_hotels(count, seed=0):
+    """Return latitudes and longitudes of ``count`` hotels around city centres."""
+    rng = np.random.default_rng(seed)
+    centres = np.column_stack([rng.uniform(-55, 65, 300), rng.uniform(-170, 170, 300)])
+    city = rng.integers(0, len(centres), count)
+    # Most hotels within ~10 km of the centre, as in a real city
+    latitudes = np.clip(centres[city, 0] + rng.normal(0, 0.08, count), -89.9, 89.9)
+    longitudes = centres[city, 1] + rng.normal(0, 0.12, count)
+    return latitudes, longitudes, centres
+
+
+def load(engine, latitudes, longitudes):
+    from hotel_scraper.geo import encode_geohashes
+    from hotel_scraper.models import Hotel
+
+    hotels = Hotel.__table__
+    with engine.begin() as connection:
+        for start in range(0, len(latitudes), CHUNK):
+            lats, lngs = latitudes[start:start + CHUNK], longitudes[start:start + CHUNK]
+            geohashes = encode_geohashes(lats, lngs)
+            connection.execute(hotels.insert(), [
+                {"property_id": start + i, "name": f"Hotel {start + i}", "latitude": float(lat),
+                 "longitude": float(lng), "geohash": str(cell), "retired": False}
+                for i, (lat, lng, cell) in enumerate(zip(lats, lngs, geohashes))
+            ])
+
+
+def full_scan(engine, latitude, longitude, radius_km, limit):
+    """Nearby hotels the way it was done before: every row, then distances."""
+    from sqlalchemy import select
+    from hotel_scraper.geo import haversine_km
+    from hotel_scraper.models import Hotel
+
+    hotels = Hotel.__table__
+    with engine.connect() as connection:
+        rows = connection.execute(select(hotels.c.id, hotels.c.latitude, hotels.c.longitude)).all()
+    coordinates = np.array([(row.latitude, row.longitude) for row in rows])
+    distances = haversine_km(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+    inside = np.flatnonzero(distances <= radius_km)
+    inside = inside[np.argsort(distances[inside], kind="stable")][:limit]
+    return [rows[i].id for i in inside]
+
+
+def timed(func, queries):
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(func(*query))
+        times.append(time.perf_counter() - start)
+    return np.array(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hotels", type=int, default=2000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--radius-km", type=float, default=2.0)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--scan-queries", type=int, default=5, help="full scans to time, they are slow")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hotel-geo-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'geo.db')}"
+    # Imported after DATABASE_URL is set, which get_engine reads
+    from hotel_scraper.database import get_engine
+    from hotel_scraper.geo import nearby
+    from hotel_scraper.models import Base
+
+    engine = get_engine()
+
+    try:
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        latitudes, longitudes, centres = synthetic_hotels(args.hotels)
+        start = time.perf_counter()
+        load(engine, latitudes, longitudes)
+        print(f"Loaded {args.hotels} hotels in {time.perf_counter() - start:.1f}s")
+
+        rng = np.random.default_rng(1)
+        picks = centres[rng.integers(0, len(centres), args.queries)]
+        queries = [(float(lat) + rng.normal(0, 0.05), float(lng) + rng.normal(0, 0.05)) for lat, lng in picks]
+
+        def indexed(lat, lng):
+            return [hotel["id"] for hotel in nearby(lat, lng, args.radius_km, args.limit, engine=engine)]
+
+        def scanned(lat, lng):
+            return full_scan(engine, lat, lng, args.radius_km, args.limit)
+
+        geo_times, geo_results = timed(indexed, queries)
+        scan_times, scan_results = timed(scanned, queries[:args.scan_queries])
+        assert geo_results[:args.scan_queries] == scan_results, "nearby() disagrees with the full scan"
+
+        found = np.mean([len(result) for result in geo_results])
+        print(f"{args.queries} queries, radius {args.radius_km} km, limit {args.limit}, {found:.1f} hotels found on average")
+        for label, times in (("full scan + numpy haversine", scan_times), ("geohash cells (geo.nearby)", geo_times)):
+            print(f"{label:30} mean {times.mean() * 1000:9.2f} ms  p99 {np.percentile(times, 99) * 1000:9.2f} ms")
+        print(f"Speed-up: {scan_times.mean() / geo_times.mean():.0f}x")
+    finally:
+        if not args.database_url:
+            engine.dispose()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
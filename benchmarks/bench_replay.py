@@ -0,0 +1,190 @@
+"""End-to-end throughput benchmark against the local stand-in server.
+
+Usage:
+    python benchmarks/bench_replay.py [--cities 20] [--pages 5] [--hotels-per-page 20]
+        [--latency-ms 50] [--error-rate 0.01] [--rate-limit 5] [--database-url sqlite:///bench.db]
+        [--throttle | --concurrency 16 --download-delay 0] [--image-outage 20] [--proxies 4]
+        [--http-cache .bench-cache --port 8765]
+
+Starts the stand-in server in a separate process, runs CityAndHotelsSpider
+in full crawl mode against it and reports pages/s, items/s, p50/p99
+callback latency, p50/p99 time until a response's output went through the
+pipelines, and peak RSS. The database defaults to a temporary SQLite
+file; pass ``--database-url`` to use a local Postgres instead.
+
+Downloads run at a fixed ``--concurrency`` and ``--download-delay`` unless
+``--throttle`` is given, in which case they start from the project's
+settings and the adaptive throttle takes over; ``--rate-limit`` makes the
+stand-in answer 429 to hotel pages beyond that many per second.
+``--image-outage`` serves images from another host name that answers 503
+for that many seconds, like an image CDN down at the start of the crawl.
+``--proxies`` sends hotel pages through that many stand-in proxies, each
+rate limited on its own like a separate client IP. ``--http-cache`` keeps
+the HTTP cache in that directory, so a second run with the same ``--port``
+replays the crawl from disk.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class CallbackTimer:
+    """Spider middleware timing each callback, placed next to the spider.
+
+    ``callback_times`` is the time spent inside the callback itself, and
+    ``response_times`` runs from the response entering the spider until its
+    output was fully consumed, which includes waiting on item pipelines.
+    """
+
+    callback_times = []
+    response_times = []
+
+    def process_spider_input(self, response, spider):
+        response.meta["_callback_started"] = time.perf_counter()
+
+    def process_spider_output(self, response, result, spider):
+        started = response.meta.get("_callback_started", time.perf_counter())
+        busy = 0.0
+        iterator = iter(result)
+        while True:
+            step = time.perf_counter()
+            try:
+                element = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                busy += time.perf_counter() - step
+            yield element
+        self.callback_times.append(busy)
+        self.response_times.append(time.perf_counter() - started)
+
+
+def serve(ready, stop, options):
+    from hotel_scraper.tests.standin import StandInServer
+
+    server = StandInServer(**options).start()
+    ready.put((server.base_url, server.proxy_urls))
+    stop.wait()
+    server.stop()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--hotels-per-page", type=int, default=20)
+    parser.add_argument("--payload-kb", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=0, help="hotel pages per second before 429s")
+    parser.add_argument("--concurrency", type=int, default=16, help="CONCURRENT_REQUESTS_PER_DOMAIN")
+    parser.add_argument("--download-delay", type=float, default=0, help="DOWNLOAD_DELAY")
+    parser.add_argument("--throttle", action="store_true", help="adapt downloads with the project's throttle")
+    parser.add_argument("--image-outage", type=float, default=0, help="seconds the image host answers 503")
+    parser.add_argument("--proxies", type=int, default=0, help="stand-in proxies to crawl through")
+    parser.add_argument("--http-cache", help="HTTP cache directory to replay runs from, off by default")
+    parser.add_argument("--port", type=int, default=0, help="stand-in port, random by default")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hotel-bench-")
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "hotel_scraper.settings")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    ready, stop = multiprocessing.Queue(), multiprocessing.Event()
+    options = {
+        "cities": args.cities, "pages": args.pages, "hotels_per_page": args.hotels_per_page,
+        "payload_kb": args.payload_kb, "image_kb": args.image_kb,
+        "latency_ms": args.latency_ms, "error_rate": args.error_rate, "rate_limit": args.rate_limit,
+        "image_host": "localhost" if args.image_outage else None, "image_outage": args.image_outage,
+        "proxies": args.proxies, "port": args.port,
+    }
+    server = multiprocessing.Process(target=serve, args=(ready, stop, options), daemon=True)
+    server.start()
+    base_url, proxy_urls = ready.get(timeout=30)
+
+    # Imported after DATABASE_URL is set, which get_engine reads
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from hotel_scraper.database import get_engine
+    from hotel_scraper.models import Base
+
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+
+    settings = get_project_settings()
+    settings.set("TRIP_BASE_URL", base_url)
+    settings.set("CRAWL_MODE", "full")
+    settings.set("IMAGES_DIR", os.path.join(workdir, "images"))
+    if not args.throttle:
+        settings.set("THROTTLE_ENABLED", False)
+        settings.set("DOWNLOAD_DELAY", args.download_delay)
+        settings.set("CONCURRENT_REQUESTS", args.concurrency * 2)
+        settings.set("CONCURRENT_REQUESTS_PER_DOMAIN", args.concurrency)
+    if proxy_urls:
+        settings.set("PROXY_ENABLED", True)
+        settings.set("PROXY_LIST", proxy_urls)
+    if args.http_cache:
+        settings.set("HTTPCACHE_ENABLED", True)
+        settings.set("HTTPCACHE_DIR", os.path.abspath(args.http_cache))
+    settings.set("LOG_LEVEL", "ERROR")
+    spider_middlewares = dict(settings.getdict("SPIDER_MIDDLEWARES"))
+    spider_middlewares[CallbackTimer] = 1000
+    settings.set("SPIDER_MIDDLEWARES", spider_middlewares)
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler("city_hotels")
+    started = time.perf_counter()
+    process.crawl(crawler)
+    process.start()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    server.join(timeout=10)
+
+    stats = crawler.stats.get_stats()
+    pages = len(CallbackTimer.callback_times)
+    items = stats.get("item_scraped_count", 0)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"Elapsed:            {elapsed:8.2f} s")
+    print(f"Pages:              {pages:8d}  ({pages / elapsed:.1f} pages/s)")
+    print(f"Items:              {items:8d}  ({items / elapsed:.1f} items/s)")
+    print(f"Responses:          {stats.get('response_received_count', 0):8d}")
+    print(f"Callback p50:       {percentile(CallbackTimer.callback_times, 0.50) * 1000:8.2f} ms")
+    print(f"Callback p99:       {percentile(CallbackTimer.callback_times, 0.99) * 1000:8.2f} ms")
+    print(f"Response p50:       {percentile(CallbackTimer.response_times, 0.50) * 1000:8.2f} ms")
+    print(f"Response p99:       {percentile(CallbackTimer.response_times, 0.99) * 1000:8.2f} ms")
+    print(f"Peak RSS:           {peak_rss_mb:8.1f} MiB")
+    statuses = {key.rsplit("/", 1)[-1]: value for key, value in stats.items()
+                if key.startswith("downloader/response_status_count/")}
+    print(f"Response statuses:  {statuses}")
+    for key, value in sorted(stats.items()):
+        if key.startswith(("throttle/", "retry/", "circuit/", "proxy/pool/", "proxy/switches")):
+            print(f"{key + ':':<28}{value}")
+    from sqlalchemy import func, select
+    from hotel_scraper.models import Hotel
+
+    with engine.connect() as connection:
+        images = connection.execute(select(func.count()).where(Hotel.image_path.isnot(None))).scalar()
+    print(f"Hotels with images: {images:8d}")
+    print(f"Work directory:     {workdir}")
+
+
+if __name__ == "__main__":
+    main()
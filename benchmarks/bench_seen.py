@@ -0,0 +1,75 @@
+"""Benchmark the persistent Bloom seen-set against an in-memory set.
+
+Usage:
+    python benchmarks/bench_seen.py [--keys 5000000] [--error-rate 0.001]
+        [--initial-capacity 1000000]
+
+Adds ``--keys`` request-fingerprint-like keys to a ``ScalableBloomFilter``
+in a temporary directory and reports adds/s, the size of its files, the
+time to reopen it, and the false positive rate measured on as many unseen
+keys, next to the memory a Python set of the same keys takes.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hotel_scraper.seen import ScalableBloomFilter  # noqa: E402
+
+
+def fingerprint(i):
+    return hashlib.sha1(b"%d" % i).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=5000000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--initial-capacity", type=int, default=1000000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hotel-seen-bench-")
+    try:
+        seen = ScalableBloomFilter(workdir, initial_capacity=args.initial_capacity, error_rate=args.error_rate)
+        start = time.perf_counter()
+        for i in range(args.keys):
+            seen.add(fingerprint(i))
+        elapsed = time.perf_counter() - start
+        seen.close()
+        size = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+
+        start = time.perf_counter()
+        seen = ScalableBloomFilter(workdir)
+        reopened = time.perf_counter() - start
+        probes = min(args.keys, 1000000)
+        start = time.perf_counter()
+        false_positives = sum(fingerprint(i) in seen for i in range(args.keys, args.keys + probes))
+        lookups = time.perf_counter() - start
+        seen.close()
+
+        sample = min(args.keys, 1000000)
+        tracemalloc.start()
+        keys = {fingerprint(i) for i in range(sample)}
+        set_bytes = tracemalloc.get_traced_memory()[0] / sample * args.keys
+        tracemalloc.stop()
+        del keys
+
+        print(f"{args.keys} keys, error rate {args.error_rate}, {len(seen.filters)} filters")
+        print(f"add      {args.keys / elapsed:10.0f} keys/s")
+        print(f"lookup   {probes / lookups:10.0f} keys/s")
+        print(f"reopen   {reopened * 1000:10.2f} ms")
+        print(f"false positives {false_positives / probes:.5f}")
+        print(f"Bloom files {size / 2 ** 20:8.1f} MB   Python set ~{set_bytes / 2 ** 20:8.1f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
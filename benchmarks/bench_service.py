@@ -0,0 +1,154 @@
+"""Load test the read-only query service against a local SQLite database.
+
+Usage:
+    python benchmarks/bench_service.py [--hotels 200000] [--cities 50] [--clients 8]
+        [--requests 2000] [--cache-ttl 60]
+
+Fills a temporary SQLite database with synthetic hotels, starts the query
+service on it in a separate process and sends requests from concurrent
+clients. Half of them walk deep into a city's hotels sorted by price,
+following the cursors, and half are filtered first pages. Reports
+requests/s and p50/p90/p99 latency, overall and for first versus deep
+pages. Run with ``--cache-ttl 0`` to measure the database alone.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load(database_url, hotel_count, city_count):
+    os.environ["DATABASE_URL"] = database_url
+    # Imported after DATABASE_URL is set, which get_engine reads
+    from hotel_scraper.city_stats import refresh_all_city_stats
+    from hotel_scraper.database import get_engine
+    from hotel_scraper.migrations import migrate
+    from hotel_scraper.models import City, Hotel
+
+    engine = get_engine()
+
+    migrate(engine)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(City.__table__.insert(), [{"id": i + 1, "name": f"City {i}"} for i in range(city_count)])
+        for start in range(0, hotel_count, 50000):
+            connection.execute(Hotel.__table__.insert(), [
+                {"property_id": i, "name": f"Hotel {i}", "city_id": i % city_count + 1,
+                 "price": round(rng.uniform(20, 500), 2), "rating": round(rng.uniform(2, 5), 1), "retired": False}
+                for i in range(start, min(start + 50000, hotel_count))
+            ])
+        refresh_all_city_stats(connection)
+    engine.dispose()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hotels", type=int, default=200000)
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=20, help="pages deep each walk goes")
+    parser.add_argument("--cache-ttl", type=float, default=60)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hotel-service-bench-")
+    database_url = f"sqlite:///{os.path.join(workdir, 'service.db')}"
+    load(database_url, args.hotels, args.cities)
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=ROOT, SCRAPY_SETTINGS_MODULE="hotel_scraper.settings")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "hotel_scraper.service", "--port", str(port), "--cache-ttl", str(args.cache_ttl)],
+        env=env, cwd=workdir, stdout=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + "/cities").read()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        latencies = {"first page": [], "deep page": []}
+        lock = threading.Lock()
+        remaining = [args.requests]
+
+        def fetch(params):
+            start = time.perf_counter()
+            with urllib.request.urlopen(f"{base}/hotels?{urllib.parse.urlencode(params)}") as response:
+                body = json.loads(response.read())
+            return time.perf_counter() - start, body
+
+        def take():
+            with lock:
+                remaining[0] -= 1
+                return remaining[0] >= 0
+
+        def client(seed):
+            rng = random.Random(seed)
+            while take():
+                city = f"City {rng.randrange(args.cities)}"
+                if rng.random() < 0.5:
+                    params = {"city": city, "sort": "price", "limit": 50}
+                    for page in range(args.pages):
+                        seconds, body = fetch(params)
+                        with lock:
+                            latencies["first page" if page == 0 else "deep page"].append(seconds)
+                        if not body["next_cursor"] or (page and not take()):
+                            break
+                        params["cursor"] = body["next_cursor"]
+                else:
+                    low = rng.choice(range(20, 400, 20))
+                    params = {"city": city, "min_price": low, "max_price": low + 100,
+                              "min_rating": rng.choice((3, 3.5, 4)), "sort": "-rating"}
+                    seconds, _ = fetch(params)
+                    with lock:
+                        latencies["first page"].append(seconds)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        everything = latencies["first page"] + latencies["deep page"]
+        print(f"{args.hotels} hotels in {args.cities} cities, {args.clients} clients, cache TTL {args.cache_ttl}s")
+        print(f"{len(everything)} requests in {elapsed:.1f}s, {len(everything) / elapsed:.0f} requests/s")
+        for label, values in (("all", everything), ("first page", latencies["first page"]),
+                              ("deep page", latencies["deep page"])):
+            print(f"{label:12} p50 {percentile(values, 0.5) * 1000:7.2f} ms  "
+                  f"p90 {percentile(values, 0.9) * 1000:7.2f} ms  p99 {percentile(values, 0.99) * 1000:7.2f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import argparse
+
+from scrapy.utils.project import get_project_settings
+from sqlalchemy.exc import OperationalError
+from hotel_scraper.database import get_engine
+from hotel_scraper.export import dump_hotels
+
+if __name__ == "__main__":
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(description="Export the stored hotels as a Parquet snapshot.")
+    parser.add_argument("--output", default=settings.get("EXPORT_DIR", "exports/hotels"))
+    parser.add_argument("--crawl-id", help="id recorded with every row, dump-<UTC time> by default")
+    parser.add_argument("--row-group-size", type=int, default=settings.getint("EXPORT_ROW_GROUP_SIZE", 10000))
+    args = parser.parse_args()
+    try:
+        print("Exporting hotels...")
+        paths = dump_hotels(
+            get_engine(settings),
+            args.output,
+            crawl_id=args.crawl_id,
+            row_group_size=args.row_group_size,
+            compression=settings.get("EXPORT_COMPRESSION", "zstd"),
+        )
+        print(f"Exported hotels to {len(paths)} files under {args.output}.")
+    except OperationalError as e:
+        print(f"Export failed: {e}")
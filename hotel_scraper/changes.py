@@ -0,0 +1,93 @@
+"""Content fingerprints of hotels and the feed of their changes.
+
+Every stored hotel carries ``content_hash``, a SHA-256 over the columns of
+``HASHED_COLUMNS``: everything scraped about the hotel, but not when it was
+last seen. The database pipeline compares the hash of each scraped hotel
+with the stored one and only rewrites the hotels whose hash differs, so a
+crawl of hotels that didn't change only bumps their ``last_seen_at``.
+
+What did change is appended to the ``hotel_changes`` table, one row per
+inserted, updated or disappeared (retired) hotel, with the changed columns
+and their old and new values. Consumers sync incrementally by reading the
+changes after the last id they have seen::
+
+    from hotel_scraper.changes import changes_since
+
+    for change in changes_since(after=last_id, limit=1000):
+        ...
+
+The query service serves the same feed as ``GET /changes?after=``. A crawl
+that starts over, clearing the stored hotels, first records every listed
+hotel as disappeared, so the feed still adds up to the hotels stored.
+"""
+
+import hashlib
+import json
+
+from sqlalchemy import DateTime, String, literal, or_, select
+
+from hotel_scraper.database import get_engine
+from hotel_scraper.models import Hotel, HotelChange
+
+HASHED_COLUMNS = (
+    "name", "rating", "location", "latitude", "longitude", "room_type", "price", "image_url",
+    "image_path", "image_width", "image_height", "image_variants", "city_id", "city_name",
+)
+
+INSERTED, UPDATED, DISAPPEARED = "inserted", "updated", "disappeared"
+
+
+def content_hash(row):
+    """Return the SHA-256 hex digest of the hashed columns of a hotel row."""
+    content = json.dumps([row.get(column) for column in HASHED_COLUMNS], sort_keys=True,
+                         separators=(",", ":"), default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def changed_columns(old, new):
+    """Return ``{column: [old, new]}`` for the hashed columns that differ."""
+    return {column: [old.get(column), new.get(column)]
+            for column in HASHED_COLUMNS if old.get(column) != new.get(column)}
+
+
+def stored_hotels(connection, property_ids):
+    """Return the stored hashed columns, hash and state of hotels, by property id."""
+    hotels = Hotel.__table__
+    columns = [hotels.c[name] for name in ("id", "property_id", "content_hash", "retired") + HASHED_COLUMNS]
+    stored = {}
+    property_ids = sorted(property_ids)
+    for start in range(0, len(property_ids), 500):
+        query = select(*columns).where(hotels.c.property_id.in_(property_ids[start:start + 500]))
+        for row in connection.execute(query).mappings():
+            stored[row["property_id"]] = dict(row)
+    return stored
+
+
+def record_changes(connection, changes):
+    """Append changes, dicts of ``HotelChange`` columns, to the feed."""
+    if changes:
+        connection.execute(HotelChange.__table__.insert(), changes)
+
+
+def record_cleared(connection, changed_at):
+    """Record every listed hotel as disappeared, before the hotels are cleared."""
+    hotels = Hotel.__table__
+    # Retired hotels were recorded as disappeared when they were retired
+    listed = (
+        select(hotels.c.property_id, literal(DISAPPEARED, String), literal(changed_at, DateTime(timezone=True)))
+        .where(hotels.c.property_id.is_not(None))
+        .where(or_(hotels.c.retired.is_(None), hotels.c.retired.is_(False)))
+        .order_by(hotels.c.id)
+    )
+    connection.execute(
+        HotelChange.__table__.insert().from_select(["property_id", "change", "changed_at"], listed)
+    )
+
+
+def changes_since(after=0, limit=1000, engine=None):
+    """Return up to ``limit`` changes with an id above ``after``, oldest first."""
+    engine = engine if engine is not None else get_engine()
+    changes = HotelChange.__table__
+    query = select(changes).where(changes.c.id > after).order_by(changes.c.id).limit(limit)
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(query).mappings()]
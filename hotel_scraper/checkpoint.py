@@ -0,0 +1,171 @@
+"""Checkpoints of full crawls, so a crawl that stops early can be resumed.
+
+A ``Checkpoint`` follows the hotel list pages of every city through the
+crawl. A page counts as done once it was parsed and all of its hotels left
+the pipelines, their images downloaded and their rows stored, or dropped.
+Hotels are followed by the ``list_page`` they carry, their page and their
+position on it, so a hotel whose row failed to be written keeps its page
+from ever counting as done, and one reported twice, e.g. failed in one
+pipeline and later stored by another, only counts once. The last page
+of a city up to which every page is done, and whether the city was read to
+the end, are saved to the ``city_checkpoints`` table every
+``CHECKPOINT_INTERVAL`` seconds and when the spider closes.
+
+When the next crawl of the same name starts and the previous one didn't
+finish, e.g. because its container was killed, only the cities not read to
+the end are crawled, each from the page after its last done page, and the
+stored data is kept. A crawl that finished is started over.
+
+With Scrapy's ``JOBDIR`` set, pending requests are queued on disk instead
+of in memory. A crawl paused cleanly, e.g. by ``docker stop``, resumes them
+from there; after a crash, the disk queue can't be trusted and the spider
+schedules the unfinished pages again itself.
+"""
+
+from datetime import datetime, timezone
+
+from itemadapter import ItemAdapter
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from hotel_scraper.items import list_page, list_position
+from hotel_scraper.models import CityCheckpoint, CrawlCheckpoint
+
+RUNNING = "running"
+PAUSED = "paused"
+FINISHED = "finished"
+
+
+class Checkpoint:
+    """Per-city progress of one full crawl, saved to the database."""
+
+    def __init__(self, engine, crawl):
+        self.engine = engine
+        self.crawl = crawl
+        self.started_at = None
+        # Progress by city id: city name, last done page and whether it is done
+        self.cities = {}
+        self.dirty = set()
+        # Pages parsed but not done yet, whether each was the city's last,
+        # and the positions of the hotels of each page still in the pipelines
+        self.parsed = {}
+        self.outstanding = {}
+
+    def open(self):
+        """Load the crawl, or start it over if the last one finished.
+
+        Returns the status the previous crawl was left in, or None when
+        there was nothing to resume.
+        """
+        now = datetime.now(timezone.utc)
+        crawls, cities = CrawlCheckpoint.__table__, CityCheckpoint.__table__
+        with self.engine.begin() as connection:
+            row = connection.execute(select(crawls).where(crawls.c.crawl == self.crawl)).first()
+            if row is not None and row.status != FINISHED:
+                previous = row.status
+                started_at = row.started_at
+                self.started_at = started_at.replace(tzinfo=timezone.utc) if started_at.tzinfo is None else started_at
+                for city in connection.execute(select(cities).where(cities.c.crawl == self.crawl)):
+                    self.cities[city.city_id] = {"city_name": city.city_name, "page": city.page, "done": city.done}
+            else:
+                previous = None
+                self.started_at = now
+                connection.execute(delete(cities).where(cities.c.crawl == self.crawl))
+            self._upsert(connection, crawls, ["crawl"], [{
+                "crawl": self.crawl, "status": RUNNING, "started_at": self.started_at,
+                "pending_items": 0, "updated_at": now,
+            }])
+        return previous
+
+    def next_page(self, city_id):
+        """Return the page a city's hotel list continues from, or None if it is done."""
+        progress = self.cities.get(str(city_id))
+        if progress is None:
+            return 1
+        return None if progress["done"] else progress["page"] + 1
+
+    def track(self, item, city_id, page, position):
+        """Note an item of a page on its way into the pipelines, marking it with its place."""
+        key = (str(city_id), page)
+        ItemAdapter(item)["list_page"] = (*key, position)
+        self.outstanding.setdefault(key, set()).add(position)
+
+    def item_done(self, item):
+        """Note an item that left the pipelines, stored, dropped or failed."""
+        key = list_page(item)
+        positions = self.outstanding.get(key)
+        position = list_position(item)
+        if positions is None or position not in positions:
+            return
+        positions.remove(position)
+        if not positions:
+            del self.outstanding[key]
+            self._advance(key[0])
+
+    def items_done(self, items):
+        """Note a batch of items stored by the database pipeline."""
+        for item in items:
+            self.item_done(item)
+
+    def page_parsed(self, city_id, city_name, page, last=False):
+        """Note a parsed page, ``last`` when the city's hotel list ends with it."""
+        city_id = str(city_id)
+        self.cities.setdefault(city_id, {"city_name": city_name, "page": page - 1, "done": False})
+        self.parsed[(city_id, page)] = last
+        self._advance(city_id)
+
+    def _advance(self, city_id):
+        progress = self.cities.get(city_id)
+        if progress is None:
+            return
+        # Pages can finish out of order; progress only moves over a run of done pages
+        while True:
+            key = (city_id, progress["page"] + 1)
+            if key not in self.parsed or key in self.outstanding:
+                break
+            progress["page"] += 1
+            progress["done"] = self.parsed.pop(key)
+            self.dirty.add(city_id)
+
+    def changes(self):
+        """Return the rows of the cities that progressed since the last call."""
+        now = datetime.now(timezone.utc)
+        rows = [
+            {"crawl": self.crawl, "city_id": city_id, "updated_at": now, **self.cities[city_id]}
+            for city_id in sorted(self.dirty)
+        ]
+        self.dirty.clear()
+        return rows
+
+    def save(self, rows, status=RUNNING, pending_items=0):
+        """Save city rows from ``changes`` and the crawl's status."""
+        now = datetime.now(timezone.utc)
+        crawls, cities = CrawlCheckpoint.__table__, CityCheckpoint.__table__
+        with self.engine.begin() as connection:
+            if rows:
+                self._upsert(connection, cities, ["crawl", "city_id"], rows)
+            connection.execute(
+                crawls.update()
+                .where(crawls.c.crawl == self.crawl)
+                .values(status=status, pending_items=pending_items, updated_at=now)
+            )
+
+    def pending(self):
+        """Return the number of hotels still in the pipelines."""
+        return sum(len(positions) for positions in self.outstanding.values())
+
+    def unfinished(self):
+        """Return the number of cities started but not read to the end."""
+        return sum(not progress["done"] for progress in self.cities.values())
+
+    @staticmethod
+    def _upsert(connection, table, keys, rows):
+        if connection.dialect.name == "postgresql":
+            statement = postgresql.insert(table)
+        else:
+            statement = sqlite.insert(table)
+        columns = [column for column in rows[0] if column not in keys]
+        statement = statement.on_conflict_do_update(
+            index_elements=keys, set_={column: statement.excluded[column] for column in columns},
+        )
+        connection.execute(statement, rows)
@@ -0,0 +1,99 @@
+"""Per-city hotel aggregates in the ``city_stats`` table.
+
+Counts, price and rating ranges and price percentiles per city would take a
+scan of ``hotels`` to compute on demand. Instead the database pipeline
+refreshes the aggregates of the cities in each batch it writes, in the same
+transaction, so readers always see aggregates consistent with the hotels.
+
+A refresh reads only the hotels of the given cities, through the
+``(city_id, price)`` and ``(city_id, rating)`` indexes, and computes the
+percentiles in Python the way ``percentile_cont`` does, so it works the
+same on every database.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, func, select
+
+from hotel_scraper.models import City, CityStats, Hotel
+
+PRICE_PERCENTILES = {"p25_price": 0.25, "median_price": 0.5, "p75_price": 0.75, "p90_price": 0.9}
+# Cities refreshed per query
+CHUNK_SIZE = 500
+
+
+def percentile(values, q):
+    """Return the ``q`` percentile of sorted values, interpolating linearly."""
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def refresh_city_stats(connection, city_ids, now=None):
+    """Recompute the aggregates of the given cities; return how many."""
+    city_ids = sorted({city_id for city_id in city_ids if city_id is not None})
+    now = now or datetime.now(timezone.utc)
+    for start in range(0, len(city_ids), CHUNK_SIZE):
+        chunk = city_ids[start:start + CHUNK_SIZE]
+        counts, prices, ratings = _values(connection, chunk)
+        rows = [_aggregate(city_id, counts.get(city_id, 0), prices[city_id], ratings[city_id], now)
+                for city_id in chunk]
+        connection.execute(_upsert_statement(connection), rows)
+    return len(city_ids)
+
+
+def refresh_all_city_stats(connection):
+    """Recompute the aggregates of every city, e.g. to backfill the table."""
+    city_ids = connection.execute(select(City.__table__.c.id)).scalars().all()
+    return refresh_city_stats(connection, city_ids)
+
+
+def _values(connection, city_ids):
+    """Return the listed hotel counts and sorted prices and ratings of cities."""
+    hotels = Hotel.__table__
+    in_cities = and_(hotels.c.city_id.in_(city_ids), func.coalesce(hotels.c.retired, False).is_(False))
+    counts = dict(connection.execute(
+        select(hotels.c.city_id, func.count()).where(in_cities).group_by(hotels.c.city_id)
+    ).all())
+    values = []
+    for column in (hotels.c.price, hotels.c.rating):
+        by_city = {city_id: [] for city_id in city_ids}
+        query = select(hotels.c.city_id, column).where(in_cities, column.is_not(None))
+        for city_id, value in connection.execute(query.order_by(hotels.c.city_id, column)):
+            by_city[city_id].append(value)
+        values.append(by_city)
+    return counts, values[0], values[1]
+
+
+def _aggregate(city_id, count, prices, ratings, now):
+    row = {
+        "city_id": city_id,
+        "hotels": count,
+        "min_price": prices[0] if prices else None,
+        "avg_price": sum(prices) / len(prices) if prices else None,
+        "max_price": prices[-1] if prices else None,
+        "min_rating": ratings[0] if ratings else None,
+        "avg_rating": sum(ratings) / len(ratings) if ratings else None,
+        "max_rating": ratings[-1] if ratings else None,
+        "median_rating": percentile(ratings, 0.5),
+        "updated_at": now,
+    }
+    for name, q in PRICE_PERCENTILES.items():
+        row[name] = percentile(prices, q)
+    return row
+
+
+def _upsert_statement(connection):
+    table = CityStats.__table__
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.city_id],
+        set_={column.name: stmt.excluded[column.name] for column in table.columns if column.name != "city_id"},
+    )
@@ -0,0 +1,186 @@
+"""Columnar snapshots of the scraped hotels for analytics.
+
+Snapshots are Parquet files in a Hive-style layout partitioned by crawl
+date and city, e.g.::
+
+    exports/hotels/crawl_date=2024-05-01/city=Dhaka/part-city_hotels-20240501T080000Z-1a2b3c4d.parquet
+
+Every row carries the ``crawl_id`` and the time it was scraped, and each
+crawl adds new files instead of replacing old ones, so price and rating
+history accumulates across runs. The whole tree reads as one table with
+e.g. ``pyarrow.dataset.dataset(root, partitioning="hive")`` or DuckDB's
+``read_parquet('exports/hotels/**/*.parquet', hive_partitioning=true)``.
+
+Files are written one row group at a time and only appear under their
+final name once complete, so readers never see a half-written file.
+
+Snapshots require pyarrow.
+"""
+
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from sqlalchemy import func, select
+
+from hotel_scraper.models import City, Hotel
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+
+# Partition columns are encoded in the directory names, not stored in the files
+PARTITION_COLUMNS = ("crawl_date", "city")
+
+SNAPSHOT_COLUMNS = (
+    ("crawl_id", "string"),
+    ("scraped_at", "timestamp"),
+    ("property_id", "int64"),
+    ("name", "string"),
+    ("city_name", "string"),
+    ("rating", "float64"),
+    ("price", "float64"),
+    ("location", "string"),
+    ("latitude", "float64"),
+    ("longitude", "float64"),
+    ("room_type", "string"),
+    ("image_url", "string"),
+    ("image_path", "string"),
+)
+
+
+def snapshot_schema():
+    """Return the Arrow schema of the snapshot files."""
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in SNAPSHOT_COLUMNS])
+
+
+def default_crawl_id(prefix, started=None):
+    """Return a crawl id made of a prefix and the UTC start time of the crawl."""
+    started = started or datetime.now(timezone.utc)
+    return f"{prefix}-{started:%Y%m%dT%H%M%SZ}"
+
+
+class SnapshotWriter:
+    """Write hotel snapshot rows to partitioned Parquet files.
+
+    ``write`` appends one row group to the file of a ``(crawl_date, city)``
+    partition, opening it on first use; callers batch the rows. Each writer
+    gets its own file per partition, so several processes can export the
+    same crawl side by side. ``close`` finishes the files and moves them to
+    their final names. Not thread safe.
+    """
+
+    def __init__(self, root, crawl_id, compression="zstd"):
+        if pa is None:
+            raise RuntimeError("Parquet snapshots require pyarrow")
+        self.root = root
+        self.crawl_id = crawl_id
+        self.compression = compression
+        self.schema = snapshot_schema()
+        self.file_name = f"part-{_safe_name(crawl_id)}-{uuid.uuid4().hex[:8]}.parquet"
+        self.writers = {}
+        self.rows_written = 0
+
+    def partition_dir(self, partition):
+        crawl_date, city = partition
+        return os.path.join(self.root, f"crawl_date={crawl_date}", f"city={quote(city or 'unknown', safe='')}")
+
+    def write(self, partition, rows):
+        """Write rows of one partition as a row group."""
+        if not rows:
+            return 0
+        writer = self.writers.get(partition)
+        if writer is None:
+            directory = self.partition_dir(partition)
+            os.makedirs(directory, exist_ok=True)
+            # A leading dot hides the file from dataset readers until it is complete
+            tmp_path = os.path.join(directory, f".{self.file_name}.tmp")
+            writer = pq.ParquetWriter(tmp_path, self.schema, compression=self.compression)
+            self.writers[partition] = writer
+        columns = {name: [row.get(name) for row in rows] for name in self.schema.names}
+        writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def close(self):
+        """Finish every file and return the paths written."""
+        paths = []
+        for partition, writer in self.writers.items():
+            writer.close()
+            directory = self.partition_dir(partition)
+            path = os.path.join(directory, self.file_name)
+            os.replace(os.path.join(directory, f".{self.file_name}.tmp"), path)
+            paths.append(path)
+        self.writers = {}
+        return paths
+
+
+def dump_hotels(engine, root, crawl_id=None, row_group_size=10000, compression="zstd"):
+    """Export the stored hotels as a snapshot; return the paths written.
+
+    Hotels are streamed from the database city by city, so memory is
+    bounded by one row group whatever the size of the table. Retired hotels
+    are left out, and each row is timestamped with when its hotel was last
+    seen by a crawl.
+    """
+    dumped_at = datetime.now(timezone.utc)
+    crawl_id = crawl_id or default_crawl_id("dump", dumped_at)
+    crawl_date = dumped_at.date().isoformat()
+    hotels = Hotel.__table__
+    cities = City.__table__
+    query = (
+        select(
+            cities.c.name.label("city"),
+            hotels.c.property_id,
+            hotels.c.name,
+            hotels.c.city_name,
+            hotels.c.rating,
+            hotels.c.price,
+            hotels.c.location,
+            hotels.c.latitude,
+            hotels.c.longitude,
+            hotels.c.room_type,
+            hotels.c.image_url,
+            hotels.c.image_path,
+            hotels.c.last_seen_at,
+        )
+        .select_from(hotels.join(cities, hotels.c.city_id == cities.c.id))
+        .where(func.coalesce(hotels.c.retired, False).is_(False))
+        .order_by(cities.c.name, hotels.c.property_id)
+    )
+
+    writer = SnapshotWriter(root, crawl_id, compression)
+    batch, city = [], None
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=row_group_size).execute(query)
+        for row in result.mappings():
+            if batch and (row["city"] != city or len(batch) >= row_group_size):
+                writer.write((crawl_date, city), batch)
+                batch = []
+            city = row["city"]
+            snapshot = dict(row, crawl_id=crawl_id, scraped_at=_utc(row["last_seen_at"]) or dumped_at)
+            batch.append(snapshot)
+    writer.write((crawl_date, city), batch)
+    return writer.close()
+
+
+def _utc(value):
+    # SQLite hands timestamps back without their time zone
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", value)
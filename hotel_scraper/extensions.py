@@ -0,0 +1,224 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import os
+from time import monotonic
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from sqlalchemy import select
+from twisted.internet.error import CannotListenError
+from twisted.internet.threads import deferToThread
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from hotel_scraper import signals as hotel_signals
+from hotel_scraper.database import get_engine
+from hotel_scraper.metrics import SIZE_BUCKETS, MetricsRegistry
+from hotel_scraper.models import City, CityStats
+
+
+class CrawlSummary:
+    """Log a per-city summary of the stored hotels when the crawl ends.
+
+    The summary is read from the ``city_stats`` aggregates, which the
+    database pipeline keeps up to date, on a worker thread once the item
+    pipelines have flushed. Enable it with
+    ``CRAWL_SUMMARY_ENABLED``.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else get_engine()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CRAWL_SUMMARY_ENABLED"):
+            raise NotConfigured
+        ext = cls(get_engine(crawler.settings))
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider):
+        dfd = deferToThread(self.summarize)
+        dfd.addCallback(self.log_summary, spider)
+        dfd.addErrback(lambda failure: spider.logger.error(f"Error while summarizing the crawl: {failure.value}"))
+        return dfd
+
+    def summarize(self):
+        """Return one row of hotel counts and price/rating stats per city."""
+        cities = City.__table__
+        stats = CityStats.__table__
+        query = (
+            select(
+                cities.c.name, stats.c.hotels, stats.c.min_price, stats.c.avg_price, stats.c.max_price,
+                stats.c.min_rating, stats.c.avg_rating, stats.c.max_rating,
+            )
+            .select_from(cities.join(stats, stats.c.city_id == cities.c.id))
+            .where(stats.c.hotels > 0)
+            .order_by(cities.c.name)
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(query).all()
+
+    def log_summary(self, rows, spider):
+        spider.logger.info(f"Crawl summary for {len(rows)} cities:")
+        for row in rows:
+            spider.logger.info(
+                f"    {row.name}: {row.hotels} hotels, "
+                f"price {_fmt(row.min_price)}/{_fmt(row.avg_price)}/{_fmt(row.max_price)}, "
+                f"rating {_fmt(row.min_rating)}/{_fmt(row.avg_rating)}/{_fmt(row.max_rating)} (min/avg/max)"
+            )
+        return rows
+
+
+class CrawlMetrics:
+    """Record per-stage and per-city metrics of the crawl.
+
+    Downloads are measured from Scrapy's ``response_received`` signal and
+    split into HTML pages and images. Payload extraction, hotel parsing,
+    image storage and database flushes report their duration through
+    ``hotel_scraper.signals.stage_finished``, and image failures through
+    ``image_failed``. While the crawl runs the metrics are served in the
+    Prometheus text format on ``http://METRICS_HOST:METRICS_PORT/metrics``;
+    when it ends a JSON summary is written to ``METRICS_FILE``. Enable it
+    with ``METRICS_ENABLED``.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9410, http_enabled=True, dump_file="metrics.json", per_city=True):
+        self.host = host
+        self.port = port
+        self.http_enabled = http_enabled
+        self.dump_file = dump_file
+        self.per_city = per_city
+        self.registry = MetricsRegistry()
+        self.listener = None
+        self.started = None
+        for name, text in (
+            ("download_seconds", "Download latency by kind (html or image)."),
+            ("response_bytes_total", "Bytes of response bodies received."),
+            ("responses_total", "Responses received by kind and status."),
+            ("cache_hits_total", "Responses served from the HTTP cache."),
+            ("stage_seconds", "Time spent in each processing stage."),
+            ("stage_bytes", "Bytes handled by each processing stage, e.g. payload size."),
+            ("stage_items_total", "Things produced by each processing stage."),
+            ("items_total", "Items scraped."),
+            ("image_failures_total", "Images that could not be stored, by reason."),
+        ):
+            self.registry.describe(name, text)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        ext = cls(
+            host=settings.get("METRICS_HOST", "127.0.0.1"),
+            port=settings.getint("METRICS_PORT", 9410),
+            http_enabled=settings.getbool("METRICS_HTTP_ENABLED", True),
+            dump_file=settings.get("METRICS_FILE", "metrics.json"),
+            per_city=settings.getbool("METRICS_PER_CITY", True),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.stage_finished, signal=hotel_signals.stage_finished)
+        crawler.signals.connect(ext.image_failed, signal=hotel_signals.image_failed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started = monotonic()
+        if not self.http_enabled:
+            return
+        from twisted.internet import reactor
+
+        root = Resource()
+        root.putChild(b"metrics", MetricsResource(self.registry))
+        try:
+            self.listener = reactor.listenTCP(self.port, Site(root), interface=self.host)
+        except CannotListenError as e:
+            spider.logger.warning(f"Metrics endpoint not started: {e}")
+            return
+        port = self.listener.getHost().port
+        spider.logger.info(f"Serving crawl metrics on http://{self.host}:{port}/metrics")
+
+    def spider_closed(self, spider):
+        if self.listener is not None:
+            self.listener.stopListening()
+            self.listener = None
+        summary = self.summary()
+        spider.logger.info(
+            f"Crawl metrics: {summary['items']} items in {summary['elapsed_seconds']:.1f}s "
+            f"({summary['items_per_second']:.1f} items/s)"
+        )
+        if self.dump_file:
+            directory = os.path.dirname(self.dump_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dump_file, "w") as f:
+                json.dump(summary, f, indent=2)
+            spider.logger.info(f"Crawl metrics written to {self.dump_file}")
+
+    def response_received(self, response, request, spider):
+        kind = "image" if request.meta.get("download_slot") == "images" else "html"
+        city = request.meta.get("city_name")
+        registry = self.registry
+        registry.inc("responses_total", kind=kind, status=response.status)
+        registry.inc("response_bytes_total", len(response.body), **self._labels(kind=kind, city=city))
+        if "cached" in response.flags:
+            registry.inc("cache_hits_total", kind=kind)
+        elif "download_latency" in request.meta:
+            registry.observe("download_seconds", request.meta["download_latency"], kind=kind)
+
+    def item_scraped(self, item, response, spider):
+        self.registry.inc("items_total", **self._labels(city=ItemAdapter(item).get("city")))
+
+    def stage_finished(self, stage, duration, size=None, count=None, city=None):
+        registry = self.registry
+        registry.observe("stage_seconds", duration, stage=stage)
+        if size is not None:
+            registry.observe("stage_bytes", size, buckets=SIZE_BUCKETS, stage=stage)
+        if count is not None:
+            registry.inc("stage_items_total", count, **self._labels(stage=stage, city=city))
+
+    def image_failed(self, url, reason, city=None):
+        self.registry.inc("image_failures_total", **self._labels(reason=reason, city=city))
+
+    def summary(self):
+        """Return the metrics with crawl-wide rates as plain data."""
+        elapsed = monotonic() - self.started if self.started is not None else 0.0
+        items = sum(value for (name, _), value in self.registry.counters.items() if name == "items_total")
+        summary = {
+            "elapsed_seconds": elapsed,
+            "items": items,
+            "items_per_second": items / elapsed if elapsed else 0.0,
+        }
+        summary.update(self.registry.to_dict())
+        return summary
+
+    def _labels(self, city=None, **labels):
+        if self.per_city and city is not None:
+            labels["city"] = city
+        return labels
+
+
+class MetricsResource(Resource):
+    """Serve a metrics registry in the Prometheus text format."""
+
+    isLeaf = True
+
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.registry.to_prometheus().encode("utf-8")
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.2f}"
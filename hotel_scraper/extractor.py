@@ -0,0 +1,156 @@
+"""Extract the ``window.IBU_HOTEL`` payload embedded in Trip.com pages.
+
+The payload is found by scanning the raw response bytes, so no DOM is
+built. The end of the object is located by a JSON decoder rather than a
+regex, which means a ``};`` inside a string value no longer truncates it.
+
+When msgspec is installed, the payload is decoded against a schema that
+only describes the subtrees the spider reads; everything else is skipped
+without being materialized. orjson is used for a fast full decode when
+only it is available, and the standard library otherwise.
+"""
+
+import json
+from typing import Any, List, TypedDict
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+MARKER = b"window.IBU_HOTEL"
+SCRIPT_END = b"</script>"
+
+_decoder = json.JSONDecoder()
+
+
+class _City(TypedDict, total=False):
+    name: Any
+    id: Any
+
+
+class _HtlsData(TypedDict, total=False):
+    inboundCities: List[_City]
+
+
+class _HomepageInitData(TypedDict, total=False):
+    htlsData: _HtlsData
+
+
+class HomepageSchema(TypedDict, total=False):
+    """Fields of the homepage payload used to list the cities."""
+    initData: _HomepageInitData
+
+
+class _HotelBasicInfo(TypedDict, total=False):
+    hotelName: Any
+    hotelId: Any
+    price: Any
+    hotelImg: Any
+
+
+class _CommentInfo(TypedDict, total=False):
+    commentScore: Any
+
+
+class _PositionInfo(TypedDict, total=False):
+    positionName: Any
+    coordinate: Any
+    cityName: Any
+
+
+class _RoomInfo(TypedDict, total=False):
+    physicalRoomName: Any
+
+
+class _Hotel(TypedDict, total=False):
+    hotelBasicInfo: _HotelBasicInfo
+    commentInfo: _CommentInfo
+    positionInfo: _PositionInfo
+    roomInfo: _RoomInfo
+
+
+class _FirstPageList(TypedDict, total=False):
+    hotelList: List[_Hotel]
+
+
+class _HotelListInitData(TypedDict, total=False):
+    firstPageList: _FirstPageList
+
+
+class HotelListSchema(TypedDict, total=False):
+    """Fields of a hotel list page payload used to build hotel items."""
+    initData: _HotelListInitData
+
+
+if msgspec is not None:
+    _typed_decoders = {
+        schema: msgspec.json.Decoder(schema) for schema in (HomepageSchema, HotelListSchema)
+    }
+else:
+    _typed_decoders = {}
+
+
+def find_payload(body):
+    """Return ``(start, end)`` offsets of the payload candidate in ``body``.
+
+    ``start`` is the offset of the opening brace and ``end`` the end of the
+    enclosing ``<script>`` element, or ``None`` if there is no payload.
+    """
+    marker = body.find(MARKER)
+    while marker != -1:
+        after = marker + len(MARKER)
+        start = body.find(b"{", after)
+        if start == -1:
+            return None
+        # Only whitespace and the assignment may separate the marker and the object
+        if body[after:start].strip() == b"=":
+            end = body.find(SCRIPT_END, start)
+            if end == -1:
+                end = len(body)
+            return start, end
+        marker = body.find(MARKER, after)
+    return None
+
+
+def extract_ibu_hotel(body, schema=None, bounds=None):
+    """Decode the ``window.IBU_HOTEL`` object from a raw response body.
+
+    ``body`` is the response body as bytes. With a ``schema`` such as
+    ``HotelListSchema`` and msgspec installed, only the fields described by
+    the schema are decoded. ``bounds`` can pass in the result of an earlier
+    ``find_payload`` call. Returns ``None`` when the page has no payload or
+    it cannot be decoded.
+    """
+    if bounds is None:
+        bounds = find_payload(body)
+    if bounds is None:
+        return None
+    start, end = bounds
+    candidate = body[start:end]
+
+    # The object is usually the last statement of its script, so try the
+    # fast decoders on it directly before falling back to raw_decode
+    exact = candidate.rstrip().rstrip(b";").rstrip()
+    typed_decoder = _typed_decoders.get(schema)
+    if typed_decoder is not None:
+        try:
+            return typed_decoder.decode(exact)
+        except (msgspec.DecodeError, msgspec.ValidationError):
+            pass
+    elif orjson is not None:
+        try:
+            return orjson.loads(exact)
+        except orjson.JSONDecodeError:
+            pass
+
+    try:
+        data, _ = _decoder.raw_decode(candidate.decode("utf-8", errors="replace"))
+    except ValueError:
+        return None
+    return data
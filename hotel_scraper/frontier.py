@@ -0,0 +1,211 @@
+"""Database-backed crawl frontier shared by several scraper processes.
+
+Work is split into units of one hotel list page of one city. Workers claim
+pending units with ``SELECT ... FOR UPDATE SKIP LOCKED`` on Postgres, so
+concurrent claims never block on or return the same rows, and hold them
+under a lease. A unit whose lease runs out, e.g. because its worker died,
+becomes claimable again until it has used up its attempts.
+
+SQLite has no row locks; there each claim is confirmed with a conditional
+update instead, which is enough for tests and single-host runs.
+"""
+
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from hotel_scraper.models import CrawlUnit
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Frontier:
+    """Claim, complete and retry the work units of one crawl."""
+
+    def __init__(self, engine, crawl, worker_id=None, lease_seconds=600, max_attempts=3):
+        self.engine = engine
+        self.crawl = crawl
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.table = CrawlUnit.__table__
+
+    def seed(self, cities):
+        """Add the first page of every city; units that exist are kept."""
+        rows = [
+            {"crawl": self.crawl, "city_id": str(city["id"]), "city_name": city["name"], "page": 1}
+            for city in cities
+        ]
+        with self.engine.begin() as connection:
+            return self._insert_missing(connection, rows)
+
+    def claim(self, limit):
+        """Lease up to ``limit`` units to this worker.
+
+        Returns the claimed units as dicts, in page then id order, so the
+        first page of every city is handed out before deeper pages.
+        """
+        now = datetime.now(timezone.utc)
+        table = self.table
+        claimable = and_(
+            table.c.crawl == self.crawl,
+            table.c.attempts < self.max_attempts,
+            or_(
+                table.c.status == PENDING,
+                and_(table.c.status == LEASED, table.c.lease_expires_at < now),
+            ),
+        )
+        query = (
+            select(table.c.id, table.c.city_id, table.c.city_name, table.c.page, table.c.attempts)
+            .where(claimable)
+            .order_by(table.c.page, table.c.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        lease = {
+            "status": LEASED,
+            "attempts": table.c.attempts + 1,
+            "leased_by": self.worker_id,
+            "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+            "updated_at": now,
+        }
+        claimed = []
+        with self.engine.begin() as connection:
+            # Leases that ran out on their last attempt are not retried
+            connection.execute(
+                update(table)
+                .where(and_(
+                    table.c.crawl == self.crawl,
+                    table.c.status == LEASED,
+                    table.c.lease_expires_at < now,
+                    table.c.attempts >= self.max_attempts,
+                ))
+                .values(status=FAILED, lease_expires_at=None, updated_at=now)
+            )
+            for row in connection.execute(query).all():
+                # Re-checking the condition keeps claims exclusive without row locks
+                result = connection.execute(
+                    update(table).where(and_(table.c.id == row.id, claimable)).values(**lease)
+                )
+                if result.rowcount:
+                    unit = row._asdict()
+                    unit["attempts"] += 1
+                    claimed.append(unit)
+        return claimed
+
+    def complete(self, unit_id, next_page=None):
+        """Mark a unit done, adding the city's next page if there is one.
+
+        The next page is leased straight to this worker and returned, as
+        with ``extend``. Both happen in one transaction, so the next page
+        can't be lost in between. Returns None when there is no next page
+        or it already existed.
+        """
+        now = datetime.now(timezone.utc)
+        table = self.table
+        with self.engine.begin() as connection:
+            next_unit = self._add_next(connection, unit_id, next_page, now) if next_page is not None else None
+            connection.execute(
+                update(table)
+                .where(and_(table.c.id == unit_id, table.c.leased_by == self.worker_id))
+                .values(status=DONE, lease_expires_at=None, updated_at=now)
+            )
+        return next_unit
+
+    def extend(self, unit_id, next_page):
+        """Add the city's next page of a unit that isn't done yet.
+
+        The next page is leased straight to this worker and returned, so a
+        city's pages stay on one worker while it is alive; if it dies, the
+        lease runs out and another worker picks the page up. The unit
+        itself stays leased until ``complete``, e.g. until its hotels are
+        stored. Returns None when the next page already existed.
+        """
+        with self.engine.begin() as connection:
+            return self._add_next(connection, unit_id, next_page, datetime.now(timezone.utc))
+
+    def fail(self, unit_id):
+        """Release a unit after a failed attempt.
+
+        It goes back to pending while it has attempts left and is marked
+        failed otherwise.
+        """
+        now = datetime.now(timezone.utc)
+        table = self.table
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(table)
+                .where(and_(table.c.id == unit_id, table.c.leased_by == self.worker_id))
+                .values(
+                    status=case((table.c.attempts >= self.max_attempts, FAILED), else_=PENDING),
+                    lease_expires_at=None,
+                    updated_at=now,
+                )
+            )
+
+    def outstanding(self):
+        """Return the number of units that are pending or leased."""
+        table = self.table
+        query = select(func.count()).where(
+            table.c.crawl == self.crawl,
+            or_(
+                and_(table.c.status == PENDING, table.c.attempts < self.max_attempts),
+                table.c.status == LEASED,
+            ),
+        )
+        with self.engine.connect() as connection:
+            return connection.execute(query).scalar_one()
+
+    def counts(self):
+        """Return the number of units of the crawl in each status."""
+        table = self.table
+        query = (
+            select(table.c.status, func.count())
+            .where(table.c.crawl == self.crawl)
+            .group_by(table.c.status)
+        )
+        with self.engine.connect() as connection:
+            return dict(connection.execute(query).all())
+
+    def _add_next(self, connection, unit_id, next_page, now):
+        table = self.table
+        unit = connection.execute(
+            select(table.c.city_id, table.c.city_name).where(table.c.id == unit_id)
+        ).one()
+        row = {
+            "crawl": self.crawl, "city_id": unit.city_id,
+            "city_name": unit.city_name, "page": next_page,
+            "status": LEASED, "attempts": 1, "leased_by": self.worker_id,
+            "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+        }
+        if not self._insert_missing(connection, [row]):
+            return None
+        return connection.execute(
+            select(table.c.id, table.c.city_id, table.c.city_name, table.c.page, table.c.attempts)
+            .where(table.c.crawl == self.crawl, table.c.city_id == unit.city_id, table.c.page == next_page)
+        ).one()._asdict()
+
+    def _insert_missing(self, connection, rows):
+        if not rows:
+            return 0
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            row.setdefault("status", PENDING)
+            row.setdefault("attempts", 0)
+            row["updated_at"] = now
+        if connection.dialect.name == "postgresql":
+            statement = postgresql.insert(self.table)
+        else:
+            statement = sqlite.insert(self.table)
+        statement = statement.on_conflict_do_nothing(index_elements=["crawl", "city_id", "page"])
+        return connection.execute(statement, rows).rowcount
@@ -0,0 +1,202 @@
+"""Geohash cells and nearby-hotel queries.
+
+Every hotel with coordinates stores the geohash of its location in the
+``geohash`` column, filled in by the database pipeline, with a composite
+index on ``(geohash, latitude, longitude)``. Hotels in a geohash cell share
+its hash as a prefix, so the hotels in a cell are one range scan of the
+index. Queries cover the search area with a handful of cells, fetch the
+hotels in them, and compute exact distances with NumPy::
+
+    from hotel_scraper.geo import nearby, in_bbox
+
+    nearby(51.5074, -0.1278, radius_km=2, limit=10)
+    in_bbox(south=51.49, west=-0.15, north=51.52, east=-0.10)
+
+Nearby queries require NumPy.
+"""
+
+import math
+
+from sqlalchemy import and_, func, or_, select
+
+from hotel_scraper.database import get_engine
+from hotel_scraper.models import Hotel
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # About 5 x 5 m
+EARTH_RADIUS_KM = 6371.0088
+# Cells covering a search area at most, the finest precision within this wins
+MAX_CELLS = 16
+# Sorts after every geohash character, for prefix range scans
+PREFIX_END = "~"
+
+RESULT_COLUMNS = ("id", "property_id", "name", "city_name", "rating", "price", "latitude", "longitude")
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Return the geohash of a location, or None without coordinates."""
+    if latitude is None or longitude is None:
+        return None
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits = bits * 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def encode_geohashes(latitudes, longitudes, precision=GEOHASH_PRECISION):
+    """Return the geohashes of arrays of locations as a NumPy string array.
+
+    The vectorized equivalent of ``encode_geohash``, for bulk loads.
+    """
+    lat_bits, lng_bits = 5 * precision // 2, (5 * precision + 1) // 2
+    lat_cells = _quantize(latitudes, -90.0, 180.0, lat_bits)
+    lng_cells = _quantize(longitudes, -180.0, 360.0, lng_bits)
+    # Interleave the bits, longitude first, most significant first
+    codes = np.zeros(len(lat_cells), dtype=np.uint64)
+    for bit in range(5 * precision):
+        cells, bits = (lng_cells, lng_bits) if bit % 2 == 0 else (lat_cells, lat_bits)
+        codes = (codes << np.uint64(1)) | ((cells >> np.uint64(bits - 1 - bit // 2)) & np.uint64(1))
+    alphabet = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+    chars = alphabet[((codes[:, None] >> shifts) & np.uint64(31)).astype(np.intp)]
+    return np.ascontiguousarray(chars).view(f"S{precision}").ravel().astype(str)
+
+
+def _quantize(values, origin, span, bits):
+    cells = np.floor((np.asarray(values, dtype=float) - origin) / span * 2 ** bits)
+    return np.clip(cells, 0, 2 ** bits - 1).astype(np.uint64)
+
+
+def cell_size(precision):
+    """Return the (height, width) of a geohash cell of a precision in degrees."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def cover_bbox(south, west, north, east, max_cells=MAX_CELLS):
+    """Return geohash prefixes of cells that together cover a bounding box.
+
+    Uses the finest precision that needs at most ``max_cells`` cells. A box
+    with ``west > east`` crosses the antimeridian.
+    """
+    if west > east:
+        return cover_bbox(south, west, north, 180.0, max_cells) + cover_bbox(south, -180.0, north, east, max_cells)
+    south, north = max(south, -90.0), min(north, 90.0)
+    west, east = max(west, -180.0), min(east, 180.0)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = range(_cell_index(south, -90.0, height, 180.0), _cell_index(north, -90.0, height, 180.0) + 1)
+        cols = range(_cell_index(west, -180.0, width, 360.0), _cell_index(east, -180.0, width, 360.0) + 1)
+        if len(rows) * len(cols) <= max_cells or precision == 1:
+            return [
+                encode_geohash(-90.0 + (row + 0.5) * height, -180.0 + (col + 0.5) * width, precision)
+                for row in rows
+                for col in cols
+            ]
+
+
+def _cell_index(value, origin, size, span):
+    # The top and right edges belong to the last cell
+    return min(int((value - origin) // size), int(span / size) - 1)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Return the distances in km from a location to arrays of locations."""
+    lat1, lng1 = math.radians(latitude), math.radians(longitude)
+    lat2, lng2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Return the (south, west, north, east) box around a circle on the sphere."""
+    angle = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angle)
+    south, north = latitude - delta_lat, latitude + delta_lat
+    if south <= -90.0 or north >= 90.0:
+        # The circle contains a pole, so it spans every longitude
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    delta_lng = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+    west, east = longitude - delta_lng, longitude + delta_lng
+    if delta_lng >= 180.0:
+        return south, -180.0, north, 180.0
+    return south, _wrap(west), north, _wrap(east)
+
+
+def _wrap(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def nearby(latitude, longitude, radius_km=5.0, limit=20, engine=None):
+    """Return hotels within ``radius_km`` of a location, nearest first.
+
+    Each hotel is a dict of ``RESULT_COLUMNS`` and its ``distance_km``.
+    Retired hotels are left out.
+    """
+    if np is None:
+        raise RuntimeError("Nearby queries require NumPy")
+    south, west, north, east = radius_bbox(latitude, longitude, radius_km)
+    candidates = _fetch(engine, south, west, north, east)
+    if not candidates:
+        return []
+    coordinates = np.array([(row.latitude, row.longitude) for row in candidates], dtype=float)
+    distances = haversine_km(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+    inside = np.flatnonzero(distances <= radius_km)
+    if limit is not None and len(inside) > limit:
+        # Only the nearest ``limit`` need sorting
+        inside = inside[np.argpartition(distances[inside], limit - 1)[:limit]]
+    inside = inside[np.argsort(distances[inside], kind="stable")]
+    return [dict(zip(RESULT_COLUMNS, candidates[i]), distance_km=float(distances[i])) for i in inside]
+
+
+def in_bbox(south, west, north, east, limit=None, engine=None):
+    """Return hotels inside a bounding box, in no particular order.
+
+    Each hotel is a dict of ``RESULT_COLUMNS``. A box with ``west > east``
+    crosses the antimeridian.
+    """
+    return [dict(zip(RESULT_COLUMNS, row)) for row in _fetch(engine, south, west, north, east, limit)]
+
+
+def _fetch(engine, south, west, north, east, limit=None):
+    """Fetch the hotels of the cells covering a box, filtered to the box."""
+    engine = engine if engine is not None else get_engine()
+    hotels = Hotel.__table__
+    cells = or_(*(
+        and_(hotels.c.geohash >= prefix, hotels.c.geohash < prefix + PREFIX_END)
+        for prefix in sorted(set(cover_bbox(south, west, north, east)))
+    ))
+    if west <= east:
+        longitude = hotels.c.longitude.between(west, east)
+    else:
+        longitude = or_(hotels.c.longitude >= west, hotels.c.longitude <= east)
+    query = (
+        select(*(hotels.c[name] for name in RESULT_COLUMNS))
+        .where(cells, hotels.c.latitude.between(south, north), longitude)
+        .where(func.coalesce(hotels.c.retired, False).is_(False))
+        # No ORDER BY, which tempts the planner into scanning the whole index in order
+        .limit(limit)
+    )
+    with engine.connect() as connection:
+        return connection.execute(query).all()
@@ -0,0 +1,230 @@
+"""HTTP cache storage, policy and middleware for the hotel crawls.
+
+Responses are kept in a single SQLite file per spider, keyed by request
+fingerprint, with compressed bodies and a bounded total size. Freshness is
+set per URL pattern with ``HTTPCACHE_TTL_PATTERNS`` and stale responses are
+revalidated with ``If-None-Match``/``If-Modified-Since``.
+
+Enable with:
+    HTTPCACHE_ENABLED = True
+    HTTPCACHE_STORAGE = "hotel_scraper.httpcache.SqliteCacheStorage"
+    HTTPCACHE_POLICY = "hotel_scraper.httpcache.PatternTTLPolicy"
+and replace Scrapy's HttpCacheMiddleware with RevalidatingHttpCacheMiddleware.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import zlib
+from time import time
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Headers a 304 response refreshes on the stored response
+REVALIDATED_HEADERS = (b"Date", b"Expires", b"Cache-Control", b"ETag", b"Last-Modified", b"Age")
+
+
+class PatternTTLPolicy(RFC2616Policy):
+    """RFC 2616 policy with explicit lifetimes for matching URLs.
+
+    ``HTTPCACHE_TTL_PATTERNS`` maps URL regexes to a lifetime in seconds,
+    where 0 caches the response indefinitely. The first matching pattern
+    wins and overrides the server's caching headers, except ``no-store``.
+    The age of a matching response is measured from when it was stored,
+    which the storage notes in the request's ``cache_stored_at`` meta key,
+    so responses without a ``Date`` header expire too. URLs matching no
+    pattern follow the plain RFC 2616 rules.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttl_patterns = [
+            (re.compile(pattern), int(ttl))
+            for pattern, ttl in settings.getdict("HTTPCACHE_TTL_PATTERNS").items()
+        ]
+        self.ignore_http_codes = [int(code) for code in settings.getlist("HTTPCACHE_IGNORE_HTTP_CODES")]
+
+    def ttl_for(self, url):
+        """Return the configured lifetime for a URL, or None if unmatched."""
+        for pattern, ttl in self.ttl_patterns:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def should_cache_response(self, response, request):
+        if response.status in self.ignore_http_codes:
+            return False
+        if self.ttl_for(request.url) is None:
+            return super().should_cache_response(response, request)
+        if b"no-store" in self._parse_cachecontrol(response):
+            return False
+        return response.status == 200
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        ttl = self.ttl_for(request.url)
+        if ttl is None:
+            return super().is_cached_response_fresh(cachedresponse, request)
+        if ttl == 0:
+            return True
+        if self.current_age(cachedresponse, request) < ttl:
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+    def current_age(self, cachedresponse, request):
+        """Return the seconds since a cached response was stored or revalidated."""
+        now = time()
+        stored_at = request.meta.get("cache_stored_at")
+        if stored_at is not None:
+            return max(0, now - stored_at)
+        if b"Date" in cachedresponse.headers:
+            return self._compute_current_age(cachedresponse, request, now)
+        # Storages that don't record it give no way to tell; treat it as stale
+        return float("inf")
+
+
+class RevalidatingHttpCacheMiddleware(HttpCacheMiddleware):
+    """HttpCacheMiddleware that refreshes entries a 304 has revalidated.
+
+    Without this, a revalidated response keeps its original age and every
+    later request for it goes back to the server.
+    """
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get("cached_response")
+        result = super().process_response(request, response, spider)
+        if result is cachedresponse and response.status == 304 and hasattr(self.storage, "refresh_response"):
+            self.storage.refresh_response(spider, request, response)
+        return result
+
+
+class SqliteCacheStorage:
+    """Cache storage keeping every response of a spider in one SQLite file.
+
+    Bodies are compressed with zstd when ``HTTPCACHE_COMPRESSION`` is
+    ``"zstd"`` and zstandard is installed, and with gzip's deflate
+    otherwise. Once the stored bodies exceed ``HTTPCACHE_MAX_SIZE`` bytes,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.max_size = settings.getint("HTTPCACHE_MAX_SIZE", 1024 ** 3)
+        self.level = settings.getint("HTTPCACHE_COMPRESSION_LEVEL", 6)
+        codec = settings.get("HTTPCACHE_COMPRESSION", "gzip")
+        self.codec = "zstd" if codec == "zstd" and zstandard is not None else "gzip"
+        self.db = None
+        self.size = 0
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cachedir, f"{spider.name}.sqlite3")
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " fingerprint TEXT PRIMARY KEY, url TEXT, status INTEGER, headers BLOB,"
+            " body BLOB, codec TEXT, size INTEGER, stored_at REAL, accessed_at REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        logger.debug("Using SQLite cache storage in %(path)s", {"path": path}, extra={"spider": spider})
+
+    def close_spider(self, spider):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def retrieve_response(self, spider, request):
+        """Return response if present in cache, or None otherwise.
+
+        When it was stored is noted in the request's ``cache_stored_at`` meta
+        key, for the policy to tell its age.
+        """
+        key = self._key(request)
+        row = self.db.execute(
+            "SELECT url, status, headers, body, codec, stored_at FROM responses WHERE fingerprint = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None  # not cached
+        url, status, rawheaders, body, codec, stored_at = row
+        if 0 < self.expiration_secs < time() - stored_at:
+            return None  # expired
+        self.db.execute("UPDATE responses SET accessed_at = ? WHERE fingerprint = ?", (time(), key))
+        request.meta["cache_stored_at"] = stored_at
+        body = self._decompress(body, codec)
+        headers = Headers(headers_raw_to_dict(rawheaders))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache."""
+        key = self._key(request)
+        body = self._compress(response.body)
+        now = time()
+        old = self.db.execute("SELECT size FROM responses WHERE fingerprint = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, response.url, response.status, headers_dict_to_raw(response.headers),
+             body, self.codec, len(body), now, now),
+        )
+        self.size += len(body) - (old[0] if old else 0)
+        if self.size > self.max_size:
+            self.evict()
+
+    def refresh_response(self, spider, request, response):
+        """Merge the headers of a 304 into the stored response."""
+        key = self._key(request)
+        row = self.db.execute("SELECT headers FROM responses WHERE fingerprint = ?", (key,)).fetchone()
+        if row is None:
+            return
+        headers = Headers(headers_raw_to_dict(row[0]))
+        for name in REVALIDATED_HEADERS:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        self.db.execute(
+            "UPDATE responses SET headers = ?, stored_at = ? WHERE fingerprint = ?",
+            (headers_dict_to_raw(headers), time(), key),
+        )
+
+    def evict(self):
+        """Drop least recently used responses until 90% of the size limit."""
+        target = self.max_size * 0.9
+        rows = self.db.execute("SELECT fingerprint, size FROM responses ORDER BY accessed_at")
+        evicted = []
+        for fingerprint, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((fingerprint,))
+            self.size -= size
+        self.db.executemany("DELETE FROM responses WHERE fingerprint = ?", evicted)
+        logger.debug("Evicted %(count)d responses from the HTTP cache", {"count": len(evicted)})
+
+    def _key(self, request):
+        return self._fingerprinter.fingerprint(request).hex()
+
+    def _compress(self, body):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(body)
+        return zlib.compress(body, self.level)
+
+    def _decompress(self, body, codec):
+        if codec == "zstd":
+            return zstandard.ZstdDecompressor().decompress(body)
+        return zlib.decompress(body)
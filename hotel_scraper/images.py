@@ -0,0 +1,149 @@
+"""Validate, clean and store downloaded hotel images.
+
+Images are stored by content: each file is named by the SHA-256 of the
+downloaded body and sharded into two directory levels by its first four
+hex digits, e.g. ``images/3f/a2/3fa2....jpg``. Identical images shared by
+several hotels or URLs are stored once, and no directory grows beyond a
+few hundred entries.
+
+``store_image`` runs in a worker process of the image pipeline when
+post-processing is enabled. It decodes the whole image before anything is
+written, so truncated bodies and error pages served with a 200 never end
+up on disk. The original is stored without its EXIF and other metadata,
+along with the configured thumbnails and an optional WebP copy.
+
+Post-processing requires Pillow; without it images are stored as downloaded.
+"""
+
+import hashlib
+import io
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+
+ORIENTATION = 0x0112  # EXIF tag of the camera orientation
+
+
+class InvalidImage(ValueError):
+    """The downloaded body is not an image that can be decoded."""
+
+
+def content_path(images_dir, digest, extension=".jpg"):
+    """Return the sharded store path of the image with a SHA-256 hex digest."""
+    return os.path.join(images_dir, digest[:2], digest[2:4], digest + extension)
+
+
+def variant_path(images_dir, path, kind, extension=".jpg"):
+    """Return where a variant of the image at ``path`` is stored.
+
+    Variants mirror the sharded layout of the originals under
+    ``<images_dir>/<kind>``, e.g. ``images/thumbs/small/3f/a2/3fa2....jpg``.
+    """
+    relative = os.path.relpath(path, images_dir)
+    return os.path.join(images_dir, kind, os.path.splitext(relative)[0] + extension)
+
+
+def store_image(body, images_dir, thumbs=None, webp_quality=None, postprocess=False):
+    """Store a downloaded image body under its content hash.
+
+    Returns a dict with the ``sha256`` of the body, the stored ``path``,
+    and, when post-processed, the image ``width``, ``height`` and
+    ``variants`` as returned by ``process_image``. A body that is already
+    stored is not written again.
+    """
+    digest = hashlib.sha256(body).hexdigest()
+    path = content_path(images_dir, digest)
+    if not postprocess:
+        if not os.path.exists(path):
+            _write(path, body)
+        info = {"path": path, "width": None, "height": None, "variants": None}
+    elif os.path.exists(path):
+        info = stored_info(path, images_dir, thumbs, webp_quality)
+    else:
+        info = process_image(body, path, images_dir, thumbs, webp_quality)
+    info["sha256"] = digest
+    return info
+
+
+def stored_info(path, images_dir, thumbs=None, webp_quality=None):
+    """Describe an image post-processed before, reading only its header."""
+    with Image.open(path) as image:
+        width, height = image.size
+    variants = {name: variant_path(images_dir, path, f"thumbs/{name}") for name in thumbs or {}}
+    if webp_quality:
+        variants["webp"] = variant_path(images_dir, path, "webp", ".webp")
+    return {"path": path, "width": width, "height": height, "variants": variants}
+
+
+def process_image(body, path, images_dir, thumbs=None, webp_quality=None):
+    """Decode ``body`` and store it at ``path`` with its variants.
+
+    ``thumbs`` maps thumbnail names to the ``(width, height)`` box they are
+    fitted in, and a ``webp_quality`` adds a full size WebP copy. Returns a
+    dict with the stored ``path``, the image ``width`` and ``height``, and
+    the ``variants`` paths by name. Raises InvalidImage if the body can't be
+    decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(body)) as probe:
+            probe.verify()
+        image = Image.open(io.BytesIO(body))
+        image.load()
+    except Exception as e:
+        raise InvalidImage(f"{type(e).__name__}: {e}") from None
+
+    icc_profile = image.info.get("icc_profile")
+    upright = image.getexif().get(ORIENTATION, 1) in (0, 1)
+    oriented = image if upright else ImageOps.exif_transpose(image)
+    if image.format == "JPEG" and upright:
+        # Rewrite with the original quantization tables, so nothing is lost but metadata
+        original, params = image, {"quality": "keep", "subsampling": "keep"}
+    else:
+        original, params = _to_rgb(oriented), {"quality": 90}
+    if icc_profile:
+        params["icc_profile"] = icc_profile
+    # Pillow copies a JPEG comment over unless it is overridden
+    _save(original, path, "JPEG", comment=b"", **params)
+
+    variants = {}
+    for name, size in (thumbs or {}).items():
+        thumb = _to_rgb(oriented).copy()
+        thumb.thumbnail(tuple(size))
+        variants[name] = _save(thumb, variant_path(images_dir, path, f"thumbs/{name}"), "JPEG", quality=85)
+    if webp_quality:
+        webp = oriented if oriented.mode in ("RGB", "RGBA") else _to_rgb(oriented)
+        variants["webp"] = _save(webp, variant_path(images_dir, path, "webp", ".webp"), "WEBP", quality=webp_quality)
+
+    width, height = oriented.size
+    return {"path": path, "width": width, "height": height, "variants": variants}
+
+
+def _to_rgb(image):
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def _tmp_path(path):
+    # Workers may store the same image at once, so each writes its own file
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+
+def _write(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _save(image, path, image_format, **params):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    image.save(tmp_path, image_format, **params)
+    os.replace(tmp_path, path)
+    return path
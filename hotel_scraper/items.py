@@ -3,10 +3,105 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+from typing import Optional
+
+import attr
 import scrapy
+from itemadapter import ItemAdapter
+
+# Placeholders the site and older item sources use for a missing value
+MISSING = ("N/A", "", None)
+
+
+def optional_str(value):
+    """Return a string, or None for a missing value."""
+    return None if value in MISSING else str(value)
+
+
+def optional_float(value):
+    """Return a float, or None for a missing value; raise ValueError on garbage."""
+    return None if value in MISSING else float(value)
+
+
+def optional_int(value):
+    """Return an int, or None for a missing value; raise ValueError on garbage."""
+    return None if value in MISSING else int(value)
+
+
+@attr.s(slots=True, auto_attribs=True, on_setattr=attr.setters.convert)
+class HotelItem:
+    """A scraped hotel with its fields normalized once, when it is built.
+
+    Missing values, such as the site's ``"N/A"``, become None, ids ints and
+    prices, ratings and coordinates floats, so pipelines use the values as
+    they are. A value that can't be converted raises ValueError. Fields
+    assigned later, like the ``image_*`` fields the image pipeline fills in,
+    are converted too. Instances are slotted, holding much less memory than
+    a dict while items wait in the pipelines.
+
+    ``list_page`` is the ``(city id, page, position)`` of the hotel on the
+    hotel list page it was scraped from, for the crawl checkpoint and
+    frontier to follow each of a page's hotels through the pipelines.
+    """
+
+    property_title: Optional[str] = attr.ib(default=None, converter=optional_str)
+    property_id: Optional[int] = attr.ib(default=None, converter=optional_int)
+    rating: Optional[float] = attr.ib(default=None, converter=optional_float)
+    location: Optional[str] = attr.ib(default=None, converter=optional_str)
+    latitude: Optional[float] = attr.ib(default=None, converter=optional_float)
+    longitude: Optional[float] = attr.ib(default=None, converter=optional_float)
+    room_type: Optional[str] = attr.ib(default=None, converter=optional_str)
+    price: Optional[float] = attr.ib(default=None, converter=optional_float)
+    image_url: Optional[str] = attr.ib(default=None, converter=optional_str)
+    city_name: Optional[str] = attr.ib(default=None, converter=optional_str)  # City in the listing
+    city: Optional[str] = attr.ib(default=None, converter=optional_str)  # City crawled, which owns the row
+    image_path: Optional[str] = attr.ib(default=None, converter=optional_str)
+    image_sha256: Optional[str] = attr.ib(default=None, converter=optional_str)
+    image_width: Optional[int] = attr.ib(default=None, converter=optional_int)
+    image_height: Optional[int] = attr.ib(default=None, converter=optional_int)
+    image_variants: Optional[dict] = None  # Paths of the thumbnails and WebP copy by name
+    list_page: Optional[tuple] = None
+
+    @classmethod
+    def from_item(cls, item):
+        """Return any item as a ``HotelItem``, normalizing it unless it is one."""
+        if isinstance(item, cls):
+            return item
+        return cls(**{name: value for name, value in ItemAdapter(item).items() if name in HOTEL_FIELDS})
+
+
+HOTEL_FIELDS = frozenset(field.name for field in attr.fields(HotelItem))
+
+
+def list_page(item):
+    """Return the ``(city id, page)`` an item was scraped from, or None."""
+    page = ItemAdapter(item).get("list_page")
+    return None if page is None else (str(page[0]), int(page[1]))
+
+
+def list_position(item):
+    """Return the position of an item on the page it was scraped from, or None."""
+    page = ItemAdapter(item).get("list_page")
+    return None if page is None or len(page) < 3 else int(page[2])
 
 
 class HotelScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    """The fields of ``HotelItem`` as a ``scrapy.Item``, values as given."""
+
+    property_title = scrapy.Field()
+    property_id = scrapy.Field()
+    rating = scrapy.Field()
+    location = scrapy.Field()
+    latitude = scrapy.Field()
+    longitude = scrapy.Field()
+    room_type = scrapy.Field()
+    price = scrapy.Field()
+    image_url = scrapy.Field()
+    city_name = scrapy.Field()
+    city = scrapy.Field()
+    image_path = scrapy.Field()
+    image_sha256 = scrapy.Field()
+    image_width = scrapy.Field()
+    image_height = scrapy.Field()
+    image_variants = scrapy.Field()
+    list_page = scrapy.Field()
@@ -0,0 +1,139 @@
+"""Counters and histograms for the crawl metrics.
+
+A small in-process registry rendered in the Prometheus text format for the
+``/metrics`` endpoint and as a JSON summary. Histograms use fixed buckets,
+so observing a value is a bisect and an increment; quantiles in the summary
+are interpolated within buckets.
+"""
+
+from bisect import bisect_left
+
+# Seconds, from a fast decode up to a slow download
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes, from 1 KiB to 64 MiB in powers of four
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Named counters and histograms, each with a set of labels."""
+
+    def __init__(self, prefix="hotel_scraper_"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def counter_value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, series in _grouped(self.counters):
+            lines.extend(self._header(name, "counter"))
+            for labels, value in series:
+                lines.append(f"{self.prefix}{name}{_labels(labels)} {_number(value)}")
+        for name, series in _grouped(self.histograms):
+            lines.extend(self._header(name, "histogram"))
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{self.prefix}{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{self.prefix}{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+                lines.append(f"{self.prefix}{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Return the counters and histogram summaries as plain data."""
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            "histograms": [
+                dict({"name": name, "labels": dict(labels)}, **histogram.summary())
+                for (name, labels), histogram in sorted(self.histograms.items(), key=lambda entry: entry[0])
+            ],
+        }
+
+    def _header(self, name, kind):
+        if name in self.help:
+            yield f"# HELP {self.prefix}{name} {self.help[name]}"
+        yield f"# TYPE {self.prefix}{name} {kind}"
+
+
+def _grouped(metrics):
+    names = {}
+    for (name, labels), value in sorted(metrics.items(), key=lambda entry: entry[0]):
+        names.setdefault(name, []).append((labels, value))
+    return names.items()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -3,11 +3,24 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import cProfile
+import os
+import pstats
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import perf_counter
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.misc import load_object
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from hotel_scraper.profiling import collapsed_stacks, hotspot_report, write_collapsed
+
 
 class HotelScraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -56,48 +69,323 @@ class HotelScraperSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
+class CallbackProfilerMiddleware:
+    """Profile a sample of spider callback invocations with cProfile.
+
+    Each response is profiled with probability ``PROFILING_SAMPLE_RATE``,
+    for as long as its callback runs to produce the next request or item;
+    the time Scrapy and the pipelines spend between those is not included.
+    Profiles are aggregated per callback, and when the spider closes each
+    callback gets a ``.prof`` file for pstats/snakeviz and a ``.collapsed``
+    flame graph file in ``PROFILING_DIR``, plus a top-N hotspot report.
+    Enable it with ``PROFILING_ENABLED``; when disabled it is not installed
+    at all.
+    """
+
+    def __init__(self, directory="profiles", sample_rate=0.1, top=25, seed=None):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.top = top
+        self.random = random.Random(seed)
+        self.profiles = {}
+        self.calls = {}
+        self.sampled = {}
+        self.seconds = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROFILING_ENABLED"):
+            raise NotConfigured
+        s = cls(
+            directory=settings.get("PROFILING_DIR", "profiles"),
+            sample_rate=settings.getfloat("PROFILING_SAMPLE_RATE", 0.1),
+            top=settings.getint("PROFILING_TOP", 25),
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        callback = getattr(response.request, "callback", None) or spider.parse
+        name = getattr(callback, "__name__", repr(callback))
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.random.random() >= self.sample_rate:
+            return result
+        self.sampled[name] = self.sampled.get(name, 0) + 1
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        return self._profiled(result, profile, name)
+
+    def _profiled(self, result, profile, name):
+        iterator = iter(result)
+        while True:
+            started = perf_counter()
+            try:
+                profile.enable()
+            except ValueError:  # Another profiler is active, e.g. a debugger
+                yield from iterator
+                return
+            try:
+                output = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profile.disable()
+                self.seconds[name] = self.seconds.get(name, 0.0) + perf_counter() - started
+            yield output
+
+    def spider_closed(self, spider):
+        if not self.profiles:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        report = []
+        for name, profile in sorted(self.profiles.items()):
+            stats = pstats.Stats(profile)
+            prefix = os.path.join(self.directory, f"{spider.name}.{name}")
+            stats.dump_stats(f"{prefix}.prof")
+            write_collapsed(collapsed_stacks(stats.stats, root=name), f"{prefix}.collapsed")
+            sampled = self.sampled[name]
+            summary = (
+                f"{name}: {sampled} of {self.calls[name]} calls profiled, "
+                f"{self.seconds[name] * 1000 / sampled:.2f} ms per call"
+            )
+            spider.logger.info(f"Profiled {summary}")
+            report.append(f"=== {summary}\n\n{hotspot_report(stats, self.top)}")
+        report_file = os.path.join(self.directory, f"{spider.name}.hotspots.txt")
+        with open(report_file, "w") as f:
+            f.write("\n".join(report))
+        spider.logger.info(f"Callback profiles written to {self.directory}")
+
+
+def retry_after_seconds(value):
+    """Return the seconds a ``Retry-After`` header value asks to wait, or None."""
+    if not value:
+        return None
+    value = value.decode("latin-1") if isinstance(value, bytes) else value
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AimdThrottle:
+    """Additive-increase, multiplicative-decrease control of a kind of download.
+
+    After every round of ``concurrency`` successful responses faster than
+    ``target_latency``, the delay goes down by ``delay_step`` until it
+    reaches ``min_delay``, and then the concurrency goes up by one until it
+    reaches ``max_concurrency``. A rate limited or banned response, a
+    network error, or a latency over twice the target halves the
+    concurrency and doubles the delay, at most once per round so that the
+    responses to requests already sent don't back off again. A
+    ``Retry-After`` header raises the delay to at least what it asks for.
+    """
+
+    def __init__(self, concurrency=1, delay=0.0, min_delay=0.0, max_delay=60.0, max_concurrency=8,
+                 target_latency=2.0, delay_step=0.25, backoff_codes=(403, 429, 503), smoothing=0.3):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.delay_step = delay_step
+        self.backoff_codes = frozenset(backoff_codes)
+        self.smoothing = smoothing
+        # Moving average of the latency, in seconds
+        self.latency = None
+        self.successes = 0
+        self.since_backoff = 0
+        self.in_flight = 0
+        # Responses, rate_limited, banned, errors, backoffs and increases
+        self.counts = Counter()
+
+    def response(self, status, latency=None, retry_after=None):
+        """Feed a response; return whether the concurrency or delay changed."""
+        self.counts["responses"] += 1
+        self.since_backoff += 1
+        if latency is not None:
+            self.latency = latency if self.latency is None else \
+                self.latency + self.smoothing * (latency - self.latency)
+        if status in self.backoff_codes:
+            self.counts["banned" if status == 403 else "rate_limited"] += 1
+            return self.backoff(retry_after)
+        if self.latency is not None and self.latency > 2 * self.target_latency:
+            return self.backoff()
+        if self.latency is not None and self.latency > self.target_latency:
+            # Slow but coping: hold steady
+            self.successes = 0
+            return False
+        self.successes += 1
+        if self.successes < self.concurrency:
+            return False
+        self.successes = 0
+        return self.increase()
+
+    def error(self):
+        """Feed a network error, e.g. a timeout; return whether anything changed."""
+        self.counts["errors"] += 1
+        self.since_backoff += 1
+        return self.backoff()
+
+    def increase(self):
+        if self.delay > self.min_delay:
+            self.delay = max(self.min_delay, self.delay - self.delay_step)
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+        else:
+            return False
+        self.counts["increases"] += 1
+        return True
+
+    def backoff(self, retry_after=None):
+        self.successes = 0
+        changed = False
+        # Requests sent before the last backoff may still come back with errors
+        if self.since_backoff >= self.in_flight:
+            self.in_flight = self.concurrency
+            self.since_backoff = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, self.delay_step, self.min_delay))
+            self.counts["backoffs"] += 1
+            changed = True
+        if retry_after is not None and retry_after > self.delay:
+            self.delay = min(self.max_delay, retry_after)
+            changed = True
+        return changed
+
+
 class HotelScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Adapt download concurrency and delay to how well the site copes.
+
+    Every download slot has its own ``AimdThrottle``, fed with the latency
+    and status of every response and with network errors, and its
+    concurrency and delay are applied to that slot: the site's slot for
+    pages, one slot per proxy when pages go through the proxy pool, and
+    the ``images`` slot for the image CDN. A throttle is created with the
+    parameters of its kind of download, "html" or "image", when its slot
+    is first used. Pages start at ``DOWNLOAD_DELAY`` and
+    ``CONCURRENT_REQUESTS_PER_DOMAIN`` and images at their ``DOWNLOAD_SLOTS``
+    entry. The crawl stats under ``throttle/html/*`` and
+    ``throttle/image/*`` add up the slots of each kind: their total
+    concurrency, longest delay, average latency and counts. Cached
+    responses are ignored. Configure it with the ``THROTTLE_*`` settings; when
+    ``THROTTLE_ENABLED`` is off it is not installed at all.
+
+    It sits before the retry middleware, so it sees the responses and
+    errors that get retried.
+    """
+
+    def __init__(self, params=None, errors=(), stats=None, crawler=None):
+        # AimdThrottle arguments by kind of download, "html" or "image"; none adapts nothing
+        self.params = params or {}
+        # Throttles by kind, then by download slot
+        self.throttles = {kind: {} for kind in self.params}
+        self.errors = tuple(errors)
+        self.stats = stats
+        self.crawler = crawler
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        if not settings.getbool("THROTTLE_ENABLED"):
+            raise NotConfigured
+        images = settings.getdict("DOWNLOAD_SLOTS").get("images", {})
+        codes = settings.getlist("THROTTLE_BACKOFF_HTTP_CODES", [403, 429, 503])
+        common = {
+            "delay_step": settings.getfloat("THROTTLE_DELAY_STEP", 0.25),
+            "backoff_codes": [int(code) for code in codes],
+        }
+        params = {
+            "html": dict(
+                concurrency=settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"),
+                delay=settings.getfloat("DOWNLOAD_DELAY"),
+                min_delay=settings.getfloat("THROTTLE_HTML_MIN_DELAY", 0.5),
+                max_delay=settings.getfloat("THROTTLE_HTML_MAX_DELAY", 60),
+                max_concurrency=settings.getint("THROTTLE_HTML_MAX_CONCURRENCY", 4),
+                target_latency=settings.getfloat("THROTTLE_HTML_TARGET_LATENCY", 2.0),
+                **common,
+            ),
+            "image": dict(
+                concurrency=images.get("concurrency", settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN")),
+                delay=images.get("delay", settings.getfloat("DOWNLOAD_DELAY")),
+                min_delay=settings.getfloat("THROTTLE_IMAGE_MIN_DELAY", 0),
+                max_delay=settings.getfloat("THROTTLE_IMAGE_MAX_DELAY", 30),
+                max_concurrency=settings.getint("THROTTLE_IMAGE_MAX_CONCURRENCY", 16),
+                target_latency=settings.getfloat("THROTTLE_IMAGE_TARGET_LATENCY", 1.0),
+                **common,
+            ),
+        }
+        errors = [load_object(x) if isinstance(x, str) else x for x in settings.getlist("RETRY_EXCEPTIONS")]
+        s = cls(params, errors, crawler.stats, crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        if "cached" in response.flags or "download_latency" not in request.meta:
+            return response
+        kind = download_kind(request)
+        throttle = self.throttle_for(kind, request)
+        if throttle is not None:
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            changed = throttle.response(response.status, request.meta["download_latency"], retry_after)
+            self.update(kind, throttle, request, changed)
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        kind = download_kind(request)
+        throttle = self.throttle_for(kind, request)
+        if throttle is not None and isinstance(exception, self.errors):
+            self.update(kind, throttle, request, throttle.error())
+        return None
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def throttle_for(self, kind, request):
+        """Return the throttle of the request's download slot, or None if its kind isn't throttled."""
+        throttles = self.throttles.get(kind)
+        if throttles is None:
+            return None
+        # The downloader notes the slot of every request it fetched
+        key = request.meta.get("download_slot", kind)
+        if key not in throttles:
+            throttles[key] = AimdThrottle(**self.params[kind])
+        return throttles[key]
+
+    def update(self, kind, throttle, request, changed):
+        """Apply a throttle to the request's download slot and record its kind in the stats."""
+        engine = getattr(self.crawler, "engine", None)
+        slot = engine.downloader.slots.get(request.meta.get("download_slot")) if engine is not None else None
+        # Slots idle for a while are recreated with their initial settings
+        if slot is not None and (slot.concurrency, slot.delay) != (throttle.concurrency, throttle.delay):
+            slot.concurrency = throttle.concurrency
+            slot.delay = throttle.delay
+        if self.stats is None:
+            return
+        throttles = self.throttles[kind].values()
+        if changed:
+            self.stats.set_value(f"throttle/{kind}/concurrency", sum(t.concurrency for t in throttles))
+            self.stats.set_value(f"throttle/{kind}/delay", round(max(t.delay for t in throttles), 3))
+        latencies = [t.latency for t in throttles if t.latency is not None]
+        if latencies:
+            self.stats.set_value(f"throttle/{kind}/latency", round(sum(latencies) / len(latencies), 3))
+        counts = sum((t.counts for t in throttles), Counter())
+        for name, value in counts.items():
+            self.stats.set_value(f"throttle/{kind}/{name}", value)
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+def download_kind(request):
+    """Return "image" for image pipeline downloads and "html" for pages."""
+    return "image" if request.meta.get("download_slot") == "images" else "html"
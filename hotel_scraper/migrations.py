@@ -0,0 +1,132 @@
+"""Versioned schema migrations.
+
+``migrate`` brings a database up to the schema of ``hotel_scraper.models``
+by running, in order, the steps of ``MIGRATIONS`` it has not run yet. The
+versions applied are recorded in the ``schema_migrations`` table. Every
+step also checks what is already there, so a database created by an older
+``create_all``, before migrations were recorded, is upgraded in place::
+
+    python initialize_db.py
+
+On Postgres the migrations run under an advisory lock, so scraper workers
+starting together migrate the database once.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, func, inspect, select, text, update
+
+from hotel_scraper.city_stats import refresh_all_city_stats
+from hotel_scraper.geo import encode_geohash
+from hotel_scraper.models import Base, CityStats, Hotel, SchemaMigration
+
+# Any constant works, as long as nothing else locks it
+ADVISORY_LOCK_ID = 48072024
+# Hotels geohashed per statement when backfilling
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def create_tables(connection):
+    """Create the tables that don't exist yet, with their indexes."""
+    Base.metadata.create_all(bind=connection)
+
+
+def add_missing_columns(connection):
+    """Add the model columns missing from tables created by older versions."""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column is Hotel.__table__.c.geohash:
+                    backfill_geohashes(connection)
+
+
+def backfill_geohashes(connection):
+    """Fill in the geohash of hotels with coordinates but no geohash."""
+    hotels = Hotel.__table__
+    query = (
+        select(hotels.c.id, hotels.c.latitude, hotels.c.longitude)
+        .where(hotels.c.geohash.is_(None), hotels.c.latitude.is_not(None), hotels.c.longitude.is_not(None))
+    )
+    rows = connection.execute(query).all()
+    statement = update(hotels).where(hotels.c.id == bindparam("hotel_id")).values(geohash=bindparam("cell"))
+    for start in range(0, len(rows), BACKFILL_CHUNK_SIZE):
+        connection.execute(statement, [
+            {"hotel_id": row.id, "cell": encode_geohash(row.latitude, row.longitude)}
+            for row in rows[start:start + BACKFILL_CHUNK_SIZE]
+        ])
+
+
+def unique_property_ids(connection):
+    """Make ``hotels.property_id`` unique, as the upserts require.
+
+    Hotels were once inserted without it, so duplicates are removed first,
+    keeping the latest row of each property.
+    """
+    inspector = inspect(connection)
+    unique = [constraint["column_names"] for constraint in inspector.get_unique_constraints("hotels")]
+    unique += [index["column_names"] for index in inspector.get_indexes("hotels") if index["unique"]]
+    if ["property_id"] in unique:
+        return
+    hotels = Hotel.__table__
+    latest = (
+        select(func.max(hotels.c.id))
+        .where(hotels.c.property_id.is_not(None))
+        .group_by(hotels.c.property_id)
+    )
+    connection.execute(hotels.delete().where(hotels.c.property_id.is_not(None), hotels.c.id.not_in(latest)))
+    connection.execute(text("CREATE UNIQUE INDEX uq_hotels_property_id ON hotels (property_id)"))
+
+
+def create_query_indexes(connection):
+    """Create the model indexes missing from tables created by older versions."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def backfill_city_stats(connection):
+    """Compute the aggregates of every city from the hotels already stored."""
+    connection.execute(CityStats.__table__.delete())
+    refresh_all_city_stats(connection)
+
+
+def change_feed(connection):
+    """Add the hotel content hashes and the ``hotel_changes`` table."""
+    create_tables(connection)
+    add_missing_columns(connection)
+
+
+# Version, name and step of each migration, in the order they run. Never
+# renumber or remove one; append new ones.
+MIGRATIONS = (
+    (1, "create tables", create_tables),
+    (2, "add missing columns", add_missing_columns),
+    (3, "unique property ids", unique_property_ids),
+    (4, "city and rating query indexes", create_query_indexes),
+    (5, "backfill city stats", backfill_city_stats),
+    (6, "hotel content hashes and change feed", change_feed),
+    (7, "crawl checkpoints", create_tables),
+)
+
+
+def migrate(engine, migrations=MIGRATIONS):
+    """Run the migrations the database has not run yet; return their versions."""
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        SchemaMigration.__table__.create(bind=connection, checkfirst=True)
+        applied = set(connection.execute(select(SchemaMigration.__table__.c.version)).scalars())
+        ran = []
+        for version, name, step in migrations:
+            if version in applied:
+                continue
+            step(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.now(timezone.utc),
+            ))
+            ran.append(version)
+    return ran
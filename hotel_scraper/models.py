@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from hotel_scraper.database import Base
 
@@ -7,21 +7,132 @@ class City(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
+    updated_at = Column(DateTime(timezone=True))  # Last time hotels of the city were written
     hotels = relationship("Hotel", back_populates="city")
 
 class Hotel(Base):
     __tablename__ = 'hotels'
+    __table_args__ = (
+        # Nearby and bounding box queries scan geohash prefixes (see hotel_scraper.geo)
+        Index('ix_hotels_geohash_location', 'geohash', 'latitude', 'longitude'),
+        # Hotels of a city by price or rating; id breaks ties for keyset pagination
+        Index('ix_hotels_city_price', 'city_id', 'price', 'id'),
+        Index('ix_hotels_city_rating', 'city_id', 'rating', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    property_id = Column(Integer)
+    property_id = Column(Integer, unique=True)
     name = Column(String, index=True)
     rating = Column(Float)
     location = Column(String)
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(String(9))  # Geohash of the location, for nearby queries
     room_type = Column(String)
     price = Column(Float)
+    image_url = Column(String)  # Source URL of the saved image
     image_path = Column(String)  # Path to the saved image
+    image_width = Column(Integer)
+    image_height = Column(Integer)
+    image_variants = Column(JSON)  # Paths of the thumbnails and WebP copy by name
     city_id = Column(Integer, ForeignKey('cities.id'))
     city_name = Column(String)
+    last_seen_at = Column(DateTime(timezone=True))  # Start of the last crawl that saw the hotel
+    missed_runs = Column(Integer, default=0)  # Crawls of its city that did not see the hotel
+    retired = Column(Boolean, default=False)
+    content_hash = Column(String(64))  # SHA-256 of the scraped columns (see hotel_scraper.changes)
     city = relationship("City", back_populates="hotels")
+
+class CityStats(Base):
+    """Aggregates of the listed hotels of a city, refreshed as they are written."""
+    __tablename__ = 'city_stats'
+
+    city_id = Column(Integer, ForeignKey('cities.id'), primary_key=True)
+    hotels = Column(Integer, nullable=False, default=0)  # Listed hotels, retired ones left out
+    min_price = Column(Float)
+    avg_price = Column(Float)
+    max_price = Column(Float)
+    p25_price = Column(Float)
+    median_price = Column(Float)
+    p75_price = Column(Float)
+    p90_price = Column(Float)
+    min_rating = Column(Float)
+    avg_rating = Column(Float)
+    max_rating = Column(Float)
+    median_rating = Column(Float)
+    updated_at = Column(DateTime(timezone=True))
+
+
+class HotelChange(Base):
+    """A hotel inserted, updated or retired by a crawl, for consumers to sync."""
+    __tablename__ = 'hotel_changes'
+
+    id = Column(Integer, primary_key=True)  # Consumers read the changes after the last id they saw
+    property_id = Column(Integer, nullable=False, index=True)
+    change = Column(String, nullable=False)  # inserted, updated or disappeared
+    fields = Column(JSON)  # Old and new value of each changed column by name
+    changed_at = Column(DateTime(timezone=True), nullable=False)  # Start of the crawl that saw it
+
+
+class ImageRecord(Base):
+    """Where the image behind a URL is stored, by content hash."""
+    __tablename__ = 'image_index'
+
+    url = Column(String, primary_key=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    path = Column(String, nullable=False)  # Path of the image in the content store
+    width = Column(Integer)
+    height = Column(Integer)
+    variants = Column(JSON)
+    stored_at = Column(DateTime(timezone=True))
+
+
+class CrawlUnit(Base):
+    """One hotel list page of a city, claimed by scraper workers."""
+    __tablename__ = 'crawl_frontier'
+    __table_args__ = (UniqueConstraint('crawl', 'city_id', 'page'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    crawl = Column(String, nullable=False)  # Name of the crawl the unit belongs to
+    city_id = Column(String, nullable=False)  # Trip.com city id
+    city_name = Column(String)
+    page = Column(Integer, nullable=False, default=1)
+    status = Column(String, nullable=False, default='pending', index=True)  # pending, leased, done or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    leased_by = Column(String)
+    lease_expires_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+
+
+class CrawlCheckpoint(Base):
+    """The state of a checkpointed full crawl, resumed when it didn't finish."""
+    __tablename__ = 'crawl_checkpoints'
+
+    crawl = Column(String, primary_key=True)  # Name of the crawl
+    status = Column(String, nullable=False, default='running')  # running, paused or finished
+    started_at = Column(DateTime(timezone=True))
+    pending_items = Column(Integer, nullable=False, default=0)  # Items in the pipelines, e.g. awaiting images
+    updated_at = Column(DateTime(timezone=True))
+
+
+class CityCheckpoint(Base):
+    """How far a checkpointed crawl got through the hotel list of a city."""
+    __tablename__ = 'city_checkpoints'
+    __table_args__ = (UniqueConstraint('crawl', 'city_id'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    crawl = Column(String, ForeignKey('crawl_checkpoints.crawl'), nullable=False)
+    city_id = Column(String, nullable=False)  # Trip.com city id
+    city_name = Column(String)
+    page = Column(Integer, nullable=False, default=0)  # Last page whose hotels were all stored
+    done = Column(Boolean, nullable=False, default=False)  # Whether the hotel list was read to the end
+    updated_at = Column(DateTime(timezone=True))
+
+
+class SchemaMigration(Base):
+    """A schema migration applied to the database (see hotel_scraper.migrations)."""
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime(timezone=True))
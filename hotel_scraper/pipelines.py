@@ -3,11 +3,861 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from time import monotonic, perf_counter
+from urllib.parse import urlparse
+
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, DropItem, NotConfigured
+from scrapy.utils.misc import load_object
+from sqlalchemy import bindparam, func, insert, or_, select, update
+from twisted.internet.defer import Deferred, DeferredLock, DeferredSemaphore, succeed
+from twisted.python.failure import Failure
+from twisted.internet.task import LoopingCall, deferLater
+from twisted.internet.threads import deferToThread
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from hotel_scraper import export, signals as hotel_signals
+from hotel_scraper.changes import (
+    DISAPPEARED, HASHED_COLUMNS, INSERTED, UPDATED, changed_columns, content_hash, record_changes,
+    stored_hotels,
+)
+from hotel_scraper.city_stats import refresh_city_stats
+from hotel_scraper.database import get_engine
+from hotel_scraper.geo import encode_geohash
+from hotel_scraper.images import Image, InvalidImage, store_image
+from hotel_scraper.items import MISSING, HotelItem
+from hotel_scraper.models import City, Hotel, ImageRecord
+from hotel_scraper.retry import HostUnavailable
+
+
+def _stage_finished(crawler, stage, duration, **kwargs):
+    """Report the duration of a processing stage to the crawl metrics."""
+    if crawler is not None:
+        crawler.signals.send_catch_log(hotel_signals.stage_finished, stage=stage, duration=duration, **kwargs)
+
+
+def _dialect_insert(connection, table):
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+def _deferred_from_future(future):
+    """Return a Deferred fired on the reactor thread with a future's result."""
+    from twisted.internet import reactor
+
+    dfd = Deferred()
+
+    def done(future):
+        try:
+            result = future.result()
+        except BaseException as e:
+            reactor.callFromThread(dfd.errback, Failure(e))
+        else:
+            reactor.callFromThread(dfd.callback, result)
+
+    future.add_done_callback(done)
+    return dfd
+
+
+class ImageDownloadPipeline:
+    """Download hotel images through Scrapy's downloader into a content store.
+
+    Images are stored once per content hash (see ``hotel_scraper.images``)
+    and the ``image_index`` table maps every image URL seen to its stored
+    file, so a URL already fetched by an earlier run or another hotel is
+    reused without a network call. Items sharing a URL that is still being
+    fetched wait for that single download.
+
+    Image requests bypass the scheduler and go straight to the downloader
+    in their own ``images`` download slot, so HTML pages keep being fetched
+    and parsed while images are in flight. A global and a per-host
+    semaphore bound the number of concurrent image downloads, and the
+    response body is written to disk on a worker thread.
+
+    With ``IMAGES_POSTPROCESS`` and Pillow installed, images are decoded,
+    stripped of metadata and stored with their ``IMAGES_THUMBS`` thumbnails
+    and WebP copy by a pool of ``IMAGES_PROCESS_WORKERS`` processes instead.
+    At most ``IMAGES_PROCESS_QUEUE`` images wait for or are in the pool, so
+    downloads slow down rather than pile up in memory when it falls behind.
+    Bodies that don't decode are discarded.
+
+    With ``RETRY_DEFER_FAILED``, images that couldn't be downloaded because
+    of a network error, a retryable status or an open circuit (see
+    ``hotel_scraper.retry``) are downloaded again once the spider runs out
+    of work, one at a time until one succeeds and then all together. Their
+    hotels have already gone on without an image, so each image stored then
+    is sent with the ``image_recovered`` signal for the database pipeline
+    to fill in.
+    """
+
+    # Seconds between rounds of deferred images that failed, like Scrapy's idle heartbeat
+    idle_round_seconds = 5.0
+
+    def __init__(self, crawler, images_dir="images", concurrency=8,
+                 concurrency_per_host=4, timeout=30, max_size=10 * 1024 * 1024,
+                 engine=None, postprocess=False, process_workers=0,
+                 process_queue=0, thumbs=None, webp_quality=None, defer_failed=False,
+                 deferred_timeout=600, retry_codes=(), retry_errors=()):
+        self.crawler = crawler
+        self.engine = engine if engine is not None else get_engine()
+        self.images_dir = images_dir
+        self.timeout = timeout
+        self.max_size = max_size
+        self.concurrency_per_host = concurrency_per_host
+        self.semaphore = DeferredSemaphore(concurrency)
+        self.host_semaphores = {}
+        self.postprocess = postprocess
+        self.process_workers = process_workers or os.cpu_count() or 1
+        self.process_semaphore = DeferredSemaphore(process_queue or 2 * self.process_workers)
+        self.thumbs = thumbs or {}
+        self.webp_quality = webp_quality
+        self.pool = None
+        # Images stored in this run by URL, and the items waiting on URLs being fetched
+        self.stored = {}
+        self.in_flight = {}
+        # Cities of the image URLs to download again at the end of the crawl
+        self.defer_failed = defer_failed
+        self.deferred_timeout = deferred_timeout
+        self.retry_codes = frozenset(retry_codes)
+        self.retry_errors = (HostUnavailable,) + tuple(retry_errors)
+        self.deferred = {}
+        self.retrying = 0
+        self.recovered = False
+        self.draining_since = None
+        self.next_round = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            crawler,
+            images_dir=settings.get("IMAGES_DIR", "images"),
+            concurrency=settings.getint("IMAGES_CONCURRENCY", 8),
+            concurrency_per_host=settings.getint("IMAGES_CONCURRENCY_PER_HOST", 4),
+            timeout=settings.getfloat("IMAGES_DOWNLOAD_TIMEOUT", 30),
+            max_size=settings.getint("IMAGES_MAX_SIZE", 10 * 1024 * 1024),
+            engine=get_engine(settings),
+            postprocess=settings.getbool("IMAGES_POSTPROCESS"),
+            process_workers=settings.getint("IMAGES_PROCESS_WORKERS", 0),
+            process_queue=settings.getint("IMAGES_PROCESS_QUEUE", 0),
+            thumbs=settings.getdict("IMAGES_THUMBS"),
+            webp_quality=settings.getint("IMAGES_WEBP_QUALITY", 0) or None,
+            defer_failed=settings.getbool("RETRY_ENABLED") and settings.getbool("RETRY_DEFER_FAILED"),
+            deferred_timeout=settings.getfloat("RETRY_DEFERRED_TIMEOUT", 600),
+            retry_codes=[int(code) for code in settings.getlist("RETRY_HTTP_CODES")],
+            retry_errors=[load_object(x) if isinstance(x, str) else x for x in settings.getlist("RETRY_EXCEPTIONS")],
+        )
+        crawler.signals.connect(pipeline.spider_idle, signal=signals.spider_idle)
+        return pipeline
+
+    def open_spider(self, spider):
+        if self.postprocess:
+            if Image is None:
+                spider.logger.warning("IMAGES_POSTPROCESS needs Pillow; storing images as downloaded.")
+            else:
+                # Forking a process with a running reactor is unsafe
+                self.pool = ProcessPoolExecutor(self.process_workers, mp_context=get_context("spawn"))
+
+    def close_spider(self, spider):
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            return deferToThread(pool.shutdown)
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        image_url = adapter.get("image_url")
+        adapter["image_path"] = None
+        if image_url in MISSING:
+            return item
+
+        if image_url in self.stored:
+            return self._downloaded(self.stored[image_url], adapter, item, spider)
+        waiting = self.in_flight.get(image_url)
+        if waiting is not None:
+            dfd = Deferred()
+            waiting.append(dfd)
+        else:
+            dfd = self._fetch(image_url, adapter.get("city"))
+        dfd.addCallback(self._downloaded, adapter, item, spider)
+        dfd.addErrback(self._failed, image_url, item, spider)
+        return dfd
+
+    def _fetch(self, image_url, city=None):
+        """Look an image URL up in the index and download it if unknown."""
+        waiting = self.in_flight[image_url] = []
+
+        def done(result):
+            del self.in_flight[image_url]
+            if isinstance(result, Failure):
+                reason = "invalid" if result.check(InvalidImage) else "error"
+                self._image_failed(image_url, reason, city)
+            if isinstance(result, dict):
+                self.stored[image_url] = result
+            for dfd in waiting:
+                if isinstance(result, Failure):
+                    dfd.errback(result)
+                else:
+                    dfd.callback(result)
+            return result
+
+        dfd = deferToThread(self.lookup, image_url)
+        dfd.addCallback(lambda known: known or self._schedule_download(image_url, city))
+        dfd.addBoth(done)
+        return dfd
+
+    def lookup(self, image_url):
+        """Return the stored image of a URL from the index, if its file exists (worker thread)."""
+        images = ImageRecord.__table__
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(images.c.sha256, images.c.path, images.c.width, images.c.height, images.c.variants)
+                .where(images.c.url == image_url)
+            ).first()
+        if row is None or not os.path.exists(row.path):
+            return None
+        return {"sha256": row.sha256, "path": row.path, "width": row.width,
+                "height": row.height, "variants": row.variants}
+
+    def _schedule_download(self, image_url, city=None):
+        host = urlparse(image_url).netloc
+        host_semaphore = self.host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = DeferredSemaphore(self.concurrency_per_host)
+            self.host_semaphores[host] = host_semaphore
+
+        request = scrapy.Request(
+            image_url,
+            meta={
+                "download_slot": "images",
+                "download_timeout": self.timeout,
+                "download_maxsize": self.max_size,
+                # Failed images are put off by the pipeline, which knows their hotels
+                "dont_defer": True,
+            },
+        )
+        return host_semaphore.run(self.semaphore.run, self._download, request, city)
+
+    def _download(self, request, city=None):
+        dfd = self.crawler.engine.download(request)
+        if self.defer_failed:
+            dfd.addBoth(self._defer_failed, request.url, city)
+        dfd.addCallback(self._store, city)
+        return dfd
+
+    def _defer_failed(self, result, image_url, city):
+        if isinstance(result, Failure):
+            retryable = result.check(*self.retry_errors) is not None
+        else:
+            retryable = result.status in self.retry_codes
+        if retryable:
+            self.deferred[image_url] = city
+        return result
+
+    def _store(self, response, city=None):
+        if response.status != 200 or not response.body:
+            reason = f"http_{response.status}" if response.status != 200 else "empty"
+            self._image_failed(response.url, reason, city)
+            return None
+        started = perf_counter()
+        if self.pool is not None:
+            dfd = self.process_semaphore.run(self._process, response.body)
+        else:
+            dfd = deferToThread(store_image, response.body, self.images_dir)
+        dfd.addCallback(self._stored, started, len(response.body), city)
+        return dfd
+
+    def _stored(self, info, started, size, city):
+        _stage_finished(self.crawler, "image_store", perf_counter() - started, size=size, city=city)
+        return info
+
+    def _image_failed(self, url, reason, city):
+        self.crawler.signals.send_catch_log(hotel_signals.image_failed, url=url, reason=reason, city=city)
+
+    def _process(self, body):
+        future = self.pool.submit(store_image, body, self.images_dir, self.thumbs, self.webp_quality, True)
+        return _deferred_from_future(future)
+
+    def _downloaded(self, info, adapter, item, spider):
+        if info is None:
+            spider.logger.info(f"Failed to download image: {adapter['image_url']}")
+            return item
+        spider.logger.debug(f"Image stored: {info['path']}")
+        adapter["image_path"] = info["path"]
+        adapter["image_sha256"] = info["sha256"]
+        adapter["image_width"] = info["width"]
+        adapter["image_height"] = info["height"]
+        adapter["image_variants"] = info["variants"]
+        return item
+
+    def _failed(self, failure, image_url, item, spider):
+        if failure.check(InvalidImage):
+            spider.logger.info(f"Discarded invalid image {image_url}: {failure.value}")
+        else:
+            spider.logger.info(f"Error downloading image {image_url}: {failure.value}")
+        return item
+
+    def spider_idle(self, spider):
+        """Download the images put off to the end of the crawl again."""
+        if self.retrying:
+            raise DontCloseSpider
+        if not self.deferred:
+            return
+        now = monotonic()
+        if self.draining_since is None:
+            self.draining_since = now
+        elif now - self.draining_since > self.deferred_timeout:
+            spider.logger.warning(f"Giving up on {len(self.deferred)} deferred images")
+            self.deferred.clear()
+            return
+        if now < self.next_round:
+            raise DontCloseSpider
+        # One image first: while its host is down, the others would fail too
+        urls = list(self.deferred) if self.recovered else list(self.deferred)[:1]
+        for image_url in urls:
+            city = self.deferred.pop(image_url)
+            self.retrying += 1
+            dfd = self._fetch(image_url, city)
+            dfd.addBoth(self._retried, image_url, city, spider)
+        raise DontCloseSpider
+
+    def _retried(self, result, image_url, city, spider):
+        self.retrying -= 1
+        self.recovered = isinstance(result, dict)
+        if not self.recovered:
+            # Scrapy checks whether the spider is idle again right away
+            self.next_round = monotonic() + self.idle_round_seconds
+        if self.recovered:
+            spider.logger.debug(f"Deferred image stored: {result['path']}")
+            self.crawler.signals.send_catch_log(
+                hotel_signals.image_recovered, url=image_url, info=result, city=city,
+            )
+        elif isinstance(result, Failure):
+            spider.logger.info(f"Error downloading deferred image {image_url}: {result.value}")
+
 
 class HotelScraperPipeline:
+    """Store scraped hotels and their cities in the database.
+
+    Items are buffered and written in batches of ``DB_BATCH_SIZE`` rows, or
+    every ``DB_FLUSH_INTERVAL`` seconds, whichever comes first. Each batch is
+    a single multi-row ``INSERT ... ON CONFLICT (property_id) DO UPDATE``
+    executed on a worker thread, so commits never run on the reactor thread.
+    Batches are written one at a time and whatever is left is flushed when
+    the spider closes. A batch whose transaction fails is written again,
+    ``DB_FLUSH_RETRY_DELAY`` seconds later and before any batch flushed
+    since, up to ``DB_FLUSH_RETRIES`` times. It is then given up, counted in
+    the ``hotels/lost`` stat and its items sent with ``item_dropped``. The
+    ``hotels_stored`` signal is sent with the items of every batch written,
+    e.g. for the crawl checkpoint, and never for those of a batch that
+    failed.
+
+    The stored image of each hotel is recorded in the ``image_index`` table
+    in the same transaction, for the image pipeline to find next time.
+    Images the image pipeline only managed to download at the end of the
+    crawl (the ``image_recovered`` signal) are given to the hotels stored
+    without them once the last batch is written.
+
+    In incremental mode, hotels of the cities whose hotel list a full crawl
+    read to the end, but which it did not see, get their ``missed_runs`` counter
+    bumped at the end of the crawl and are retired once it reaches
+    ``RETIRE_AFTER_RUNS``.
+    """
+
+    # Columns refreshed when a hotel that is already stored is seen again
+    upsert_columns = (
+        "name", "rating", "location", "latitude", "longitude", "geohash", "room_type",
+        "price", "image_url", "image_path", "image_width", "image_height",
+        "image_variants", "city_id", "city_name",
+        "last_seen_at", "missed_runs", "retired", "content_hash",
+    )
+
+    def __init__(self, batch_size=500, flush_interval=5.0, incremental=False, retire_after=3,
+                 engine=None, crawler=None, flush_retries=3, flush_retry_delay=1.0):
+        self.engine = engine if engine is not None else get_engine()
+        self.crawler = crawler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_retries = flush_retries
+        self.flush_retry_delay = flush_retry_delay
+        self.incremental = incremental
+        self.retire_after = retire_after
+        self.buffer = []
+        self.buffered_items = []
+        self.city_ids = {}
+        self.seen_cities = set()
+        # Images downloaded at the end of the crawl, by URL
+        self.recovered_images = {}
+        # Hotels written, unchanged, inserted, updated, disappeared and lost in this crawl
+        self.counts = Counter()
+        self.lock = DeferredLock()
+        self.timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            batch_size=settings.getint("DB_BATCH_SIZE", 500),
+            flush_interval=settings.getfloat("DB_FLUSH_INTERVAL", 5.0),
+            flush_retries=settings.getint("DB_FLUSH_RETRIES", 3),
+            flush_retry_delay=settings.getfloat("DB_FLUSH_RETRY_DELAY", 1.0),
+            incremental=settings.getbool("INCREMENTAL_CRAWL"),
+            retire_after=settings.getint("RETIRE_AFTER_RUNS", 3),
+            engine=get_engine(settings),
+            crawler=crawler,
+        )
+        crawler.signals.connect(pipeline.image_recovered, signal=hotel_signals.image_recovered)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.run_started = datetime.now(timezone.utc)
+        if self.flush_interval > 0:
+            self.timer = LoopingCall(self.flush)
+            self.timer.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        if self.timer is not None and self.timer.running:
+            self.timer.stop()
+        dfd = self.flush_all()
+        dfd.addCallback(self._store_recovered_images)
+        dfd.addErrback(self._recovered_images_failed)
+        if self.incremental:
+            dfd.addCallback(lambda _: self.lock.run(deferToThread, self.retire_missing))
+            dfd.addErrback(self._retire_failed)
+        dfd.addCallback(self._log_counts)
+        return dfd
+
+    def process_item(self, item, spider):
+        # Dropped rather than passed on, so the checkpoint counts them as done
+        try:
+            hotel = HotelItem.from_item(item)
+        except (TypeError, ValueError) as e:
+            raise DropItem(f"Invalid hotel item {ItemAdapter(item).get('property_title')}: {e}")
+        if hotel.city is None:
+            raise DropItem(f"Invalid hotel item {hotel.property_title}: no city")
+
+        self.buffer.append({
+            "name": hotel.property_title,
+            "property_id": hotel.property_id,
+            "rating": hotel.rating,
+            "location": hotel.location,
+            "latitude": hotel.latitude,
+            "longitude": hotel.longitude,
+            "geohash": encode_geohash(hotel.latitude, hotel.longitude),
+            "room_type": hotel.room_type,
+            "price": hotel.price,
+            "image_url": hotel.image_url,
+            "image_path": hotel.image_path,
+            "image_width": hotel.image_width,
+            "image_height": hotel.image_height,
+            "image_variants": hotel.image_variants,
+            "image_sha256": hotel.image_sha256,
+            "city": hotel.city,
+            "city_name": hotel.city_name,
+            "last_seen_at": self.run_started,
+            "missed_runs": 0,
+            "retired": False,
+        })
+        self.buffered_items.append(item)
+        self.seen_cities.add(hotel.city)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        """Write the buffered rows; return a Deferred fired once written."""
+        rows, self.buffer = self.buffer, []
+        items, self.buffered_items = self.buffered_items, []
+        if not rows:
+            return succeed(None)
+        return self.lock.run(self._write, rows, items)
+
+    def flush_all(self, result=None):
+        """Flush until every row is written or given up; return a Deferred."""
+        if not self.buffer:
+            return succeed(result)
+        dfd = self.flush()
+        dfd.addCallback(self.flush_all)
+        return dfd
+
+    def _write(self, rows, items, attempt=1):
+        started = perf_counter()
+        dfd = deferToThread(self.write_batch, rows)
+        dfd.addCallbacks(self._written, self._write_failed,
+                         callbackArgs=(started, items), errbackArgs=(rows, items, attempt))
+        return dfd
+
+    def _written(self, count, started, items):
+        _stage_finished(self.crawler, "db_flush", perf_counter() - started, count=count)
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(hotel_signals.hotels_stored, items=items)
+        return count
+
+    def write_batch(self, rows):
+        """Upsert the changed hotels of a batch in one transaction (worker thread).
+
+        Hotels whose content hash matches the stored one are only marked as
+        seen. The others are upserted and recorded in the change feed.
+        """
+        # A statement may only touch each property once, so keep the latest row.
+        # Rows are copied, as a batch that fails is written again.
+        unique_rows = {}
+        for row in rows:
+            key = row["property_id"] if row["property_id"] is not None else id(row)
+            unique_rows[key] = dict(row)
+        rows = list(unique_rows.values())
+
+        images = {}
+        for row in rows:
+            sha256 = row.pop("image_sha256", None)
+            if sha256 and row["image_url"] and row["image_path"]:
+                images[row["image_url"]] = {
+                    "url": row["image_url"], "sha256": sha256, "path": row["image_path"],
+                    "width": row["image_width"], "height": row["image_height"],
+                    "variants": row["image_variants"], "stored_at": row["last_seen_at"],
+                }
+
+        with self.engine.begin() as connection:
+            for row in rows:
+                row["city_id"] = self.get_city_id(connection, row.pop("city"))
+                row["content_hash"] = content_hash(row)
+            changed, unchanged, changes = self.compare(connection, rows)
+            if changed:
+                connection.execute(self.upsert_statement(connection), changed)
+                written_urls = {row["image_url"] for row in changed}
+                images = [image for url, image in images.items() if url in written_urls]
+                if images:
+                    connection.execute(self.image_upsert_statement(connection), images)
+                record_changes(connection, changes)
+                self.touch_cities(connection, {row["city_id"] for row in changed})
+            if unchanged:
+                # Only mark them seen, a narrow update that leaves the indexed columns alone
+                hotels = Hotel.__table__
+                for start in range(0, len(unchanged), 500):
+                    connection.execute(
+                        update(hotels)
+                        .where(hotels.c.property_id.in_(unchanged[start:start + 500]))
+                        .values(last_seen_at=self.run_started, missed_runs=0)
+                    )
+        self.counts["written"] += len(changed)
+        self.counts["unchanged"] += len(unchanged)
+        for change in changes:
+            self.counts[change["change"]] += 1
+        return len(rows)
+
+    def compare(self, connection, rows):
+        """Split rows into changed rows, unchanged property ids and feed changes."""
+        stored = stored_hotels(connection, [row["property_id"] for row in rows if row["property_id"] is not None])
+        changed, unchanged, changes = [], [], []
+        for row in rows:
+            old = stored.get(row["property_id"])
+            if old is not None and old["content_hash"] == row["content_hash"] and not old["retired"]:
+                unchanged.append(row["property_id"])
+                continue
+            changed.append(row)
+            if row["property_id"] is None:
+                continue
+            fields = changed_columns(old or {}, row)
+            if old is not None and old["retired"]:
+                fields["retired"] = [True, False]
+            # Hotels stored before they had a hash may not have changed at all
+            if old is None or fields:
+                changes.append({
+                    "property_id": row["property_id"], "change": INSERTED if old is None else UPDATED,
+                    "fields": fields, "changed_at": self.run_started,
+                })
+        return changed, unchanged, changes
+
+    def touch_cities(self, connection, city_ids):
+        """Record that hotels of the cities changed and refresh their aggregates."""
+        cities = City.__table__
+        now = datetime.now(timezone.utc)
+        connection.execute(update(cities).where(cities.c.id.in_(city_ids)).values(updated_at=now))
+        refresh_city_stats(connection, city_ids, now=now)
+
+    def image_recovered(self, url, info, city=None):
+        self.recovered_images[url] = info
+
+    def _store_recovered_images(self, result):
+        if self.recovered_images:
+            return self.lock.run(deferToThread, self.store_recovered_images)
+        return result
+
+    def store_recovered_images(self):
+        """Give hotels stored without an image the images recovered since (worker thread).
+
+        The cities of the hotels updated are touched in the same transaction,
+        so their aggregates and cached query results are refreshed.
+        """
+        images, self.recovered_images = self.recovered_images, {}
+        hotels = Hotel.__table__
+        # The hashed columns include city_id
+        columns = [hotels.c[name] for name in ("id", "property_id") + HASHED_COLUMNS]
+        urls = sorted(images)
+        with self.engine.begin() as connection:
+            updates, changes, city_ids = [], [], set()
+            for start in range(0, len(urls), 500):
+                query = select(*columns).where(
+                    hotels.c.image_url.in_(urls[start:start + 500]), hotels.c.image_path.is_(None),
+                )
+                for old in connection.execute(query).mappings():
+                    info = images[old["image_url"]]
+                    new = dict(old, image_path=info["path"], image_width=info["width"],
+                               image_height=info["height"], image_variants=info["variants"])
+                    new["content_hash"] = content_hash(new)
+                    city_ids.add(old["city_id"])
+                    updates.append({"hotel_id": old["id"], **{
+                        column: new[column]
+                        for column in ("image_path", "image_width", "image_height", "image_variants", "content_hash")
+                    }})
+                    if old["property_id"] is not None:
+                        changes.append({
+                            "property_id": old["property_id"], "change": UPDATED,
+                            "fields": changed_columns(old, new), "changed_at": self.run_started,
+                        })
+            if updates:
+                connection.execute(
+                    update(hotels).where(hotels.c.id == bindparam("hotel_id")).values(
+                        {column: bindparam(column) for column in updates[0] if column != "hotel_id"}
+                    ),
+                    updates,
+                )
+                self.touch_cities(connection, city_ids)
+            connection.execute(self.image_upsert_statement(connection), [
+                {"url": url, "sha256": info["sha256"], "path": info["path"], "width": info["width"],
+                 "height": info["height"], "variants": info["variants"], "stored_at": self.run_started}
+                for url, info in images.items()
+            ])
+            record_changes(connection, changes)
+        self.counts[UPDATED] += len(changes)
+        self.spider.logger.info(f"Gave {len(updates)} hotels their image recovered at the end of the crawl.")
+        return len(updates)
+
+    def upsert_statement(self, connection):
+        """Build the dialect specific ``INSERT ... ON CONFLICT`` for hotels."""
+        stmt = _dialect_insert(connection, Hotel.__table__)
+        return stmt.on_conflict_do_update(
+            index_elements=[Hotel.__table__.c.property_id],
+            set_={column: stmt.excluded[column] for column in self.upsert_columns},
+        )
+
+    def image_upsert_statement(self, connection):
+        """Build the ``INSERT ... ON CONFLICT`` recording image URLs in the index."""
+        stmt = _dialect_insert(connection, ImageRecord.__table__)
+        return stmt.on_conflict_do_update(
+            index_elements=[ImageRecord.__table__.c.url],
+            set_={column: stmt.excluded[column]
+                  for column in ("sha256", "path", "width", "height", "variants", "stored_at")},
+        )
+
+    def retire_missing(self):
+        """Count a missed run for unseen hotels of the crawled cities (worker thread)."""
+        # Only a city a full crawl read to the end tells us which of its hotels are gone
+        completed = getattr(self.spider, "completed_cities", ())
+        city_ids = [self.city_ids[name] for name in self.seen_cities & completed if name in self.city_ids]
+        if not city_ids:
+            return 0
+        # Hotels skipped as seen earlier in the crawl window were seen by that run
+        seen_since = min(self.run_started, getattr(self.spider, "seen_since", None) or self.run_started)
+        hotels = Hotel.__table__
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(hotels)
+                .where(hotels.c.city_id.in_(city_ids))
+                .where(or_(hotels.c.last_seen_at.is_(None), hotels.c.last_seen_at < seen_since))
+                .values(missed_runs=func.coalesce(hotels.c.missed_runs, 0) + 1)
+            )
+            gone = connection.execute(
+                select(hotels.c.id, hotels.c.property_id)
+                .where(hotels.c.city_id.in_(city_ids))
+                .where(hotels.c.missed_runs >= self.retire_after)
+                .where(or_(hotels.c.retired.is_(None), hotels.c.retired.is_(False)))
+            ).all()
+            for start in range(0, len(gone), 500):
+                ids = [row.id for row in gone[start:start + 500]]
+                connection.execute(update(hotels).where(hotels.c.id.in_(ids)).values(retired=True))
+            record_changes(connection, [
+                {"property_id": row.property_id, "change": DISAPPEARED, "fields": {"retired": [False, True]},
+                 "changed_at": self.run_started}
+                for row in gone if row.property_id is not None
+            ])
+            if gone:
+                self.touch_cities(connection, city_ids)
+        self.counts[DISAPPEARED] += len(gone)
+        self.spider.logger.info(f"Retired {len(gone)} hotels not seen for {self.retire_after} runs.")
+        return len(gone)
+
+    def get_city_id(self, connection, city_name):
+        """Return the id of the named city, creating the row if needed."""
+        if city_name not in self.city_ids:
+            cities = City.__table__
+            city_id = connection.execute(
+                select(cities.c.id).where(cities.c.name == city_name)
+            ).scalar()
+            if city_id is None:
+                city_id = connection.execute(
+                    insert(cities).values(name=city_name)
+                ).inserted_primary_key[0]
+            self.city_ids[city_name] = city_id
+        return self.city_ids[city_name]
+
+    def _log_counts(self, result):
+        counts = self.counts
+        self.spider.logger.info(
+            f"Wrote {counts['written']} hotels, skipped {counts['unchanged']} unchanged; "
+            f"{counts[INSERTED]} inserted, {counts[UPDATED]} updated, {counts[DISAPPEARED]} disappeared."
+        )
+        if counts["lost"]:
+            self.spider.logger.error(f"Lost {counts['lost']} hotels to {counts['flush_failed']} failed flushes.")
+        if self.crawler is not None:
+            for name, value in counts.items():
+                self.crawler.stats.set_value(f"hotels/{name}", value)
+        return result
+
+    def _write_failed(self, failure, rows, items, attempt):
+        # City ids may belong to a rolled back transaction
+        self.city_ids.clear()
+        self.counts["flush_failed"] += 1
+        if attempt > self.flush_retries:
+            self.spider.logger.error(
+                f"Error while saving {len(rows)} hotels, giving them up after {attempt} attempts: {failure.value}"
+            )
+            self.counts["lost"] += len(rows)
+            if self.crawler is not None:
+                exception = DropItem(f"Lost to failed database flushes: {failure.value}")
+                for item in items:
+                    self.crawler.signals.send_catch_log(
+                        signals.item_dropped, item=item, response=None, exception=exception, spider=self.spider,
+                    )
+            return None
+        self.spider.logger.error(f"Error while saving {len(rows)} hotels, retrying: {failure.value}")
+        # Still holding the lock, so batches flushed since are written after this one
+        if self.flush_retry_delay > 0:
+            from twisted.internet import reactor
+            return deferLater(reactor, self.flush_retry_delay * attempt, self._write, rows, items, attempt + 1)
+        return self._write(rows, items, attempt + 1)
+
+    def _recovered_images_failed(self, failure):
+        self.spider.logger.error(f"Error while storing recovered images: {failure.value}")
+
+    def _retire_failed(self, failure):
+        self.spider.logger.error(f"Error while retiring unseen hotels: {failure.value}")
+
+
+class SnapshotExportPipeline:
+    """Append scraped hotels to partitioned Parquet snapshots.
+
+    Rows are buffered per ``(crawl_date, city)`` partition and written as a
+    row group once a partition holds ``EXPORT_ROW_GROUP_SIZE`` rows; when
+    ``EXPORT_MAX_BUFFERED_ROWS`` rows are buffered in total the largest
+    partition is written early, so memory stays bounded however many cities
+    a crawl visits. Row groups are written one at a time on a worker thread.
+    The crawl date is the UTC date the crawl started on, and rows are
+    tagged with the ``crawl_id`` of the run (see ``hotel_scraper.export``).
+    Enable it with ``EXPORT_ENABLED``; it requires pyarrow.
+    """
+
+    def __init__(self, export_dir="exports/hotels", row_group_size=10000, max_buffered_rows=50000,
+                 compression="zstd", crawl_id=None):
+        self.export_dir = export_dir
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.compression = compression
+        self.crawl_id = crawl_id
+        self.buffers = {}
+        self.buffered = 0
+        self.lock = DeferredLock()
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("EXPORT_ENABLED"):
+            raise NotConfigured
+        if export.pa is None:
+            raise NotConfigured("Parquet snapshots require pyarrow")
+        return cls(
+            export_dir=settings.get("EXPORT_DIR", "exports/hotels"),
+            row_group_size=settings.getint("EXPORT_ROW_GROUP_SIZE", 10000),
+            max_buffered_rows=settings.getint("EXPORT_MAX_BUFFERED_ROWS", 50000),
+            compression=settings.get("EXPORT_COMPRESSION", "zstd"),
+            crawl_id=settings.get("EXPORT_CRAWL_ID"),
+        )
+
+    def open_spider(self, spider):
+        self.spider = spider
+        started = datetime.now(timezone.utc)
+        self.crawl_date = started.date().isoformat()
+        if self.crawl_id is None:
+            # Frontier workers of one crawl share its name
+            frontier = getattr(spider, "frontier", None)
+            self.crawl_id = frontier.crawl if frontier is not None else export.default_crawl_id(spider.name, started)
+        self.writer = export.SnapshotWriter(self.export_dir, self.crawl_id, self.compression)
+
+    def close_spider(self, spider):
+        for partition in list(self.buffers):
+            self.flush(partition)
+        dfd = self.lock.run(deferToThread, self.writer.close)
+        dfd.addCallback(self._closed)
+        dfd.addErrback(lambda failure: spider.logger.error(f"Error while closing the snapshot: {failure.value}"))
+        return dfd
+
     def process_item(self, item, spider):
+        try:
+            hotel = HotelItem.from_item(item)
+        except (TypeError, ValueError) as e:
+            spider.logger.error(f"Invalid hotel item {ItemAdapter(item).get('property_title')}: {e}")
+            return item
+        row = {
+            "crawl_id": self.crawl_id,
+            "scraped_at": datetime.now(timezone.utc),
+            "property_id": hotel.property_id,
+            "name": hotel.property_title,
+            "city_name": hotel.city_name,
+            "rating": hotel.rating,
+            "price": hotel.price,
+            "location": hotel.location,
+            "latitude": hotel.latitude,
+            "longitude": hotel.longitude,
+            "room_type": hotel.room_type,
+            "image_url": hotel.image_url,
+            "image_path": hotel.image_path,
+        }
+
+        partition = (self.crawl_date, hotel.city)
+        rows = self.buffers.setdefault(partition, [])
+        rows.append(row)
+        self.buffered += 1
+        if len(rows) >= self.row_group_size:
+            self.flush(partition)
+        elif self.buffered >= self.max_buffered_rows:
+            self.flush(max(self.buffers, key=lambda key: len(self.buffers[key])))
         return item
+
+    def flush(self, partition):
+        """Write the buffered rows of a partition as a row group."""
+        rows = self.buffers.pop(partition)
+        self.buffered -= len(rows)
+        dfd = self.lock.run(deferToThread, self.writer.write, partition, rows)
+        dfd.addErrback(self._flush_failed, len(rows))
+        return dfd
+
+    def _closed(self, paths):
+        self.spider.logger.info(
+            f"Exported {self.writer.rows_written} hotels of crawl {self.crawl_id} to {len(paths)} snapshot files"
+        )
+        return paths
+
+    def _flush_failed(self, failure, count):
+        self.spider.logger.error(f"Error while exporting {count} hotels: {failure.value}")
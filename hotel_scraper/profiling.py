@@ -0,0 +1,81 @@
+"""Reports for the callback profiler.
+
+``CallbackProfilerMiddleware`` collects one ``cProfile`` profile per spider
+callback. The functions here turn those into a top-N hotspot report and into
+collapsed stacks, the ``frame;frame;frame value`` text format read by
+flamegraph.pl, speedscope and most other flame graph viewers.
+
+cProfile records calls as caller/callee pairs rather than full stacks, so
+the stacks are rebuilt by walking down from the time each function spent
+outside any profiled caller, splitting each callee's time between its callers in proportion to the time
+it spent under each of them.
+"""
+
+import io
+import os
+import pstats
+from collections import Counter
+
+MAX_DEPTH = 64
+MIN_MICROSECONDS = 1
+
+
+def frame_name(func):
+    """Return a short flame graph frame name for a pstats function key."""
+    filename, line, name = func
+    if filename == "~":  # Built-in functions have no source location
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+
+def collapsed_stacks(stats, root=None):
+    """Return a Counter of collapsed stacks to microseconds of self time.
+
+    ``stats`` is the ``stats`` dict of a ``pstats.Stats``. A ``root`` frame
+    name, e.g. the callback name, is prepended to every stack.
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge))
+    stacks = Counter()
+
+    def walk(func, path, share, seen):
+        _, _, self_time, cumulative, _ = stats[func]
+        micros = round(self_time * share * 1e6)
+        if micros >= MIN_MICROSECONDS:
+            stacks[";".join(path)] += micros
+        if len(path) >= MAX_DEPTH or not cumulative:
+            return
+        for callee, (_, _, _, edge_cumulative) in children.get(func, ()):
+            if callee in seen or not stats[callee][3]:
+                continue  # Recursion is folded into the first frame of the function
+            callee_share = share * edge_cumulative / stats[callee][3]
+            if stats[callee][3] * callee_share * 1e6 >= MIN_MICROSECONDS:
+                walk(callee, path + [frame_name(callee)], callee_share, seen | {callee})
+
+    for func, (_, _, _, cumulative, callers) in stats.items():
+        # Time not spent under any profiled caller was spent directly under
+        # the callback, e.g. in the first next() on its generator
+        top_level = cumulative - sum(edge[3] for edge in callers.values())
+        if top_level * 1e6 < MIN_MICROSECONDS or "_lsprof.Profiler" in func[2]:
+            continue
+        path = [root, frame_name(func)] if root else [frame_name(func)]
+        walk(func, path, top_level / cumulative, {func})
+    return stacks
+
+
+def write_collapsed(stacks, path):
+    """Write collapsed stacks to ``path``, heaviest first."""
+    with open(path, "w") as f:
+        for stack, micros in stacks.most_common():
+            f.write(f"{stack} {micros}\n")
+
+
+def hotspot_report(stats, top=25, sort="tottime"):
+    """Return the ``top`` functions of a ``pstats.Stats`` as printed text."""
+    stream = io.StringIO()
+    report = pstats.Stats(stream=stream)
+    report.add(stats)  # A copy, since strip_dirs changes the stats in place
+    report.strip_dirs().sort_stats(sort).print_stats(top)
+    return stream.getvalue()
@@ -0,0 +1,253 @@
+"""Rotate hotel page requests over a pool of proxies, by health.
+
+``ProxyPoolMiddleware`` sends every hotel page through one of the proxies
+of ``PROXY_LIST`` and ``PROXY_LIST_FILE``. Each proxy keeps a moving
+average of its latency and success rate, and a request goes through the
+proxy with the best health score: the success rate over the latency,
+shared among the requests it already has in flight. The pages of a city
+stick to the proxy that fetched its first page for as long as that proxy
+stays healthy, as a visitor's session would.
+
+A proxy that gets a ban (one of ``PROXY_BAN_HTTP_CODES``), or
+``PROXY_MAX_ERRORS`` network errors in a row, is quarantined for
+``PROXY_QUARANTINE_SECONDS``, twice as long for every quarantine since its
+last success, up to ``PROXY_MAX_QUARANTINE_SECONDS``. The banned request is
+sent again through another proxy, up to ``PROXY_MAX_SWITCHES`` times. When
+every proxy is quarantined, requests wait for the first to come back.
+
+Every proxy gets its own download slot, so the download delay and
+concurrency, and the throttle adapting them, apply per proxy and the crawl
+can go as much faster as there are proxies. Images go direct unless
+``PROXY_IMAGES`` is set. The health of the pool is kept in the crawl stats
+under ``proxy/*``.
+"""
+
+from collections import Counter
+from time import monotonic
+from urllib.parse import urlparse
+
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import load_object
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from hotel_scraper.middlewares import download_kind
+
+
+def load_proxies(settings):
+    """Return the proxy URLs of ``PROXY_LIST`` and ``PROXY_LIST_FILE``, without duplicates."""
+    urls = list(settings.getlist("PROXY_LIST"))
+    path = settings.get("PROXY_LIST_FILE")
+    if path:
+        with open(path) as f:
+            urls.extend(line.split("#", 1)[0].strip() for line in f)
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+class Proxy:
+    """A proxy of the pool and its health."""
+
+    def __init__(self, url):
+        self.url = url
+        parsed = urlparse(url)
+        # Without the credentials, for logs and stats
+        self.name = f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+        # Moving averages of the success rate and of the latency in seconds
+        self.success = 1.0
+        self.latency = None
+        self.in_flight = 0
+        self.errors = 0
+        self.strikes = 0
+        self.quarantined_until = 0.0
+        # Requests, bans, errors and quarantines
+        self.counts = Counter()
+
+    def score(self, default_latency=1.0):
+        latency = self.latency if self.latency is not None else default_latency
+        return self.success / max(latency, 0.01) / (1 + self.in_flight)
+
+
+class ProxyPool:
+    """Pick proxies by health score and quarantine the ones that fail."""
+
+    def __init__(self, urls, quarantine_seconds=300.0, max_quarantine_seconds=3600.0, max_errors=3,
+                 smoothing=0.2, clock=monotonic):
+        self.proxies = [Proxy(url) for url in urls]
+        self.by_url = {proxy.url: proxy for proxy in self.proxies}
+        self.quarantine_seconds = quarantine_seconds
+        self.max_quarantine_seconds = max_quarantine_seconds
+        self.max_errors = max_errors
+        self.smoothing = smoothing
+        self.clock = clock
+        # Proxy of each sticky session, by session key
+        self.sessions = {}
+
+    def pick(self, session=None):
+        """Return the proxy for a request of a session, or None while all are quarantined."""
+        now = self.clock()
+        proxy = self.sessions.get(session)
+        if proxy is not None and proxy.quarantined_until <= now:
+            return proxy
+        available = [proxy for proxy in self.proxies if proxy.quarantined_until <= now]
+        if not available:
+            return None
+        proxy = max(available, key=Proxy.score)
+        if session is not None:
+            self.sessions[session] = proxy
+        return proxy
+
+    def available(self):
+        now = self.clock()
+        return sum(proxy.quarantined_until <= now for proxy in self.proxies)
+
+    def next_release(self):
+        """Return the seconds until the first quarantined proxy comes back."""
+        return max(0.0, min(proxy.quarantined_until for proxy in self.proxies) - self.clock())
+
+    def succeeded(self, proxy, latency=None):
+        proxy.success += self.smoothing * (1 - proxy.success)
+        if latency is not None:
+            proxy.latency = latency if proxy.latency is None else \
+                proxy.latency + self.smoothing * (latency - proxy.latency)
+        proxy.errors = 0
+        proxy.strikes = 0
+
+    def banned(self, proxy):
+        """Note a ban of a proxy; return the seconds it is quarantined for."""
+        proxy.success -= self.smoothing * proxy.success
+        proxy.counts["bans"] += 1
+        return self.quarantine(proxy)
+
+    def failed(self, proxy):
+        """Note a network error; return the seconds the proxy is quarantined for, if it is."""
+        proxy.success -= self.smoothing * proxy.success
+        proxy.errors += 1
+        proxy.counts["errors"] += 1
+        if proxy.errors >= self.max_errors:
+            return self.quarantine(proxy)
+        return None
+
+    def quarantine(self, proxy):
+        proxy.strikes += 1
+        seconds = min(self.max_quarantine_seconds, self.quarantine_seconds * 2 ** (proxy.strikes - 1))
+        proxy.quarantined_until = self.clock() + seconds
+        proxy.errors = 0
+        proxy.counts["quarantines"] += 1
+        return seconds
+
+
+class ProxyPoolMiddleware:
+    """Send hotel pages through a pool of proxies picked by health.
+
+    See the module docstring. It runs before Scrapy's ``HttpProxyMiddleware``,
+    which adds the credentials of proxy URLs, and after the throttle and
+    the retry middleware, so that a ban answered by another proxy reaches
+    neither. Requests with a ``proxy`` of their own are left alone. When
+    ``PROXY_ENABLED`` is off it is not installed at all.
+    """
+
+    def __init__(self, pool, ban_codes=(403, 429), max_switches=2, images=False, errors=(), stats=None):
+        self.pool = pool
+        self.ban_codes = frozenset(ban_codes)
+        self.max_switches = max_switches
+        self.images = images
+        self.errors = tuple(errors)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROXY_ENABLED"):
+            raise NotConfigured
+        urls = load_proxies(settings)
+        if not urls:
+            raise NotConfigured("PROXY_ENABLED needs proxies in PROXY_LIST or PROXY_LIST_FILE")
+        pool = ProxyPool(
+            urls,
+            quarantine_seconds=settings.getfloat("PROXY_QUARANTINE_SECONDS", 300),
+            max_quarantine_seconds=settings.getfloat("PROXY_MAX_QUARANTINE_SECONDS", 3600),
+            max_errors=settings.getint("PROXY_MAX_ERRORS", 3),
+        )
+        errors = [load_object(x) if isinstance(x, str) else x for x in settings.getlist("RETRY_EXCEPTIONS")]
+        return cls(
+            pool,
+            ban_codes=[int(code) for code in settings.getlist("PROXY_BAN_HTTP_CODES", [403, 429])],
+            max_switches=settings.getint("PROXY_MAX_SWITCHES", 2),
+            images=settings.getbool("PROXY_IMAGES"),
+            errors=errors,
+            stats=crawler.stats,
+        )
+
+    def process_request(self, request, spider):
+        # A request sent again carries the proxy of its last attempt
+        request.meta.pop("pool_proxy", None)
+        if "proxy" in request.meta and not request.meta.get("pool_assigned"):
+            return None
+        kind = download_kind(request)
+        if kind == "image" and not self.images:
+            return None
+        proxy = self.pool.pick(request.meta.get("city_id"))
+        if proxy is None:
+            self.inc_stat("proxy/pool/exhausted")
+            return deferLater(reactor, self.pool.next_release(), self.process_request, request, spider)
+        request.meta["proxy"] = request.meta["pool_proxy"] = proxy.url
+        request.meta["pool_assigned"] = True
+        if kind == "html":
+            request.meta["download_slot"] = f"{urlparse_cached(request).hostname}@{proxy.name}"
+        proxy.in_flight += 1
+        proxy.counts["requests"] += 1
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = self.release(request)
+        if proxy is None or "cached" in response.flags:
+            return response
+        if response.status not in self.ban_codes:
+            self.pool.succeeded(proxy, request.meta.get("download_latency"))
+            self.update_stats(proxy)
+            return response
+        seconds = self.pool.banned(proxy)
+        spider.logger.warning(f"Proxy {proxy.name} quarantined for {seconds:.0f}s after HTTP {response.status}")
+        self.update_stats(proxy)
+        switches = request.meta.get("proxy_switches", 0)
+        if switches >= self.max_switches:
+            return response
+        self.inc_stat("proxy/switches")
+        retry = request.replace(dont_filter=True)
+        retry.meta["proxy_switches"] = switches + 1
+        return retry
+
+    def process_exception(self, request, exception, spider):
+        proxy = self.release(request)
+        if proxy is not None and isinstance(exception, self.errors):
+            seconds = self.pool.failed(proxy)
+            if seconds is not None:
+                spider.logger.warning(
+                    f"Proxy {proxy.name} quarantined for {seconds:.0f}s after {self.pool.max_errors} errors"
+                )
+            self.update_stats(proxy)
+        return None
+
+    def release(self, request):
+        """Return the proxy a request went through, no longer in flight."""
+        proxy = self.pool.by_url.get(request.meta.pop("pool_proxy", None))
+        if proxy is not None:
+            proxy.in_flight -= 1
+        return proxy
+
+    def update_stats(self, proxy):
+        if self.stats is None:
+            return
+        prefix = f"proxy/{proxy.name}"
+        for name, value in proxy.counts.items():
+            self.stats.set_value(f"{prefix}/{name}", value)
+        self.stats.set_value(f"{prefix}/success", round(proxy.success, 3))
+        if proxy.latency is not None:
+            self.stats.set_value(f"{prefix}/latency", round(proxy.latency, 3))
+        self.stats.set_value("proxy/pool/size", len(self.pool.proxies))
+        self.stats.set_value("proxy/pool/available", self.pool.available())
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
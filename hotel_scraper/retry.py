@@ -0,0 +1,339 @@
+"""Retries with backoff, per-host retry budgets and circuit breakers.
+
+``HostRetryMiddleware`` replaces Scrapy's retry middleware. Requests that
+fail with one of ``RETRY_HTTP_CODES`` or ``RETRY_EXCEPTIONS`` are retried up
+to ``RETRY_TIMES`` times, each after a random wait of up to
+``RETRY_BACKOFF_BASE * 2 ** (retry - 1)`` seconds, capped at
+``RETRY_BACKOFF_MAX`` ("full jitter"), or as long as ``Retry-After`` asks.
+Waiting retries don't hold a place in their download slot.
+
+Every host has a ``RetryBudget``: it earns ``RETRY_BUDGET_RATIO`` of a retry
+per request sent and starts with ``RETRY_BUDGET_RESERVE``, so a host that
+fails all the time gets a fraction more traffic rather than ``RETRY_TIMES``
+times as much.
+
+Every host also has a ``CircuitBreaker`` fed with the outcome of its
+requests. Once at least ``CIRCUIT_ERROR_RATIO`` of the last
+``CIRCUIT_WINDOW`` requests failed, the circuit opens and requests to the
+host are not sent for ``CIRCUIT_OPEN_SECONDS``. It then lets a single probe
+through: if it succeeds the circuit closes, otherwise it opens again for
+twice as long, up to ``CIRCUIT_MAX_OPEN_SECONDS``. Network errors of
+requests sent through a proxy may be the proxy's rather than the host's, so
+they are left to the proxy pool and don't count against the host's circuit;
+they are still retried.
+
+With ``RETRY_DEFER_FAILED``, requests turned away by an open circuit, and
+requests that used up their retries, are put off to the end of the crawl
+instead of being dropped. When the spider runs out of other work, they are
+sent again host by host as the circuits let them through, for at most
+``RETRY_DEFERRED_TIMEOUT`` seconds. Requests with an errback, like those of
+the frontier, and requests with ``dont_defer`` in their meta are left to
+their owner.
+"""
+
+import random
+from collections import Counter, deque
+from time import monotonic
+
+from scrapy import signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.response import response_status_message
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from hotel_scraper.middlewares import retry_after_seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class HostUnavailable(IgnoreRequest):
+    """A request was not sent because the circuit of its host is open."""
+
+
+def backoff_delay(retry, base=1.0, cap=30.0, rng=random):
+    """Return a random wait in seconds before retry number ``retry``."""
+    return rng.uniform(0, min(cap, base * 2 ** (retry - 1)))
+
+
+class CircuitBreaker:
+    """Stop sending requests to a host whose recent requests mostly fail.
+
+    Closed, it records whether each of the last ``window`` requests
+    succeeded, and opens once at least ``min_requests`` were recorded and
+    ``error_ratio`` of them failed. Open, it lets nothing through for
+    ``open_seconds``. Half-open, it lets one probe through at a time and
+    closes when a request succeeds, or opens again for twice as long, up to
+    ``max_open_seconds``, when it fails.
+    """
+
+    def __init__(self, window=20, min_requests=5, error_ratio=0.5, open_seconds=30.0,
+                 max_open_seconds=300.0, clock=monotonic):
+        self.outcomes = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.error_ratio = error_ratio
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.open_for = open_seconds
+        self.opened_until = 0.0
+        self.probe_sent = None
+        # Times opened, probes sent and requests turned away
+        self.counts = Counter()
+
+    def ready(self):
+        """Return whether a request would be let through now."""
+        if self.state == CLOSED:
+            return True
+        now = self.clock()
+        if self.state == OPEN:
+            return now >= self.opened_until
+        # A probe that never reports back is replaced after a while
+        return self.probe_sent is None or now - self.probe_sent >= self.open_for
+
+    def allow(self):
+        """Return whether a request may be sent, counting it as the probe when half-open."""
+        if self.state == CLOSED:
+            return True
+        if not self.ready():
+            self.counts["rejected"] += 1
+            return False
+        self.state = HALF_OPEN
+        self.probe_sent = self.clock()
+        self.counts["probes"] += 1
+        return True
+
+    def record(self, ok):
+        """Record whether a request succeeded; return whether the state changed."""
+        if self.state == OPEN:
+            # Answers to requests sent before it opened
+            return False
+        if self.state == HALF_OPEN:
+            if ok:
+                self.state = CLOSED
+                self.open_for = self.open_seconds
+                self.outcomes.clear()
+            else:
+                self.open_for = min(self.max_open_seconds, self.open_for * 2)
+                self.trip()
+            return True
+        self.outcomes.append(ok)
+        failures = len(self.outcomes) - sum(self.outcomes)
+        if len(self.outcomes) >= self.min_requests and failures >= self.error_ratio * len(self.outcomes):
+            self.trip()
+            return True
+        return False
+
+    def trip(self):
+        self.state = OPEN
+        self.opened_until = self.clock() + self.open_for
+        self.probe_sent = None
+        self.outcomes.clear()
+        self.counts["opened"] += 1
+
+
+class RetryBudget:
+    """The retries a host may still get.
+
+    Every request sent earns ``ratio`` of a retry, up to ``limit``, on top
+    of a starting ``reserve``, and every retry spends one.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10, limit=100):
+        self.ratio = ratio
+        self.limit = limit
+        self.tokens = float(reserve)
+
+    def request(self):
+        self.tokens = min(self.limit, self.tokens + self.ratio)
+
+    def spend(self):
+        """Take a retry from the budget; return False if it is spent."""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class HostRetryMiddleware(RetryMiddleware):
+    """Retry failed downloads with backoff, within per-host budgets and circuits.
+
+    See the module docstring. Enable it in place of
+    ``scrapy.downloadermiddlewares.retry.RetryMiddleware``, at the same
+    order. It is configured with the ``RETRY_*`` and ``CIRCUIT_*`` settings,
+    and reports under ``retry/*`` and ``circuit/*`` in the crawl stats.
+    """
+
+    def __init__(self, settings, stats=None, crawler=None, clock=monotonic, rng=random):
+        super().__init__(settings)
+        self.stats = stats
+        self.crawler = crawler
+        self.clock = clock
+        self.rng = rng
+        self.backoff_base = settings.getfloat("RETRY_BACKOFF_BASE", 1.0)
+        self.backoff_max = settings.getfloat("RETRY_BACKOFF_MAX", 30.0)
+        self.budget_ratio = settings.getfloat("RETRY_BUDGET_RATIO", 0.2)
+        self.budget_reserve = settings.getint("RETRY_BUDGET_RESERVE", 10)
+        self.circuit = {
+            "window": settings.getint("CIRCUIT_WINDOW", 20),
+            "min_requests": settings.getint("CIRCUIT_MIN_REQUESTS", 5),
+            "error_ratio": settings.getfloat("CIRCUIT_ERROR_RATIO", 0.5),
+            "open_seconds": settings.getfloat("CIRCUIT_OPEN_SECONDS", 30),
+            "max_open_seconds": settings.getfloat("CIRCUIT_MAX_OPEN_SECONDS", 300),
+        }
+        self.defer_failed = settings.getbool("RETRY_DEFER_FAILED", True)
+        self.deferred_timeout = settings.getfloat("RETRY_DEFERRED_TIMEOUT", 600)
+        self.breakers = {}
+        self.budgets = {}
+        # Requests put off to the end of the crawl, by host
+        self.deferred = {}
+        self.draining_since = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler.settings, crawler.stats, crawler)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        return s
+
+    def breaker(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(clock=self.clock, **self.circuit)
+        return breaker
+
+    def budget(self, host):
+        budget = self.budgets.get(host)
+        if budget is None:
+            budget = self.budgets[host] = RetryBudget(self.budget_ratio, self.budget_reserve)
+        return budget
+
+    def process_request(self, request, spider):
+        delay = request.meta.pop("retry_delay", 0)
+        if delay > 0:
+            # The circuit may open while the retry waits, so check it afterwards
+            return deferLater(reactor, delay, self.process_request, request, spider)
+        host = urlparse_cached(request).hostname
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            self.inc_stat("circuit/rejected")
+            self.defer(request, host)
+            raise HostUnavailable(f"Circuit open for {host}")
+        if breaker.state == HALF_OPEN:
+            self.inc_stat("circuit/probes")
+        if not request.meta.get("retry_times"):
+            self.budget(host).request()
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags:
+            return response
+        host = urlparse_cached(request).hostname
+        failed = response.status in self.retry_http_codes
+        self.record(host, not failed, spider)
+        if not failed or request.meta.get("dont_retry", False):
+            return response
+        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        new_request = self.retry(request, response_status_message(response.status), spider, host, retry_after)
+        if new_request is not None:
+            return new_request
+        if self.defer(request, host, failed=True):
+            raise IgnoreRequest(f"Deferred {request.url} to the end of the crawl")
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, self.exceptions_to_retry):
+            return None
+        host = urlparse_cached(request).hostname
+        # A dead proxy mustn't open the circuit of a healthy host
+        if not request.meta.get("proxy"):
+            self.record(host, False, spider)
+        if request.meta.get("dont_retry", False):
+            return None
+        new_request = self.retry(request, exception, spider, host)
+        if new_request is None and self.defer(request, host, failed=True):
+            raise IgnoreRequest(f"Deferred {request.url} to the end of the crawl")
+        return new_request
+
+    def record(self, host, ok, spider):
+        breaker = self.breaker(host)
+        if not breaker.record(ok):
+            return
+        if breaker.state == OPEN:
+            spider.logger.warning(f"Circuit for {host} opened for {breaker.open_for:.0f}s")
+            self.inc_stat("circuit/opened")
+        else:
+            spider.logger.info(f"Circuit for {host} closed")
+        if self.stats is not None:
+            self.stats.set_value(f"circuit/{host}/state", breaker.state)
+
+    def retry(self, request, reason, spider, host, retry_after=None):
+        """Return the retry of a failed request, or None if it gets none."""
+        retries = request.meta.get("retry_times", 0)
+        if retries < request.meta.get("max_retry_times", self.max_retry_times) \
+                and not self.budget(host).spend():
+            self.inc_stat("retry/budget_exhausted")
+            return None
+        new_request = self._retry(request, reason, spider)
+        if new_request is not None:
+            delay = backoff_delay(retries + 1, self.backoff_base, self.backoff_max, self.rng)
+            new_request.meta["retry_delay"] = min(self.backoff_max, max(delay, retry_after or 0))
+        return new_request
+
+    def defer(self, request, host, failed=False):
+        """Put a request off to the end of the crawl; return whether it was.
+
+        Requests that failed are put off once, with fresh retries.
+        """
+        if not self.defer_failed or request.errback is not None or request.meta.get("dont_defer"):
+            return False
+        if failed and request.meta.get("deferred"):
+            return False
+        request = request.replace(dont_filter=True)
+        if failed:
+            request.meta["deferred"] = True
+            request.meta["retry_times"] = 0
+        self.deferred.setdefault(host, []).append(request)
+        self.inc_stat("retry/deferred")
+        return True
+
+    def spider_idle(self, spider):
+        """Send the deferred requests of every host its circuit lets through.
+
+        All of them once the circuit is closed, otherwise one as a probe.
+        """
+        if not self.deferred:
+            return
+        now = self.clock()
+        if self.draining_since is None:
+            self.draining_since = now
+        elif now - self.draining_since > self.deferred_timeout:
+            dropped = sum(len(requests) for requests in self.deferred.values())
+            spider.logger.warning(
+                f"Giving up on {dropped} deferred requests to {', '.join(sorted(self.deferred))}"
+            )
+            self.inc_stat("retry/deferred_dropped", dropped)
+            self.deferred.clear()
+            return
+        for host in list(self.deferred):
+            breaker = self.breaker(host)
+            if not breaker.ready():
+                continue
+            requests = self.deferred[host]
+            if breaker.state == CLOSED:
+                released, self.deferred[host] = requests, []
+            else:
+                released = [requests.pop(0)]
+            if not self.deferred[host]:
+                del self.deferred[host]
+            for request in released:
+                self.crawler.engine.crawl(request)
+            self.inc_stat("retry/deferred_released", len(released))
+        raise DontCloseSpider
+
+    def inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
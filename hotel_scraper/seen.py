@@ -0,0 +1,216 @@
+"""Persistent seen-sets: scalable Bloom filters in memory-mapped files.
+
+A ``ScalableBloomFilter`` remembers keys, such as request fingerprints or
+hotel property ids, across runs in a few MB per million keys. It is a
+series of fixed-size Bloom filters, each a file mapped into memory, so
+opening one is instant however many keys it holds and the OS pages in only
+the parts in use. When the newest filter is full, a new one with twice the
+capacity and a tighter error rate is added, which keeps the false positive
+rate of the whole series under ``error_rate`` however many keys are added.
+
+A filter belongs to a crawl window: once it is ``max_age`` seconds old it
+is cleared when opened, so keys are remembered across the runs of one
+window, e.g. a day, and not forever.
+
+``BloomDupeFilter`` uses one as Scrapy's ``DUPEFILTER_CLASS``::
+
+    DUPEFILTER_CLASS = "hotel_scraper.seen.BloomDupeFilter"
+
+and the spider uses another to skip hotels already scraped in the window
+when ``SEEN_ENABLED`` is set. A seen-set directory must only be opened by
+one process at a time.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timezone
+
+from scrapy.dupefilters import RFPDupeFilter
+
+# Magic, capacity, error rate, hash count, bit count, key count, created at
+HEADER = struct.Struct("<8sQdIQQd")
+MAGIC = b"HSBLOOM1"
+MASK64 = (1 << 64) - 1
+
+
+def _key_bytes(key):
+    return key if isinstance(key, bytes) else str(key).encode("utf-8")
+
+
+class BloomFilter:
+    """A fixed-capacity Bloom filter in a memory-mapped file.
+
+    The file is created for ``capacity`` keys at ``error_rate`` if it
+    doesn't exist; an existing file keeps the parameters it was made with.
+    """
+
+    def __init__(self, path, capacity=1000000, error_rate=0.001, created_at=None):
+        self.path = path
+        if not os.path.exists(path):
+            self._create(path, capacity, error_rate, created_at or time.time())
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.capacity, self.error_rate, self.hashes, self.bits, self.count, self.created_at = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Bloom filter")
+
+    @staticmethod
+    def _create(path, capacity, error_rate, created_at):
+        # Written aside and renamed, so a crash never leaves a truncated filter behind
+        bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, capacity, error_rate, hashes, bits, 0, created_at))
+            f.truncate(HEADER.size + (bits + 7) // 8)
+        os.replace(tmp_path, path)
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher: k positions from the two halves of one digest
+        digest = hashlib.blake2b(_key_bytes(key), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [((h1 + i * h2) & MASK64) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        data = self.map
+        return all(data[HEADER.size + position // 8] & (1 << position % 8) for position in self._positions(key))
+
+    def add(self, key):
+        """Add a key; return False if it was (probably) already there."""
+        data, added = self.map, False
+        for position in self._positions(key):
+            offset, bit = HEADER.size + position // 8, 1 << position % 8
+            if not data[offset] & bit:
+                data[offset] |= bit
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def flush(self):
+        """Write the key count and the bits set so far to the file."""
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.error_rate, self.hashes, self.bits,
+                         self.count, self.created_at)
+        self.map.flush()
+
+    def close(self):
+        if not self.map.closed:
+            self.flush()
+            self.map.close()
+        self.file.close()
+
+
+class ScalableBloomFilter:
+    """A growing series of Bloom filters in a directory, for a crawl window.
+
+    ``add`` returns False for keys (probably) added before, in this run or
+    in an earlier run of the same window. Filters are ``filter-NNN.bloom``
+    files, the first for ``initial_capacity`` keys, each next one ``growth``
+    times larger with ``tightening`` times the error rate of the previous.
+    """
+
+    def __init__(self, directory, initial_capacity=1000000, error_rate=0.001, max_age=None,
+                 growth=2, tightening=0.5):
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(name for name in os.listdir(directory) if name.startswith("filter-"))
+        self.filters = [BloomFilter(os.path.join(directory, name)) for name in names]
+        if self.filters and max_age is not None and time.time() - self.filters[0].created_at > max_age:
+            self.clear()
+        if not self.filters:
+            self._grow()
+
+    @property
+    def created_at(self):
+        """When the window of the filter started, as an aware datetime."""
+        return datetime.fromtimestamp(self.filters[0].created_at, timezone.utc)
+
+    def _grow(self):
+        index = len(self.filters)
+        # Error rates shrink geometrically, so their sum stays under error_rate
+        self.filters.append(BloomFilter(
+            os.path.join(self.directory, f"filter-{index:03}.bloom"),
+            capacity=self.initial_capacity * self.growth ** index,
+            error_rate=self.error_rate * (1 - self.tightening) * self.tightening ** index,
+            created_at=self.filters[0].created_at if self.filters else None,
+        ))
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in reversed(self.filters))
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, key):
+        """Add a key; return False if it was (probably) added before."""
+        if key in self:
+            return False
+        if self.filters[-1].full:
+            self._grow()
+        return self.filters[-1].add(key)
+
+    def clear(self):
+        """Forget every key and start a new window."""
+        for bloom in self.filters:
+            bloom.close()
+            os.remove(bloom.path)
+        self.filters = []
+        self._grow()
+
+    def flush(self):
+        for bloom in self.filters:
+            bloom.flush()
+
+    def close(self):
+        for bloom in self.filters:
+            bloom.close()
+
+
+def open_seen_set(settings, name):
+    """Open the seen-set ``name`` under ``SEEN_DIR`` as configured in settings."""
+    return ScalableBloomFilter(
+        os.path.join(settings.get("SEEN_DIR", "seen"), name),
+        initial_capacity=settings.getint("SEEN_INITIAL_CAPACITY", 1000000),
+        error_rate=settings.getfloat("SEEN_ERROR_RATE", 0.001),
+        max_age=settings.getfloat("SEEN_WINDOW_SECONDS", 86400) or None,
+    )
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """Scrapy dupefilter remembering request fingerprints for the crawl window.
+
+    Unlike the default dupefilter, whose fingerprints are lost when the run
+    ends, or kept in a plain text file under ``JOBDIR``, requests seen by an
+    earlier run of the window are filtered too, in bounded memory. Requests
+    with ``dont_filter`` are never filtered, as usual.
+    """
+
+    def __init__(self, seen, debug=False, *, fingerprinter=None):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.seen = seen
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(open_seen_set(settings, "requests"), settings.getbool("DUPEFILTER_DEBUG"),
+                   fingerprinter=crawler.request_fingerprinter)
+
+    def request_seen(self, request):
+        return not self.seen.add(self.request_fingerprint(request))
+
+    def close(self, reason):
+        self.seen.close()
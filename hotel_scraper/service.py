@@ -0,0 +1,368 @@
+"""Read-only HTTP query service over the scraped cities and hotels.
+
+Run it next to the database with::
+
+    python -m hotel_scraper.service [--host 0.0.0.0] [--port 8000]
+
+Endpoints, all answering JSON:
+
+    GET /cities
+        Every city with its hotel count, price range, median price and
+        average rating, read from the ``city_stats`` table.
+    GET /hotels?city=&min_price=&max_price=&min_rating=&sort=&limit=&cursor=
+        One page of hotels, filtered by city name, price range and rating
+        floor. ``sort`` is ``id`` (the default), ``price``, ``rating`` or
+        ``name``, prefixed with ``-`` for descending order. Hotels without
+        a value for the sort column are left out. The response carries a
+        ``next_cursor`` to pass as ``cursor`` for the next page.
+    GET /changes?after=&limit=
+        The hotels inserted, updated or retired by crawls, oldest first,
+        from the change feed (see ``hotel_scraper.changes``). Pass the
+        ``next_after`` of the response as ``after`` to read on.
+
+Pages are fetched with keyset pagination: the cursor holds the sort value
+and id of the last hotel of the previous page, and the next page starts
+right after it with ``WHERE (price, id) > (:price, :id)``, so deep pages
+cost the same as the first one, unlike ``OFFSET``.
+
+Responses are kept in an in-process LRU cache for ``SERVICE_CACHE_TTL``
+seconds. Every time the database pipeline writes hotels of a city it bumps
+the city's ``updated_at``; the service polls those every
+``SERVICE_INVALIDATE_INTERVAL`` seconds and drops the cached responses of
+the cities that changed.
+
+Queries run on a thread pool, so the reactor keeps serving cached
+responses while the database works.
+"""
+
+import argparse
+import base64
+import json
+from collections import OrderedDict
+from time import monotonic
+
+from sqlalchemy import func, select, tuple_
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from hotel_scraper.changes import changes_since
+from hotel_scraper.database import get_engine
+from hotel_scraper.models import City, CityStats, Hotel
+
+SORT_COLUMNS = ("id", "price", "rating", "name")
+HOTEL_COLUMNS = (
+    "id", "property_id", "name", "rating", "location", "latitude", "longitude",
+    "room_type", "price", "image_url", "image_path",
+)
+CITY_STATS_COLUMNS = ("min_price", "median_price", "max_price", "avg_rating")
+
+
+class BadRequest(ValueError):
+    """A query parameter is missing or malformed."""
+
+
+class ResponseCache:
+    """LRU cache of encoded responses, each expiring after ``ttl`` seconds.
+
+    Entries are tagged with the city they depend on, or None if they
+    depend on every city, so that a change to a city only drops the
+    entries that may show it.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0, clock=monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, value, city=None):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        self.entries[key] = (self.clock() + self.ttl, city, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, cities):
+        """Drop the entries showing any of ``cities``, or that show every city."""
+        stale = [key for key, (_, city, _) in self.entries.items() if city is None or city in cities]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+
+class HotelQueries:
+    """The queries behind the service, run on worker threads."""
+
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else get_engine()
+
+    def cities(self):
+        """Return every city with the aggregates of its listed hotels."""
+        cities = City.__table__
+        stats = CityStats.__table__
+        query = (
+            select(cities.c.id, cities.c.name, func.coalesce(stats.c.hotels, 0).label("hotels"),
+                   *(stats.c[name] for name in CITY_STATS_COLUMNS))
+            .select_from(cities.outerjoin(stats, stats.c.city_id == cities.c.id))
+            .order_by(cities.c.name)
+        )
+        with self.engine.connect() as connection:
+            return [dict(row) for row in connection.execute(query).mappings()]
+
+    def changes(self, after=0, limit=50):
+        """Return a page of the change feed and the ``after`` of the next page."""
+        changes = changes_since(after, limit, engine=self.engine)
+        return {"changes": changes, "next_after": changes[-1]["id"] if changes else after}
+
+    def city_versions(self):
+        """Return when each city last had hotels written, by name."""
+        cities = City.__table__
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(cities.c.name, cities.c.updated_at)).all())
+
+    def hotels(self, city=None, min_price=None, max_price=None, min_rating=None, sort="id", limit=50,
+               cursor=None):
+        """Return a page of hotels and the cursor of the next page, if any."""
+        hotels = Hotel.__table__
+        cities = City.__table__
+        descending = sort.startswith("-")
+        field = sort.lstrip("-")
+        column = hotels.c[field]
+        query = (
+            select(*(hotels.c[name] for name in HOTEL_COLUMNS), cities.c.name.label("city"))
+            .select_from(hotels.outerjoin(cities, hotels.c.city_id == cities.c.id))
+            .where(func.coalesce(hotels.c.retired, False).is_(False))
+        )
+        if city is not None:
+            city_id = select(cities.c.id).where(cities.c.name == city).scalar_subquery()
+            query = query.where(hotels.c.city_id == city_id)
+        if min_price is not None:
+            query = query.where(hotels.c.price >= min_price)
+        if max_price is not None:
+            query = query.where(hotels.c.price <= max_price)
+        if min_rating is not None:
+            query = query.where(hotels.c.rating >= min_rating)
+
+        if field == "id":
+            key, order = hotels.c.id, [hotels.c.id]
+        else:
+            query = query.where(column.is_not(None))
+            key, order = tuple_(column, hotels.c.id), [column, hotels.c.id]
+        if cursor is not None:
+            after = cursor[0] if field == "id" else tuple_(*cursor)
+            query = query.where(key < after if descending else key > after)
+        if descending:
+            order = [part.desc() for part in order]
+        query = query.order_by(*order).limit(limit + 1)
+
+        with self.engine.connect() as connection:
+            rows = [dict(row) for row in connection.execute(query).mappings()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, [last["id"]] if field == "id" else [last[field], last["id"]])
+        return {"hotels": rows, "next_cursor": next_cursor}
+
+
+def encode_cursor(sort, values):
+    return base64.urlsafe_b64encode(json.dumps([sort] + values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """Return the key values in a cursor made for the given sort."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("Malformed cursor") from None
+    expected = 2 if sort.lstrip("-") == "id" else 3
+    if not isinstance(values, list) or len(values) != expected or values[0] != sort:
+        raise BadRequest("Cursor does not belong to this sort order")
+    return tuple(values[1:])
+
+
+class QueryService(Resource):
+    """Twisted web resource serving the read-only query API."""
+
+    isLeaf = True
+
+    def __init__(self, queries, cache=None, page_size=50, max_page_size=500, invalidate_interval=5.0,
+                 clock=monotonic):
+        super().__init__()
+        self.queries = queries
+        self.cache = cache if cache is not None else ResponseCache()
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.invalidate_interval = invalidate_interval
+        self.clock = clock
+        self.versions = None
+        self.checked_at = None
+        self.waiters = None
+
+    def render_GET(self, request):
+        path = request.path.decode("utf-8").rstrip("/")
+        args = {key.decode("utf-8"): values[-1].decode("utf-8") for key, values in request.args.items()}
+        dfd = self.check_versions()
+        dfd.addCallback(lambda _: self.respond(path, args))
+        dfd.addCallbacks(self._write, self._failed, callbackArgs=(request,), errbackArgs=(request,))
+        return NOT_DONE_YET
+
+    def respond(self, path, args):
+        """Return a Deferred firing with the status and body of a request."""
+        if path == "/cities":
+            query, params, city = self.queries.cities, {}, None
+        elif path == "/hotels":
+            query, params = self.queries.hotels, self.hotel_params(args)
+            city = params["city"]
+        elif path == "/changes":
+            query, params, city = self.queries.changes, self.change_params(args), None
+        else:
+            raise BadRequest(f"Unknown path {path}")
+        key = (path, tuple(sorted(params.items())))
+        body = self.cache.get(key)
+        if body is not None:
+            return 200, body
+        dfd = deferToThread(query, **params)
+        dfd.addCallback(self._encode)
+        dfd.addCallback(self._store, key, city)
+        return dfd
+
+    def hotel_params(self, args):
+        unknown = set(args) - {"city", "min_price", "max_price", "min_rating", "sort", "limit", "cursor"}
+        if unknown:
+            raise BadRequest(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        sort = args.get("sort", "id")
+        if sort.lstrip("-") not in SORT_COLUMNS:
+            raise BadRequest(f"sort must be one of {', '.join(SORT_COLUMNS)}, optionally prefixed with -")
+        limit = _number(args, "limit", int) or self.page_size
+        if not 0 < limit <= self.max_page_size:
+            raise BadRequest(f"limit must be between 1 and {self.max_page_size}")
+        return {
+            "city": args.get("city"),
+            "min_price": _number(args, "min_price", float),
+            "max_price": _number(args, "max_price", float),
+            "min_rating": _number(args, "min_rating", float),
+            "sort": sort,
+            "limit": limit,
+            "cursor": decode_cursor(args["cursor"], sort) if args.get("cursor") else None,
+        }
+
+    def change_params(self, args):
+        unknown = set(args) - {"after", "limit"}
+        if unknown:
+            raise BadRequest(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        limit = _number(args, "limit", int) or self.page_size
+        if not 0 < limit <= self.max_page_size:
+            raise BadRequest(f"limit must be between 1 and {self.max_page_size}")
+        return {"after": _number(args, "after", int) or 0, "limit": limit}
+
+    def check_versions(self):
+        """Drop cached responses of cities written since the last check."""
+        waiter = Deferred()
+        if self.waiters is not None:
+            # A check is running, wait for it
+            self.waiters.append(waiter)
+            return waiter
+        now = self.clock()
+        if self.checked_at is not None and now - self.checked_at < self.invalidate_interval:
+            return succeed(None)
+        self.checked_at = now
+        self.waiters = [waiter]
+        dfd = deferToThread(self.queries.city_versions)
+        dfd.addCallback(self._versions_checked)
+        dfd.addBoth(self._checked)
+        return waiter
+
+    def _versions_checked(self, versions):
+        if self.versions is not None and versions != self.versions:
+            changed = {name for name in set(versions) | set(self.versions)
+                       if versions.get(name) != self.versions.get(name)}
+            self.cache.invalidate(changed)
+        self.versions = versions
+
+    def _checked(self, result):
+        if isinstance(result, Failure):
+            # Retried on the next request
+            log.err(result, "Checking for updated cities failed")
+        waiters, self.waiters = self.waiters, None
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def _encode(self, result):
+        return 200, json.dumps(result, default=str).encode("utf-8")
+
+    def _store(self, response, key, city):
+        self.cache.put(key, response[1], city)
+        return response
+
+    def _write(self, response, request):
+        status, body = response
+        request.setResponseCode(status)
+        request.setHeader(b"Content-Type", b"application/json")
+        request.write(body)
+        request.finish()
+
+    def _failed(self, failure, request):
+        if failure.check(BadRequest):
+            response = 400, json.dumps({"error": str(failure.value)}).encode("utf-8")
+        else:
+            log.err(failure, "Hotel query failed")
+            response = 500, json.dumps({"error": "Internal error"}).encode("utf-8")
+        self._write(response, request)
+
+
+def _number(args, name, kind):
+    value = args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a number") from None
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+    from twisted.internet import reactor
+
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(description="Serve the scraped hotels over HTTP.")
+    parser.add_argument("--host", default=settings.get("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=settings.getint("SERVICE_PORT", 8000))
+    parser.add_argument("--cache-ttl", type=float, default=settings.getfloat("SERVICE_CACHE_TTL", 60.0),
+                        help="seconds responses are cached, 0 to disable the cache")
+    args = parser.parse_args()
+
+    reactor.suggestThreadPoolSize(settings.getint("SERVICE_THREADS", 10))
+    service = QueryService(
+        HotelQueries(get_engine(settings)),
+        ResponseCache(settings.getint("SERVICE_CACHE_SIZE", 1024), args.cache_ttl),
+        page_size=settings.getint("SERVICE_PAGE_SIZE", 50),
+        max_page_size=settings.getint("SERVICE_MAX_PAGE_SIZE", 500),
+        invalidate_interval=settings.getfloat("SERVICE_INVALIDATE_INTERVAL", 5.0),
+    )
+    reactor.listenTCP(args.port, Site(service), interface=args.host)
+    print(f"Serving hotels on http://{args.host}:{args.port}")
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
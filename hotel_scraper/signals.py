@@ -0,0 +1,24 @@
+"""Signals sent by the spider and pipelines for the crawl metrics and checkpoints.
+
+Like Scrapy's own signals, they are sent with
+``crawler.signals.send_catch_log(signal, **kwargs)`` and cost next to
+nothing when nothing is connected to them.
+"""
+
+# A stage of work finished: stage name, duration in seconds, and optionally
+# the city, the number of bytes handled (size) and the number of things
+# produced (count). Stages are "extract", "hotels", "image_store" and
+# "db_flush".
+stage_finished = object()
+
+# An image could not be stored: url, reason ("http_<status>", "invalid",
+# "error") and optionally the city.
+image_failed = object()
+
+# A batch of hotels was written to the database: items, the items of the
+# batch, whether they changed or not.
+hotels_stored = object()
+
+# An image put off to the end of the crawl was stored: url, info (sha256,
+# path, width, height and variants, as for an item) and the city.
+image_recovered = object()
@@ -1,36 +1,178 @@
 import scrapy
-import json
-import re
 import random
 import os
-import requests
 import shutil
-from hotel_scraper.models import Base
-from hotel_scraper.database import SessionLocal
-from hotel_scraper.models import City, Hotel
+from datetime import datetime, timezone
+from time import perf_counter
+from scrapy import signals
+from itemadapter import ItemAdapter
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet.defer import DeferredLock
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from hotel_scraper.changes import record_cleared
+from hotel_scraper.database import SessionLocal, get_engine
+from hotel_scraper import signals as hotel_signals
+from hotel_scraper.checkpoint import FINISHED, PAUSED, RUNNING, Checkpoint
+from hotel_scraper.extractor import extract_ibu_hotel, find_payload, HomepageSchema, HotelListSchema
+from hotel_scraper.frontier import Frontier
+from hotel_scraper.items import HotelItem, list_page, list_position
+from hotel_scraper.migrations import migrate
+from hotel_scraper.seen import open_seen_set
+from hotel_scraper.models import City, CityStats, Hotel, ImageRecord
+
+
+def city_sort_key(city):
+    """Order cities by id, numerically where the id is a number."""
+    city_id = city["id"]
+    if isinstance(city_id, int) or str(city_id).isdigit():
+        return 0, int(city_id), ""
+    return 1, 0, str(city_id)
 
 
 class CityAndHotelsSpider(scrapy.Spider):
     name = "city_hotels"
     start_urls = ['https://uk.trip.com/hotels/?locale=en-GB&curr=GBP']
+    list_url = "https://uk.trip.com/hotels/list?city={city_id}"
+    incremental = False
+    images_dir = "images"
+
+    # "sample" scrapes a few hotels of a few random cities; "full" scrapes
+    # every city and follows its hotel list pages until they run out;
+    # "frontier" does the same with the work shared through the database
+    # between any number of spider processes
+    crawl_mode = "sample"
+    sample_cities = 3
+    sample_hotels = 5
+    max_pages = 0  # Per-city page budget in full and frontier mode, 0 for no limit
+    frontier = None
+    frontier_batch_size = 16
+    # Property ids stored by any run of the crawl window, with SEEN_ENABLED
+    seen_hotels = None
+    # Progress of a full crawl saved every checkpoint_interval seconds, with
+    # CHECKPOINT_ENABLED, and Scrapy's JOBDIR queueing requests on disk
+    checkpoint = None
+    checkpoint_interval = 30.0
+    jobdir = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Cities whose hotel list was read to the end in this crawl
+        self.completed_cities = set()
+        self.city_hotel_ids = {}
+        # Frontier calls running on worker threads, and whether the crawl ran out of work
+        self.frontier_calls = 0
+        self.frontier_drained = False
+        # Frontier units whose hotels are still in the pipelines, by list page
+        self.unit_pages = {}
+        self.checkpoint_timer = None
+        self.checkpoint_lock = DeferredLock()
+        # Database engine of the crawl's settings, created when first used
+        self._engine = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider._engine = get_engine(settings)
+        base_url = settings.get("TRIP_BASE_URL", "https://uk.trip.com").rstrip("/")
+        spider.start_urls = [f"{base_url}/hotels/?locale=en-GB&curr=GBP"]
+        spider.list_url = base_url + "/hotels/list?city={city_id}"
+        spider.incremental = settings.getbool("INCREMENTAL_CRAWL")
+        spider.images_dir = settings.get("IMAGES_DIR", "images")
+        # Spider arguments (-a crawl_mode=full -a max_pages=20) take precedence
+        spider.crawl_mode = kwargs.get("crawl_mode", settings.get("CRAWL_MODE", cls.crawl_mode))
+        spider.sample_cities = int(kwargs.get("sample_cities", settings.getint("CRAWL_SAMPLE_CITIES", cls.sample_cities)))
+        spider.sample_hotels = int(kwargs.get("sample_hotels", settings.getint("CRAWL_SAMPLE_HOTELS", cls.sample_hotels)))
+        spider.max_pages = int(kwargs.get("max_pages", settings.getint("CRAWL_MAX_PAGES_PER_CITY", cls.max_pages)))
+        if spider.crawl_mode not in ("sample", "full", "frontier"):
+            raise ValueError(f"Unknown crawl mode: {spider.crawl_mode}")
+        if spider.crawl_mode == "frontier":
+            # Workers started on the same day share a crawl unless it is named
+            crawl = kwargs.get("frontier_crawl", settings.get("FRONTIER_CRAWL")) or \
+                f"{spider.name}-{datetime.now(timezone.utc):%Y-%m-%d}"
+            spider.frontier = Frontier(
+                spider.engine,
+                crawl,
+                worker_id=settings.get("FRONTIER_WORKER_ID"),
+                lease_seconds=settings.getint("FRONTIER_LEASE_SECONDS", 600),
+                max_attempts=settings.getint("FRONTIER_MAX_ATTEMPTS", 3),
+            )
+            spider.frontier_batch_size = settings.getint("FRONTIER_BATCH_SIZE", cls.frontier_batch_size)
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+            crawler.signals.connect(spider.unit_items_done, signal=hotel_signals.hotels_stored)
+            crawler.signals.connect(spider.unit_item_done, signal=signals.item_dropped)
+            crawler.signals.connect(spider.unit_item_done, signal=signals.item_error)
+        if settings.getbool("SEEN_ENABLED"):
+            spider.seen_hotels = open_seen_set(settings, "hotels")
+            crawler.signals.connect(spider.remember_seen, signal=hotel_signals.hotels_stored)
+        if settings.getbool("CHECKPOINT_ENABLED") and spider.crawl_mode == "full":
+            crawl = kwargs.get("checkpoint_crawl", settings.get("CHECKPOINT_CRAWL")) or spider.name
+            spider.checkpoint = Checkpoint(spider.engine, crawl)
+            spider.checkpoint_interval = settings.getfloat("CHECKPOINT_INTERVAL", cls.checkpoint_interval)
+            spider.jobdir = settings.get("JOBDIR")
+            crawler.signals.connect(spider.checkpoint.items_done, signal=hotel_signals.hotels_stored)
+            crawler.signals.connect(spider.checkpoint.item_done, signal=signals.item_dropped)
+            crawler.signals.connect(spider.checkpoint.item_done, signal=signals.item_error)
+        return spider
+
+    @property
+    def engine(self):
+        """Database engine of the crawl's settings, or of the environment outside a crawl."""
+        if self._engine is None:
+            self._engine = get_engine()
+        return self._engine
+
+    @property
+    def seen_since(self):
+        """Earliest time hotels counted as seen by this crawl were scraped.
+
+        That is the start of the crawl window of the seen hotels, or of the
+        checkpointed crawl this one resumed, if any.
+        """
+        starts = []
+        if self.seen_hotels is not None:
+            starts.append(self.seen_hotels.created_at)
+        if self.checkpoint is not None and self.checkpoint.started_at is not None:
+            starts.append(self.checkpoint.started_at)
+        return min(starts, default=None)
+
+    def closed(self, reason):
+        if self.seen_hotels is not None:
+            self.seen_hotels.close()
+        if self.checkpoint_timer is not None:
+            # Any other reason, e.g. a shutdown, leaves the crawl to be resumed
+            if self.checkpoint_timer.running:
+                self.checkpoint_timer.stop()
+            status = FINISHED if reason == "finished" else PAUSED
+            unfinished = self.checkpoint.unfinished()
+            if unfinished:
+                self.logger.info(f"Crawl '{self.checkpoint.crawl}' {status} with {unfinished} cities not read to the end.")
+            return self.save_checkpoint(status)
+
+    def ensure_schema(self):
+        """Create or upgrade the database tables."""
+        migrate(self.engine)
 
     def clear_previous_data(self):
         """Clear previous data and images."""
         # Ensure database tables are created
-        from hotel_scraper.database import engine
-        Base.metadata.create_all(bind=engine)  # Create tables if they don't exist
+        self.ensure_schema()
 
         # Clear images folder
-        folder_path = "images"
+        folder_path = self.images_dir
         if os.path.exists(folder_path):
             shutil.rmtree(folder_path)  # Recursively delete the folder
             self.log(f"Deleted folder: {folder_path}")
 
-        # Clear database tables
-        session = SessionLocal()
+        # Clear database tables, telling the change feed the hotels are gone
+        session = SessionLocal(bind=self.engine)
         try:
+            record_cleared(session, datetime.now(timezone.utc))
             session.query(Hotel).delete()
+            session.query(CityStats).delete()
             session.query(City).delete()
+            session.query(ImageRecord).delete()
             session.commit()
             self.log("Previous data and images cleared.")
         except Exception as e:
@@ -40,178 +182,341 @@ class CityAndHotelsSpider(scrapy.Spider):
             session.close()
 
     def parse(self, response):
-        # Clear previous data and images
-        self.clear_previous_data()
-
-        # Locate the <script> tag containing 'window.IBU_HOTEL'
-        script_data = response.xpath("//script[contains(text(), 'window.IBU_HOTEL')]/text()").get()
-        
-        if script_data:
-            # Extract the JSON-like data within the script
-            json_match = re.search(r'window.IBU_HOTEL\s*=\s*(\{.*?\});', script_data, re.DOTALL)
-            if json_match:
-                raw_json = json_match.group(1)
-                data = json.loads(raw_json)
-                init_data = data.get("initData", {})
-                htls_data = init_data.get("htlsData", {})
-                inbound_cities = htls_data.get("inboundCities", [])
-
-                if not inbound_cities:
-                    self.log("No cities found in the data.")
-                    return
-
-                # Extract city information
-                cities = [{"name": city.get("name", "N/A"), "id": city.get("id", "N/A")} for city in inbound_cities]
-
-                # Select 3 random cities
-                selected_cities = random.sample(cities, min(3, len(cities)))
-
-                for city in selected_cities:
-                    city_id = city["id"]
-                    city_name = city["name"]
-                    self.log(f"Selected city: {city_name} with ID: {city_id}")
-
-                    # Construct URL for the selected city's hotels page
-                    city_url = f"https://uk.trip.com/hotels/list?city={city_id}"
-
-                    # Make a request to fetch hotels for the selected city
-                    yield scrapy.Request(
-                        url=city_url,
-                        callback=self.parse_city_hotels,
-                        meta={"city_name": city_name}
-                    )
-            else:
-                self.log("Failed to extract JSON data from script.")
+        # Incremental and resumed crawls update the stored data in place; full
+        # crawls start over, except in frontier mode where other workers share the data
+        resumed = None
+        if self.incremental or self.frontier is not None or self.checkpoint is not None:
+            self.ensure_schema()
+            resumed = self.open_checkpoint()
+        if not (self.incremental or self.frontier is not None or resumed):
+            self.clear_previous_data()
+
+        # Decode the 'window.IBU_HOTEL' payload straight from the response bytes
+        data = extract_ibu_hotel(response.body, HomepageSchema)
+        if data is None:
+            self.log("Failed to extract JSON data from script.")
+            return
+
+        init_data = data.get("initData") or {}
+        htls_data = init_data.get("htlsData") or {}
+        inbound_cities = htls_data.get("inboundCities") or []
+
+        if not inbound_cities:
+            self.log("No cities found in the data.")
+            return
+
+        # Extract city information
+        cities = [{"name": city.get("name", "N/A"), "id": city.get("id", "N/A")} for city in inbound_cities]
+
+        if self.frontier is not None:
+            # Every worker seeds the same units; they are claimed once idle
+            self.log(f"Seeding the frontier of crawl '{self.frontier.crawl}' with {len(cities)} cities.")
+            self.frontier_call(self.frontier.seed, cities)
+            return
+
+        if self.crawl_mode == "full":
+            # Every city, in a stable order so reruns schedule the same work
+            selected_cities = sorted(cities, key=city_sort_key)
+        else:
+            selected_cities = random.sample(cities, min(self.sample_cities, len(cities)))
+
+        if resumed == PAUSED and self.jobdir_queued():
+            # The pending requests of the paused crawl are queued under JOBDIR
+            self.logger.info(f"Resuming the requests of crawl '{self.checkpoint.crawl}' queued in {self.jobdir}.")
+            return
+
+        for city in selected_cities:
+            page = self.checkpoint.next_page(city["id"]) if self.checkpoint is not None else 1
+            if page is None:
+                continue
+            resume = f" from page {page}" if page > 1 else ""
+            self.log(f"Selected city: {city['name']} with ID: {city['id']}{resume}")
+            # Requests made before a crash may be in the JOBDIR dupefilter though never fetched
+            yield self.hotel_list_request(city["id"], city["name"], page, dont_filter=resumed is not None)
+
+    def open_checkpoint(self):
+        """Open the crawl checkpoint, if any; return the status it was resumed from."""
+        if self.checkpoint is None:
+            return None
+        resumed = self.checkpoint.open()
+        if resumed:
+            done = len(self.checkpoint.cities) - self.checkpoint.unfinished()
+            self.logger.info(f"Resuming {resumed} crawl '{self.checkpoint.crawl}' with {done} cities done.")
+        self.checkpoint_timer = LoopingCall(self.save_checkpoint)
+        self.checkpoint_timer.start(self.checkpoint_interval, now=False)
+        return resumed
+
+    def jobdir_queued(self):
+        """Return whether a request queue was left under JOBDIR by a clean shutdown."""
+        return bool(self.jobdir) and os.path.exists(os.path.join(self.jobdir, "requests.queue", "active.json"))
+
+    def save_checkpoint(self, status=RUNNING):
+        """Save the progress of the crawl checkpoint on a worker thread."""
+        rows = self.checkpoint.changes()
+        dfd = self.checkpoint_lock.run(deferToThread, self.checkpoint.save, rows, status, self.checkpoint.pending())
+        dfd.addErrback(self.checkpoint_failed, rows)
+        return dfd
+
+    def checkpoint_failed(self, failure, rows):
+        self.logger.error(f"Error while saving the checkpoint of crawl '{self.checkpoint.crawl}': {failure.value}")
+        # Saved with the next checkpoint instead
+        self.checkpoint.dirty.update(row["city_id"] for row in rows)
+
+    def hotel_list_request(self, city_id, city_name, page=1, unit_id=None, dont_filter=False):
+        """Build the request for one page of a city's hotel list.
+
+        Deeper pages get a lower priority, so the first page of every city
+        is fetched before any city is paginated further. ``unit_id`` is the
+        frontier unit the page belongs to in frontier mode.
+        """
+        url = self.list_url.format(city_id=city_id)
+        if page > 1:
+            url = f"{url}&page={page}"
+        meta = {"city_name": city_name, "city_id": city_id, "page": page}
+        if unit_id is None:
+            return scrapy.Request(url=url, callback=self.parse_city_hotels, priority=1 - page, meta=meta,
+                                  dont_filter=dont_filter)
+        meta["frontier_unit"] = unit_id
+        return scrapy.Request(
+            url=url,
+            callback=self.parse_city_hotels,
+            errback=self.frontier_request_failed,
+            priority=1 - page,
+            meta=meta,
+        )
 
     def parse_city_hotels(self, response):
-        """Parse hotels from the selected city's hotel page."""
+        """Parse hotels from one page of the selected city's hotel list."""
         city_name = response.meta["city_name"]
-
-        # Locate the <script> tag containing 'window.IBU_HOTEL'
-        script_data = response.xpath("//script[contains(text(), 'window.IBU_HOTEL')]/text()").get()
-
-        if script_data:
-            json_match = re.search(r'window.IBU_HOTEL\s*=\s*(\{.*?\});', script_data, re.DOTALL)
-            if json_match:
-                raw_json = json_match.group(1)
-                data = json.loads(raw_json)
-                init_data = data.get("initData", {})
-                first_page_list = init_data.get("firstPageList", [])
-                if not first_page_list:
-                    self.log(f"No hotel data found for city: {city_name}")
-                    return
-
-                hotel_list = first_page_list.get("hotelList", [])
-                if not hotel_list:
-                    self.log(f"No hotels found for city: {city_name}")
-                    return
-
-                # Connect to the database
-                session = SessionLocal()
-
-                # Ensure the city exists in the database
-                city = session.query(City).filter_by(name=city_name).first()
-                if not city:
-                    city = City(name=city_name)
-                    session.add(city)
-                    session.commit()
-
-                for hotel in hotel_list[:5]:  # Limit to 5 hotels per city
-                    hotel_data = self.extract_hotel_data(hotel)
-
-                    # Download and save the image
-                    image_path = None
-                    if hotel_data["image_url"] != "N/A":
-                        image_path = self.download_image(hotel_data["image_url"], city_name, hotel_data["property_title"])
-
-                    # Add hotel data to the database
-                    hotel_obj = Hotel(
-                        name=hotel_data["property_title"],
-                        property_id=hotel_data["property_id"],
-                        rating=float(hotel_data["rating"]) if hotel_data["rating"] not in ["N/A", "", None] else None,
-                        location=hotel_data["location"],
-                        latitude=float(hotel_data["latitude"]) if hotel_data["latitude"] != "N/A" else None,
-                        longitude=float(hotel_data["longitude"]) if hotel_data["longitude"] != "N/A" else None,
-                        room_type=hotel_data["room_type"],
-                        price=float(hotel_data["price"]) if hotel_data["price"] not in ["N/A", "", None] else None,
-                        image_path=image_path,
-                        city_id=city.id,
-                        city_name=hotel_data["city_name"],
-                    )
-                    session.add(hotel_obj)
-
-                # Commit the transaction
-                session.commit()
-
-                # Query the database to display data
-                self.display_database_content(session)
-
-                session.close()
-
-                self.log(f"Data for city '{city_name}' and its hotels has been saved to the database.")
-            else:
-                self.log("Failed to extract JSON data from script.")
+        page = response.meta.get("page", 1)
+
+        started = perf_counter()
+        bounds = find_payload(response.body)
+        data = extract_ibu_hotel(response.body, HotelListSchema, bounds) if bounds else None
+        self.stage_finished("extract", perf_counter() - started, city=city_name,
+                            size=bounds[1] - bounds[0] if bounds else 0)
+        if data is None:
+            self.log("Failed to extract JSON data from script.")
+            if "frontier_unit" in response.meta:
+                self.frontier_call(self.frontier.fail, response.meta["frontier_unit"])
+            return
+
+        init_data = data.get("initData") or {}
+        first_page_list = init_data.get("firstPageList")
+        if not first_page_list:
+            self.log(f"No hotel data found for city: {city_name}")
+            self.complete_city(city_name, response)
+            return
+
+        hotel_list = first_page_list.get("hotelList")
+        if not hotel_list:
+            self.log(f"No hotels found for city: {city_name}")
+            self.complete_city(city_name, response)
+            return
+
+        if self.crawl_mode == "sample":
+            hotel_list = hotel_list[:self.sample_hotels]
+
+        seen = self.city_hotel_ids.setdefault(city_name, set())
+        new_hotels = skipped = 0
+        # Only the extraction itself is timed; items are processed between iterations
+        busy = 0.0
+        for position, hotel in enumerate(hotel_list):
+            started = perf_counter()
+            try:
+                hotel_data = self.extract_hotel_data(hotel)
+            except (TypeError, ValueError) as e:
+                self.logger.warning(f"Skipping malformed hotel in city '{city_name}': {e}")
+                continue
+            finally:
+                busy += perf_counter() - started
+            if hotel_data.property_id is not None:
+                if hotel_data.property_id in seen:
+                    continue
+                seen.add(hotel_data.property_id)
+            new_hotels += 1
+            if self.seen_hotels is not None and hotel_data.property_id is not None \
+                    and hotel_data.property_id in self.seen_hotels:
+                # Stored earlier in the crawl window, e.g. listed under another city
+                skipped += 1
+                continue
+            # The selected city owns the row; positionInfo's cityName is kept as-is
+            hotel_data.city = city_name
+            if self.checkpoint is not None:
+                self.checkpoint.track(hotel_data, response.meta["city_id"], page, position)
+            if "frontier_unit" in response.meta:
+                self.track_unit_item(hotel_data, response, position)
+            yield hotel_data
+
+        self.log(f"Scraped {new_hotels - skipped} hotels from page {page} for city '{city_name}'"
+                 + (f", skipped {skipped} seen earlier." if skipped else "."))
+        self.stage_finished("hotels", busy, city=city_name, count=new_hotels)
+
+        if self.crawl_mode == "sample":
+            return
+        if not new_hotels:
+            # The site served nothing new, e.g. it ignores the page parameter
+            self.complete_city(city_name, response)
+        elif self.max_pages and page >= self.max_pages:
+            self.log(f"Page budget of {self.max_pages} reached for city '{city_name}'.")
+            self.city_hotel_ids.pop(city_name, None)
+            self.complete_unit(response)
+            self.checkpoint_page(response, last=True)
+        elif "frontier_unit" in response.meta:
+            self.complete_unit(response, page + 1)
+        else:
+            self.checkpoint_page(response)
+            yield self.hotel_list_request(response.meta["city_id"], city_name, page + 1)
+
+    def remember_seen(self, items):
+        """Add the hotels the database pipeline stored to the seen-set.
+
+        Only once stored, so hotels lost to a crash or a failed batch are
+        scraped again rather than skipped for the rest of the window.
+        """
+        for item in items:
+            property_id = ItemAdapter(item).get("property_id")
+            if property_id is not None:
+                self.seen_hotels.add(property_id)
+
+    def stage_finished(self, stage, duration, **kwargs):
+        """Report the duration of a processing stage to the crawl metrics."""
+        crawler = getattr(self, "crawler", None)
+        if crawler is not None:
+            crawler.signals.send_catch_log(hotel_signals.stage_finished, stage=stage, duration=duration, **kwargs)
+
+    def complete_city(self, city_name, response=None):
+        """Record that a city's hotel list was read to the end.
+
+        Only full crawls record it for retiring hotels; in frontier mode
+        other workers may have scraped part of the city.
+        """
+        if self.crawl_mode == "full":
+            self.completed_cities.add(city_name)
+        self.city_hotel_ids.pop(city_name, None)
+        if response is not None:
+            self.complete_unit(response)
+            self.checkpoint_page(response, last=True)
+
+    def complete_unit(self, response, next_page=None):
+        """Mark the frontier unit of a response done, scheduling its next page.
+
+        A unit whose hotels are still in the pipelines is only marked done
+        once they are all stored or dropped, so that a worker dying before
+        its rows are written leaves the unit to be claimed again when its
+        lease runs out. Its next page is leased and scheduled right away.
+        """
+        unit_id = response.meta.get("frontier_unit")
+        if unit_id is None:
+            return
+        key = (str(response.meta["city_id"]), response.meta.get("page", 1))
+        pending = self.unit_pages.get(key)
+        if pending is None or not pending["items"]:
+            self.unit_pages.pop(key, None)
+            dfd = self.frontier_call(self.frontier.complete, unit_id, next_page)
+        else:
+            pending["parsed"] = True
+            if next_page is None:
+                return
+            dfd = self.frontier_call(self.frontier.extend, unit_id, next_page)
+        dfd.addCallback(lambda unit: unit and self.schedule_units([unit]))
+
+    def track_unit_item(self, item, response, position):
+        """Note a hotel of a frontier unit on its way into the pipelines."""
+        key = (str(response.meta["city_id"]), response.meta.get("page", 1))
+        item.list_page = (*key, position)
+        pending = self.unit_pages.setdefault(
+            key, {"unit_id": response.meta["frontier_unit"], "items": set(), "parsed": False}
+        )
+        pending["items"].add(position)
+
+    def unit_item_done(self, item):
+        """Note a hotel of a frontier unit that was dropped or failed in the pipelines."""
+        key = list_page(item)
+        pending = self.unit_pages.get(key)
+        position = list_position(item)
+        # A hotel that failed in one pipeline and was stored by another is reported twice
+        if pending is None or position not in pending["items"]:
+            return
+        pending["items"].remove(position)
+        if not pending["items"] and pending["parsed"]:
+            del self.unit_pages[key]
+            self.frontier_call(self.frontier.complete, pending["unit_id"])
+
+    def unit_items_done(self, items):
+        """Note hotels stored by the database pipeline, completing the units all stored."""
+        for item in items:
+            self.unit_item_done(item)
+
+    def checkpoint_page(self, response, last=False):
+        """Record a parsed page of a city's hotel list in the crawl checkpoint."""
+        if self.checkpoint is not None:
+            meta = response.meta
+            self.checkpoint.page_parsed(meta["city_id"], meta["city_name"], meta.get("page", 1), last)
+
+    def frontier_call(self, func, *args):
+        """Run a frontier method on a worker thread, keeping the spider open meanwhile."""
+        self.frontier_calls += 1
+
+        def done(result):
+            self.frontier_calls -= 1
+            return result
+
+        dfd = deferToThread(func, *args)
+        dfd.addBoth(done)
+        dfd.addErrback(lambda failure: self.logger.error(f"Frontier error: {failure.value}"))
+        return dfd
+
+    def frontier_request_failed(self, failure):
+        """Release the frontier unit of a hotel list request that failed."""
+        self.log(f"Hotel list request failed: {failure.value}")
+        self.frontier_call(self.frontier.fail, failure.request.meta["frontier_unit"])
+
+    def spider_idle(self, spider):
+        """Claim the next batch of frontier units once the spider runs dry.
+
+        The spider is kept open while frontier calls are running, and while
+        units leased by other workers may still come back to the frontier.
+        """
+        if self.frontier_calls:
+            raise DontCloseSpider
+        if self.frontier_drained:
+            return
+        dfd = self.frontier_call(self.claim_units)
+        dfd.addCallback(self.schedule_units)
+        raise DontCloseSpider
+
+    def claim_units(self):
+        """Claim a batch of units, noting when the crawl has no work left."""
+        units = self.frontier.claim(self.frontier_batch_size)
+        if not units and not self.frontier.outstanding():
+            self.frontier_drained = True
+            self.log(f"Frontier of crawl '{self.frontier.crawl}' is drained: {self.frontier.counts()}")
+        return units
+
+    def schedule_units(self, units):
+        for unit in units:
+            self.log(f"Claimed page {unit['page']} of city {unit['city_name']} (attempt {unit['attempts']}).")
+            self.crawler.engine.crawl(
+                self.hotel_list_request(unit["city_id"], unit["city_name"], unit["page"], unit["id"])
+            )
 
     def extract_hotel_data(self, hotel):
-        """Extract and structure hotel data."""
+        """Extract a hotel of the list payload as a typed ``HotelItem``."""
         hotel_basic_info = hotel.get("hotelBasicInfo", {})
         commentInfo = hotel.get("commentInfo", {})
         positionInfo = hotel.get("positionInfo", {})
         roomInfo = hotel.get("roomInfo", {})
-        return {
-            "property_title": hotel_basic_info.get("hotelName", "N/A"),
-            "property_id": hotel_basic_info.get("hotelId", "N/A"),
-            "rating": commentInfo.get("commentScore", "N/A"),
-            "location": positionInfo.get("positionName", "N/A"),
-            "latitude": positionInfo.get("coordinate", {}).get("lat", "N/A"),
-            "longitude": positionInfo.get("coordinate", {}).get("lng", "N/A"),
-            "room_type": roomInfo.get("physicalRoomName", "N/A"),
-            "price": hotel_basic_info.get("price", "N/A"),
-            "image_url": hotel_basic_info.get("hotelImg", "N/A"),
-            "city_name": positionInfo.get("cityName", "N/A"),
-        }
-
-    def download_image(self, image_url, city_name, hotel_name):
-        """Download image and save it to the images folder."""
-        folder_path = os.path.join("images", city_name)
-        os.makedirs(folder_path, exist_ok=True)
-
-        image_name = f"{hotel_name.replace(' ', '_')}.jpg"
-        image_path = os.path.join(folder_path, image_name)
-
-        try:
-            response = requests.get(image_url, stream=True)
-            if response.status_code == 200:
-                with open(image_path, "wb") as f:
-                    for chunk in response.iter_content(1024):
-                        f.write(chunk)
-                self.log(f"Image saved: {image_path}")
-                return image_path
-            else:
-                self.log(f"Failed to download image: {image_url}")
-                return None
-        except Exception as e:
-            self.log(f"Error downloading image {image_url}: {e}")
-            return None
-        
-    def display_database_content(self, session):
-        """Display the content of the database."""
-        self.log("Fetching data from the database...")
-
-        # Query all cities
-        cities = session.query(City).all()
-        for city in cities:
-            self.log(f"City: {city.name}")
-            
-            # Query hotels for each city
-            hotels = session.query(Hotel).filter_by(city_id=city.id).all()
-            for hotel in hotels:
-                self.log(f"    Hotel: {hotel.name}")
-                self.log(f"    Rating: {hotel.rating}")
-                self.log(f"    Location: {hotel.location}")
-                self.log(f"    Latitude: {hotel.latitude}")
-                self.log(f"    Longitude: {hotel.longitude}")
-                self.log(f"    Room Type: {hotel.room_type}")
-                self.log(f"    Price: {hotel.price}")
-                self.log(f"    Image Path: {hotel.image_path}")
-
+        coordinate = positionInfo.get("coordinate", {})
+        return HotelItem(
+            property_title=hotel_basic_info.get("hotelName"),
+            property_id=hotel_basic_info.get("hotelId"),
+            rating=commentInfo.get("commentScore"),
+            location=positionInfo.get("positionName"),
+            latitude=coordinate.get("lat"),
+            longitude=coordinate.get("lng"),
+            room_type=roomInfo.get("physicalRoomName"),
+            price=hotel_basic_info.get("price"),
+            image_url=hotel_basic_info.get("hotelImg"),
+            city_name=positionInfo.get("cityName"),
+        )
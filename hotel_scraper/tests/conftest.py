@@ -0,0 +1,5 @@
+import os
+
+# Run against a private in-memory SQLite database unless DATABASE_URL points
+# the tests at a real server. Set before any engine is created.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,254 @@
+"""A local stand-in for the Trip.com pages the spider crawls.
+
+Serves generated homepage, hotel list and image responses shaped like the
+real site, so the spider can be run end to end without network access.
+The number of cities, hotels per page and pages per city, the payload
+size, the injected latency and error rate, and a rate limit on hotel pages
+answered with 429 and ``Retry-After`` are all configurable.
+
+With ``proxies``, it also listens on as many other ports that act as HTTP
+proxies in front of it, each standing for a client with its own IP: the
+rate limit applies to every proxy, and to direct requests, separately.
+
+Run it on its own with:
+    python -m hotel_scraper.tests.standin --port 8080 --cities 20 --pages 5
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse, urlunparse
+
+# A valid 8x8 JPEG, padded with comment segments to the requested size
+SAMPLE_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300100b0c0e0c0a100e0d0e1211101318281a181616183123"
+    "251d283a333d3c3933383740485c4e404457453738506d51575f626768673e4d71797064785c656763ffdb0043011112"
+    "121815182f1a1a2f63423842636363636363636363636363636363636363636363636363636363636363636363636363"
+    "6363636363636363636363636363ffc00011080008000803012200021101031101ffc4001f0000010501010101010100"
+    "000000000000000102030405060708090a0bffc400b5100002010303020403050504040000017d010203000411051221"
+    "31410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a"
+    "434445464748494a535455565758595a636465666768696a737475767778797a838485868788898a9293949596979899"
+    "9aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1"
+    "f2f3f4f5f6f7f8f9faffc4001f0100030101010101010101010000000000000102030405060708090a0bffc400b51100"
+    "020102040403040705040400010277000102031104052131061241510761711322328108144291a1b1c109233352f015"
+    "6272d10a162434e125f11718191a262728292a35363738393a434445464748494a535455565758595a63646566676869"
+    "6a737475767778797a82838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4"
+    "c5c6c7c8c9cad2d3d4d5d6d7d8d9dae2e3e4e5e6e7e8e9eaf2f3f4f5f6f7f8f9faffda000c03010002110311003f00b3"
+    "45145701d67fffd9"
+)
+
+
+class StandInServer:
+    """Threaded HTTP server generating Trip.com-like responses."""
+
+    def __init__(self, host="127.0.0.1", port=0, cities=10, hotels_per_page=20, pages=3,
+                 payload_kb=0, image_kb=8, latency_ms=0, error_rate=0.0, rate_limit=0,
+                 image_host=None, image_outage=0, proxies=0, seed=0):
+        self.cities = cities
+        self.hotels_per_page = hotels_per_page
+        self.pages = pages
+        self.payload_kb = payload_kb
+        self.image_kb = image_kb
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        # Hotel pages served per second to each client before answering 429,
+        # 0 for no limit, and the current second and count by client
+        self.rate_limit = rate_limit
+        self.rate_windows = {}
+        # Images are linked under another host name, e.g. "localhost", to
+        # stand for a CDN, and answer 503 for the first image_outage seconds
+        self.image_host = image_host
+        self.image_outage = image_outage
+        self.started = time.monotonic()
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.request_count = 0
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        # Proxies numbered from 1, direct requests being client 0
+        self.proxy_servers = []
+        for client in range(1, proxies + 1):
+            proxy = ThreadingHTTPServer((host, 0), self.handler_class(client))
+            proxy.daemon_threads = True
+            self.proxy_servers.append(proxy)
+        self.threads = []
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def image_base_url(self):
+        if self.image_host is None:
+            return self.base_url
+        return f"http://{self.image_host}:{self.httpd.server_address[1]}"
+
+    @property
+    def proxy_urls(self):
+        return [f"http://{host}:{port}" for host, port in (proxy.server_address[:2] for proxy in self.proxy_servers)]
+
+    def start(self):
+        self.started = time.monotonic()
+        for httpd in [self.httpd] + self.proxy_servers:
+            thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for httpd in [self.httpd] + self.proxy_servers:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handler_class(self, client=0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                status, content_type, body = server.respond(self.path, client)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def respond(self, path, client=0):
+        """Return ``(status, content_type, body)`` for a request path from a client."""
+        if path.startswith("http://"):
+            # Asked as a proxy, with the absolute URL
+            path = urlunparse(urlparse(path)._replace(scheme="", netloc=""))
+        with self.random_lock:
+            self.request_count += 1
+            roll = self.random.random()
+            jitter = self.random.uniform(0.5, 1.5)
+            limited = False
+            if self.rate_limit and path.startswith("/hotels"):
+                second, served = self.rate_windows.get(client, (0, 0))
+                now = int(time.monotonic())
+                served = served + 1 if now == second else 1
+                self.rate_windows[client] = (now, served)
+                limited = served > self.rate_limit
+        if self.latency_ms:
+            time.sleep(self.latency_ms * jitter / 1000)
+
+        url = urlparse(path)
+        if url.path == "/robots.txt":
+            return 200, "text/plain", b"User-agent: *\nAllow: /\n"
+        if limited:
+            return 429, "text/html", b"<html><body>Too Many Requests</body></html>"
+        if roll < self.error_rate:
+            return 503, "text/html", b"<html><body>Service Unavailable</body></html>"
+        if url.path.startswith("/images/"):
+            if time.monotonic() - self.started < self.image_outage:
+                return 503, "text/html", b"<html><body>Service Unavailable</body></html>"
+            return 200, "image/jpeg", self.image_body()
+        if url.path == "/hotels/list":
+            query = parse_qs(url.query)
+            try:
+                city_id = int(query["city"][0])
+                page = int(query.get("page", ["1"])[0])
+            except (KeyError, ValueError):
+                return 404, "text/html", b"<html><body>Not Found</body></html>"
+            return 200, "text/html; charset=utf-8", self.page_body(self.hotel_list_payload(city_id, page))
+        if url.path in ("/", "/hotels", "/hotels/"):
+            return 200, "text/html; charset=utf-8", self.page_body(self.homepage_payload())
+        return 404, "text/html", b"<html><body>Not Found</body></html>"
+
+    def homepage_payload(self):
+        cities = [{"name": f"City {city_id}", "id": city_id} for city_id in range(1, self.cities + 1)]
+        return {"initData": {"htlsData": {"inboundCities": cities}}}
+
+    def hotel_list_payload(self, city_id, page):
+        hotels = []
+        if 1 <= city_id <= self.cities and 1 <= page <= self.pages:
+            for i in range(self.hotels_per_page):
+                hotel_id = city_id * 100000 + page * 1000 + i
+                hotels.append({
+                    "hotelBasicInfo": {
+                        "hotelName": f"Hotel {hotel_id}",
+                        "hotelId": hotel_id,
+                        "price": 40 + hotel_id % 300,
+                        "hotelImg": f"{self.image_base_url}/images/{city_id}/{hotel_id}.jpg",
+                    },
+                    "commentInfo": {"commentScore": str(round(1 + hotel_id % 40 / 10, 1))},
+                    "positionInfo": {
+                        "positionName": f"District {i % 7}",
+                        "cityName": f"City {city_id}",
+                        "coordinate": {"lat": 10 + city_id / 10 + i / 1e4, "lng": 20 + page / 100},
+                    },
+                    "roomInfo": {"physicalRoomName": "Double Room"},
+                })
+        return {"initData": {"firstPageList": {"hotelList": hotels}}}
+
+    def page_body(self, payload):
+        if self.payload_kb:
+            # Unused data, as on the real pages, to reach the requested size
+            payload["initData"]["seoData"] = {"content": "x" * (self.payload_kb * 1024)}
+        script = "window.IBU_HOTEL = " + json.dumps(payload) + ";"
+        return ("<html><head><script>" + script + "</script></head><body></body></html>").encode()
+
+    def image_body(self):
+        padding = []
+        remaining = self.image_kb * 1024 - len(SAMPLE_JPEG)
+        while remaining > 4:
+            length = min(remaining - 2, 0xFFFF)
+            padding.append(b"\xff\xfe" + length.to_bytes(2, "big") + b"\x00" * (length - 2))
+            remaining -= length + 2
+        return SAMPLE_JPEG[:2] + b"".join(padding) + SAMPLE_JPEG[2:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Trip.com-like pages locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cities", type=int, default=10)
+    parser.add_argument("--hotels-per-page", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--payload-kb", type=int, default=0)
+    parser.add_argument("--image-kb", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=0, help="hotel pages per second before 429s")
+    parser.add_argument("--image-host", help="host name of image URLs, e.g. localhost")
+    parser.add_argument("--image-outage", type=float, default=0, help="seconds images answer 503 for")
+    parser.add_argument("--proxies", type=int, default=0, help="ports to serve as proxies in front of it")
+    args = parser.parse_args()
+
+    server = StandInServer(
+        args.host, args.port, cities=args.cities, hotels_per_page=args.hotels_per_page,
+        pages=args.pages, payload_kb=args.payload_kb, image_kb=args.image_kb,
+        latency_ms=args.latency_ms, error_rate=args.error_rate, rate_limit=args.rate_limit,
+        image_host=args.image_host, image_outage=args.image_outage, proxies=args.proxies,
+    )
+    server.start()
+    print(f"Serving on {server.base_url} (set TRIP_BASE_URL to use it)")
+    if server.proxy_urls:
+        print(f"Proxies: {','.join(server.proxy_urls)} (set PROXY_LIST to use them)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import pytest
+from hotel_scraper.checkpoint import FINISHED, PAUSED, RUNNING, Checkpoint
+from hotel_scraper.database import get_engine
+from hotel_scraper.items import HotelItem
+from hotel_scraper.models import Base, CityCheckpoint, CrawlCheckpoint
+
+engine = get_engine()
+
+
+# Fixtures
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema before running tests."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def clear_checkpoints():
+    """Start every test without checkpoints."""
+    with engine.begin() as connection:
+        connection.execute(CityCheckpoint.__table__.delete())
+        connection.execute(CrawlCheckpoint.__table__.delete())
+
+
+def crawl_status(crawl):
+    with engine.connect() as connection:
+        table = CrawlCheckpoint.__table__
+        return connection.execute(
+            table.select().with_only_columns(table.c.status, table.c.pending_items).where(table.c.crawl == crawl)
+        ).one()
+
+
+# Tests
+def test_checkpoint_advances_over_pages_whose_hotels_are_stored():
+    """Test that a city only progresses once the hotels of its pages are all stored."""
+    checkpoint = Checkpoint(engine, "test-crawl")
+    assert checkpoint.open() is None
+    first, second, third = HotelItem(property_id=1), HotelItem(property_id=2), HotelItem(property_id=3)
+    checkpoint.track(first, 10, 1, 0)
+    checkpoint.track(second, 10, 1, 1)
+    checkpoint.page_parsed(10, "City10", 1)
+    checkpoint.track(third, 10, 2, 0)
+    checkpoint.page_parsed(10, "City10", 2, last=True)
+
+    checkpoint.items_done([third, first])
+    assert checkpoint.next_page(10) == 1 and checkpoint.changes() == []
+    # A hotel that failed in one pipeline and was stored by another only counts once
+    checkpoint.item_done(first)
+    assert checkpoint.next_page(10) == 1 and checkpoint.pending() == 1
+
+    checkpoint.item_done(second)
+    assert checkpoint.next_page(10) is None
+    rows = checkpoint.changes()
+    assert [(row["city_id"], row["page"], row["done"]) for row in rows] == [("10", 2, True)]
+    checkpoint.save(rows)
+    assert crawl_status("test-crawl") == (RUNNING, 0)
+
+
+def test_checkpoint_resumes_an_unfinished_crawl():
+    """Test that a crawl left running or paused is resumed and a finished one started over."""
+    checkpoint = Checkpoint(engine, "test-crawl")
+    checkpoint.open()
+    checkpoint.page_parsed(1, "City1", 1)
+    checkpoint.page_parsed(2, "City2", 1, last=True)
+    checkpoint.track(HotelItem(property_id=3), 3, 1, 0)
+    checkpoint.page_parsed(3, "City3", 1)
+    checkpoint.save(checkpoint.changes(), PAUSED, checkpoint.pending())
+    assert crawl_status("test-crawl") == (PAUSED, 1)
+
+    resumed = Checkpoint(engine, "test-crawl")
+    assert resumed.open() == PAUSED
+    assert resumed.started_at == checkpoint.started_at
+    assert [resumed.next_page(city_id) for city_id in (1, 2, 3, 4)] == [2, None, 1, 1]
+    assert resumed.unfinished() == 1
+    resumed.save([], FINISHED)
+
+    restarted = Checkpoint(engine, "test-crawl")
+    assert restarted.open() is None
+    assert restarted.next_page(2) == 1 and restarted.started_at > checkpoint.started_at
+
+
+def test_checkpoint_follows_items_by_their_page():
+    """Test that items are followed by the page they carry, whatever the object reaching the signals."""
+    checkpoint = Checkpoint(engine, "test-crawl")
+    checkpoint.open()
+    item = {"property_id": 1}
+    checkpoint.track(item, 10, 1, 0)
+    checkpoint.track(HotelItem(property_id=2), 10, 1, 1)
+    checkpoint.page_parsed(10, "City10", 1, last=True)
+    assert item["list_page"] == ("10", 1, 0) and checkpoint.pending() == 2
+
+    checkpoint.item_done(HotelItem.from_item(item))
+    checkpoint.item_done(HotelItem(property_id=3))
+    assert checkpoint.pending() == 1 and checkpoint.next_page(10) == 1
+
+    checkpoint.item_done({"property_id": 2, "list_page": ["10", 1, 1]})
+    assert checkpoint.pending() == 0 and checkpoint.next_page(10) is None
@@ -0,0 +1,76 @@
+import os
+import pytest
+from datetime import datetime, timezone
+from hotel_scraper.database import SessionLocal, get_engine
+from hotel_scraper.models import Base, City, Hotel
+
+engine = get_engine()
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.dataset as ds  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+from hotel_scraper.export import SnapshotWriter, dump_hotels  # noqa: E402
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema before running tests."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def snapshot_row(property_id, price):
+    """Build a snapshot row as the export pipeline does."""
+    return {
+        "crawl_id": "crawl-1",
+        "scraped_at": datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc),
+        "property_id": property_id,
+        "name": f"Hotel {property_id}",
+        "price": price,
+    }
+
+
+def test_snapshot_writer_publishes_files_on_close(tmp_path):
+    """Test that each write is a row group and files only appear once closed."""
+    writer = SnapshotWriter(str(tmp_path), "crawl/1")
+    partition = ("2024-05-01", "New York")
+    writer.write(partition, [snapshot_row(1, 80.0), snapshot_row(2, None)])
+    writer.write(partition, [snapshot_row(3, 95.5)])
+    directory = tmp_path / "crawl_date=2024-05-01" / "city=New%20York"
+    assert [name.startswith(".") for name in os.listdir(directory)] == [True]
+
+    paths = writer.close()
+
+    assert len(paths) == 1 and os.path.basename(paths[0]).startswith("part-crawl_1-")
+    assert pq.ParquetFile(paths[0]).num_row_groups == 2
+    table = ds.dataset(str(tmp_path), partitioning="hive").to_table()
+    assert table.column("price").to_pylist() == [80.0, None, 95.5]
+    assert table.column("city").to_pylist() == ["New York"] * 3
+    assert writer.rows_written == 3
+
+
+def test_dump_hotels_exports_stored_hotels(tmp_path):
+    """Test that the bulk dump streams the hotels table into a snapshot by city."""
+    last_seen = datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+    session = SessionLocal()
+    try:
+        dhaka, paris = City(name="Dhaka"), City(name="Paris")
+        session.add_all([dhaka, paris])
+        session.flush()
+        for property_id, city in ((10, dhaka), (11, dhaka), (12, dhaka), (13, paris)):
+            session.add(Hotel(property_id=property_id, name=f"Hotel {property_id}", price=50.0 + property_id,
+                              city_id=city.id, last_seen_at=last_seen, retired=False))
+        session.add(Hotel(property_id=14, name="Closed", city_id=paris.id, retired=True))
+        session.commit()
+    finally:
+        session.close()
+
+    paths = dump_hotels(engine, str(tmp_path), crawl_id="dump-1", row_group_size=2)
+
+    assert len(paths) == 2
+    table = ds.dataset(str(tmp_path), partitioning="hive").to_table().sort_by("property_id")
+    assert table.column("property_id").to_pylist() == [10, 11, 12, 13]
+    assert table.column("city").to_pylist() == ["Dhaka", "Dhaka", "Dhaka", "Paris"]
+    assert table.column("scraped_at").to_pylist()[0] == last_seen
+    assert set(table.column("crawl_id").to_pylist()) == {"dump-1"}
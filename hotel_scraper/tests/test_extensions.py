@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import Mock
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from hotel_scraper.city_stats import refresh_city_stats
+from hotel_scraper.extensions import CrawlSummary
+from hotel_scraper.models import Base, City, Hotel
+from hotel_scraper.database import SessionLocal, get_engine
+
+engine = get_engine()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema before running tests."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def spider():
+    """Provide a mock spider with a logger."""
+    mock_spider = Mock(spec=Spider)
+    mock_spider.name = "test_spider"
+    mock_spider.logger = Mock()
+    return mock_spider
+
+
+def test_crawl_summary_disabled_by_default():
+    """Test that the summary extension is opt-in."""
+    crawler = Mock(settings=Settings())
+
+    with pytest.raises(NotConfigured):
+        CrawlSummary.from_crawler(crawler)
+
+
+def test_crawl_summary_aggregates_per_city(spider):
+    """Test the per-city aggregate used for the summary."""
+    session = SessionLocal()
+    try:
+        city = City(name="Summary City")
+        session.add(city)
+        session.commit()
+        session.add_all([
+            Hotel(name="A", price=100.0, rating=4.0, city_id=city.id),
+            Hotel(name="B", price=200.0, rating=5.0, city_id=city.id),
+            Hotel(name="C", price=900.0, rating=1.0, city_id=city.id, retired=True),
+        ])
+        session.commit()
+        city_id = city.id
+    finally:
+        session.close()
+    with engine.begin() as connection:
+        refresh_city_stats(connection, [city_id])
+
+    rows = CrawlSummary().summarize()
+    CrawlSummary().log_summary(rows, spider)
+
+    row = next(row for row in rows if row.name == "Summary City")
+    assert row.hotels == 2
+    assert (row.min_price, row.avg_price, row.max_price) == (100.0, 150.0, 200.0)
+    assert (row.min_rating, row.max_rating) == (4.0, 5.0)
+    assert "Summary City: 2 hotels" in spider.logger.info.call_args_list[-1][0][0]
@@ -0,0 +1,85 @@
+import json
+import pytest
+from unittest.mock import patch
+from hotel_scraper import extractor
+from hotel_scraper.extractor import extract_ibu_hotel, find_payload, HomepageSchema, HotelListSchema
+
+
+def page(payload, trailer=b""):
+    """Build a page embedding the payload the way Trip.com does."""
+    return (
+        b"<html><head><script>var a = 'window.IBU_HOTEL';</script>"
+        b"<script>window.IBU_HOTEL = " + json.dumps(payload).encode() + b";" + trailer +
+        b"</script></head><body></body></html>"
+    )
+
+
+HOTEL_LIST = {
+    "initData": {
+        "firstPageList": {
+            "hotelList": [{
+                "hotelBasicInfo": {"hotelName": "Tricky }; Hotel", "hotelId": 7, "price": 99, "extra": [1, 2]},
+                "commentInfo": {"commentScore": "4.6"},
+                "positionInfo": {"positionName": "Centre", "coordinate": {"lat": 1.5, "lng": 2.5}},
+                "roomInfo": {"physicalRoomName": "Twin"},
+                "unused": {"deep": ["x" * 100]},
+            }],
+        },
+        "seo": {"text": "};"},
+    },
+}
+
+
+@pytest.fixture(params=["msgspec", "orjson", "stdlib"])
+def decoder(request):
+    """Run a test once per available decoding path."""
+    if request.param == "msgspec" and extractor.msgspec is None:
+        pytest.skip("msgspec is not installed")
+    if request.param == "orjson" and extractor.orjson is None:
+        pytest.skip("orjson is not installed")
+    typed = extractor._typed_decoders if request.param == "msgspec" else {}
+    fast = extractor.orjson if request.param != "stdlib" else None
+    with patch.object(extractor, "_typed_decoders", typed), patch.object(extractor, "orjson", fast):
+        yield request.param
+
+
+def test_extract_does_not_truncate_at_brace_semicolon(decoder):
+    """Test that a '};' inside a string does not end the payload."""
+    data = extract_ibu_hotel(page(HOTEL_LIST), HotelListSchema)
+
+    hotel = data["initData"]["firstPageList"]["hotelList"][0]
+    assert hotel["hotelBasicInfo"]["hotelName"] == "Tricky }; Hotel"
+    assert hotel["positionInfo"]["coordinate"] == {"lat": 1.5, "lng": 2.5}
+
+
+def test_extract_with_trailing_statements(decoder):
+    """Test that statements after the assignment are ignored."""
+    payload = {"initData": {"htlsData": {"inboundCities": [{"name": "City1", "id": 1}]}}}
+
+    data = extract_ibu_hotel(page(payload, b" window.other = {};"), HomepageSchema)
+
+    assert data["initData"]["htlsData"]["inboundCities"] == [{"name": "City1", "id": 1}]
+
+
+def test_schema_skips_unused_fields():
+    """Test that the typed decoder only materializes the described fields."""
+    if extractor.msgspec is None:
+        pytest.skip("msgspec is not installed")
+
+    data = extract_ibu_hotel(page(HOTEL_LIST), HotelListSchema)
+
+    assert "seo" not in data["initData"]
+    assert "unused" not in data["initData"]["firstPageList"]["hotelList"][0]
+
+
+def test_schema_mismatch_falls_back_to_full_decode():
+    """Test that unexpected types are decoded without the schema."""
+    payload = {"initData": {"firstPageList": None}}
+
+    assert extract_ibu_hotel(page(payload), HotelListSchema) == payload
+
+
+def test_missing_payload():
+    """Test pages without a payload."""
+    assert find_payload(b"<html><script>var x = 1;</script></html>") is None
+    assert extract_ibu_hotel(b"<script>window.IBU_HOTEL = {broken</script>") is None
@@ -0,0 +1,113 @@
+import pytest
+from hotel_scraper.database import get_engine
+from hotel_scraper.frontier import Frontier
+from hotel_scraper.models import Base, CrawlUnit
+
+engine = get_engine()
+
+
+CITIES = [{"name": "City1", "id": 1}, {"name": "City2", "id": 2}, {"name": "City3", "id": 3}]
+
+
+# Fixtures
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema before running tests."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def clear_frontier():
+    """Start every test with an empty frontier."""
+    with engine.begin() as connection:
+        connection.execute(CrawlUnit.__table__.delete())
+
+
+@pytest.fixture
+def frontier():
+    """Provide a frontier for one worker of a test crawl."""
+    return Frontier(engine, "test-crawl", worker_id="worker-1")
+
+
+# Tests
+def test_seed_is_idempotent(frontier):
+    """Test seeding the same cities twice adds their first pages once."""
+    frontier.seed(CITIES)
+    frontier.seed(CITIES[:2])
+
+    assert frontier.counts() == {"pending": 3}
+
+
+def test_claim_leases_units_once(frontier):
+    """Test claimed units are not handed to another worker."""
+    frontier.seed(CITIES)
+    other = Frontier(engine, "test-crawl", worker_id="worker-2")
+
+    first = frontier.claim(2)
+    second = other.claim(5)
+
+    assert [unit["city_id"] for unit in first] == ["1", "2"]
+    assert [unit["city_id"] for unit in second] == ["3"]
+    assert other.claim(5) == []
+    assert frontier.counts() == {"leased": 3}
+
+
+def test_expired_lease_is_reclaimed(frontier):
+    """Test units of a worker whose lease ran out go to another worker."""
+    frontier.seed(CITIES[:1])
+    dead = Frontier(engine, "test-crawl", worker_id="dead-worker", lease_seconds=-1)
+    dead.claim(1)
+
+    units = frontier.claim(1)
+
+    assert len(units) == 1
+    assert units[0]["attempts"] == 2
+
+
+def test_complete_leases_next_page(frontier):
+    """Test completing a unit hands its city's next page to the same worker."""
+    frontier.seed(CITIES[:1])
+    unit = frontier.claim(1)[0]
+
+    next_unit = frontier.complete(unit["id"], next_page=2)
+
+    assert next_unit["page"] == 2
+    assert next_unit["city_id"] == "1"
+    assert frontier.counts() == {"done": 1, "leased": 1}
+    assert frontier.claim(1) == []
+
+
+def test_extend_leases_next_page_and_keeps_the_unit(frontier):
+    """Test that a unit still being stored hands out its next page and stays leased."""
+    frontier.seed(CITIES[:1])
+    unit = frontier.claim(1)[0]
+
+    assert frontier.extend(unit["id"], 2)["page"] == 2
+    assert frontier.extend(unit["id"], 2) is None
+    assert frontier.counts() == {"leased": 2}
+    assert frontier.complete(unit["id"]) is None
+    assert frontier.counts() == {"done": 1, "leased": 1}
+
+
+def test_failed_unit_is_retried_until_attempts_run_out(frontier):
+    """Test failed units return to pending until they are out of attempts."""
+    frontier.max_attempts = 2
+    frontier.seed(CITIES[:1])
+
+    frontier.fail(frontier.claim(1)[0]["id"])
+    assert frontier.counts() == {"pending": 1}
+
+    frontier.fail(frontier.claim(1)[0]["id"])
+    assert frontier.counts() == {"failed": 1}
+    assert frontier.outstanding() == 0
+
+
+def test_outstanding_counts_pending_and_leased_units(frontier):
+    """Test outstanding work includes units leased by other workers."""
+    frontier.seed(CITIES)
+    unit = frontier.claim(1)[0]
+    frontier.complete(unit["id"])
+
+    assert frontier.outstanding() == 2
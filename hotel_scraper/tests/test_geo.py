@@ -0,0 +1,84 @@
+import random
+import pytest
+from hotel_scraper.database import SessionLocal, get_engine
+from hotel_scraper.geo import cover_bbox, encode_geohash, in_bbox, nearby, radius_bbox
+from hotel_scraper.models import Base, Hotel
+
+engine = get_engine()
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema and a few hotels around London and Fiji."""
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    locations = {
+        1: (51.5074, -0.1278),   # Charing Cross
+        2: (51.5033, -0.1196),   # London Eye, 0.7 km away
+        3: (51.5194, -0.1270),   # British Museum, 1.3 km away
+        4: (51.4700, -0.4543),   # Heathrow, 23 km away
+        5: (-16.50, 179.99),     # Either side of the antimeridian
+        6: (-16.50, -179.99),
+    }
+    for property_id, (latitude, longitude) in locations.items():
+        session.add(Hotel(property_id=property_id, name=f"Hotel {property_id}", latitude=latitude,
+                          longitude=longitude, geohash=encode_geohash(latitude, longitude), retired=False))
+    session.add(Hotel(property_id=7, name="Retired", latitude=51.5075, longitude=-0.1279,
+                      geohash=encode_geohash(51.5075, -0.1279), retired=True))
+    session.commit()
+    session.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_encode_geohash():
+    """Test geohash encoding against known values."""
+    assert encode_geohash(57.64911, 10.40744, precision=11) == "u4pruydqqvj"
+    assert encode_geohash(51.5074, -0.1278, precision=5) == "gcpvj"
+    assert encode_geohash(None, 10.0) is None
+
+
+def test_cover_bbox_contains_every_point():
+    """Test that the cells covering a box contain every location inside it."""
+    rng = random.Random(0)
+    for south, west, north, east in ((51.48, -0.15, 51.52, -0.09), (-10, 170, 5, -175), (-90, -180, 90, 180)):
+        prefixes = cover_bbox(south, west, north, east)
+        assert 0 < len(prefixes) <= 32
+        for _ in range(200):
+            latitude = rng.uniform(south, north)
+            longitude = rng.uniform(west, east if west <= east else east + 360)
+            longitude = (longitude + 180) % 360 - 180
+            assert encode_geohash(latitude, longitude).startswith(tuple(prefixes))
+
+
+def test_radius_bbox_spans_poles_and_antimeridian():
+    """Test the bounding box of circles touching a pole or the antimeridian."""
+    assert radius_bbox(89.9, 0, 50)[1:4:2] == (-180.0, 180.0)
+    south, west, north, east = radius_bbox(-16.5, 179.99, 5)
+    assert west > 179 and east < -179
+
+
+def test_nearby_returns_hotels_within_radius_nearest_first():
+    """Test that nearby hotels come back nearest first, with exact distances."""
+    hotels = nearby(51.5074, -0.1278, radius_km=2)
+
+    assert [hotel["property_id"] for hotel in hotels] == [1, 2, 3]
+    assert hotels[0]["distance_km"] == 0.0
+    assert hotels[1]["distance_km"] == pytest.approx(0.72, abs=0.01)
+    assert [hotel["property_id"] for hotel in nearby(51.5074, -0.1278, radius_km=2, limit=2)] == [1, 2]
+    assert [hotel["property_id"] for hotel in nearby(51.5074, -0.1278, radius_km=30)] == [1, 2, 3, 4]
+
+
+def test_nearby_crosses_antimeridian():
+    """Test that a search near the antimeridian finds hotels on both sides."""
+    hotels = nearby(-16.5, 179.995, radius_km=5)
+    assert sorted(hotel["property_id"] for hotel in hotels) == [5, 6]
+
+
+def test_in_bbox():
+    """Test the bounding box search."""
+    hotels = in_bbox(south=51.50, west=-0.13, north=51.51, east=-0.11)
+    assert sorted(hotel["property_id"] for hotel in hotels) == [1, 2]
+    assert len(in_bbox(south=51.0, west=-1.0, north=52.0, east=0.0, limit=3)) == 3
@@ -0,0 +1,126 @@
+import pytest
+from email.utils import formatdate
+from time import time
+from unittest.mock import Mock
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.utils.request import RequestFingerprinter
+from hotel_scraper.httpcache import PatternTTLPolicy, SqliteCacheStorage
+
+
+LIST_URL = "https://uk.trip.com/hotels/list?city=1"
+IMAGE_URL = "https://ak-d.tripcdn.com/images/1.jpg"
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Provide cache settings pointing at a temporary directory."""
+    return Settings({
+        "HTTPCACHE_DIR": str(tmp_path),
+        "HTTPCACHE_TTL_PATTERNS": {r"/hotels/list\?": 900, r"\.jpg$": 0},
+        "HTTPCACHE_IGNORE_HTTP_CODES": [503],
+    })
+
+
+@pytest.fixture
+def spider():
+    """Provide a mock spider with a request fingerprinter."""
+    mock_spider = Mock()
+    mock_spider.name = "test_spider"
+    mock_spider.crawler.request_fingerprinter = RequestFingerprinter()
+    return mock_spider
+
+
+@pytest.fixture
+def storage(settings, spider):
+    """Provide an opened SQLite cache storage."""
+    cache = SqliteCacheStorage(settings)
+    cache.open_spider(spider)
+    yield cache
+    cache.close_spider(spider)
+
+
+def cached_response(url, age, **headers):
+    """Build a cached response that is ``age`` seconds old."""
+    return Response(url=url, status=200, headers=dict(Date=formatdate(time() - age, usegmt=True), **headers))
+
+
+def test_storage_round_trip_is_compressed(storage, spider):
+    """Test that stored responses come back intact with a compressed body."""
+    request = Request(LIST_URL)
+    body = b"<html>" + b"hotel " * 5000 + b"</html>"
+    storage.store_response(spider, request, HtmlResponse(url=LIST_URL, body=body, headers={"ETag": "v1"}))
+
+    response = storage.retrieve_response(spider, request)
+
+    assert isinstance(response, HtmlResponse)
+    assert response.body == body
+    assert response.headers["ETag"] == b"v1"
+    assert storage.size < len(body) / 10
+    assert storage.retrieve_response(spider, Request(LIST_URL + "&page=2")) is None
+
+
+def test_storage_evicts_least_recently_used(settings, spider):
+    """Test that the cache stays under its size limit."""
+    settings.set("HTTPCACHE_MAX_SIZE", 2500)
+    settings.set("HTTPCACHE_COMPRESSION_LEVEL", 0)
+    storage = SqliteCacheStorage(settings)
+    storage.open_spider(spider)
+    try:
+        for page in range(1, 4):
+            request = Request(f"{LIST_URL}&page={page}")
+            storage.store_response(spider, request, Response(url=request.url, body=bytes(1000)))
+
+        assert storage.size <= 2500
+        assert storage.retrieve_response(spider, Request(f"{LIST_URL}&page=1")) is None
+        assert storage.retrieve_response(spider, Request(f"{LIST_URL}&page=3")) is not None
+    finally:
+        storage.close_spider(spider)
+
+
+def test_storage_refresh_updates_validators(storage, spider):
+    """Test that a 304 refreshes the stored headers."""
+    request = Request(LIST_URL)
+    storage.store_response(spider, request, cached_response(LIST_URL, 3600, ETag="v1"))
+
+    storage.refresh_response(spider, request, Response(url=LIST_URL, status=304, headers={"ETag": "v2"}))
+
+    assert storage.retrieve_response(spider, request).headers["ETag"] == b"v2"
+
+
+def test_policy_uses_pattern_ttls(settings):
+    """Test freshness by URL pattern, overriding the server's headers."""
+    policy = PatternTTLPolicy(settings)
+    no_cache = {"Cache-Control": "no-cache"}
+
+    assert policy.is_cached_response_fresh(cached_response(LIST_URL, 60, **no_cache), Request(LIST_URL))
+    assert policy.is_cached_response_fresh(cached_response(IMAGE_URL, 10 ** 8), Request(IMAGE_URL))
+    assert policy.should_cache_response(Response(url=LIST_URL, headers=no_cache), Request(LIST_URL))
+    assert not policy.should_cache_response(Response(url=LIST_URL, status=503), Request(LIST_URL))
+
+
+def test_policy_revalidates_stale_responses(settings):
+    """Test that stale responses are revalidated with their validators."""
+    policy = PatternTTLPolicy(settings)
+    request = Request(LIST_URL)
+    stale = cached_response(LIST_URL, 1000, ETag="v1", **{"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    assert not policy.is_cached_response_fresh(stale, request)
+    assert request.headers["If-None-Match"] == b"v1"
+    assert request.headers["If-Modified-Since"] == b"Mon, 01 Jan 2024 00:00:00 GMT"
+    assert policy.is_cached_response_valid(stale, Response(url=LIST_URL, status=304), request)
+
+
+def test_policy_ages_responses_from_when_they_were_stored(storage, settings, spider):
+    """Test that a response without a Date header expires with the time it was stored."""
+    policy = PatternTTLPolicy(settings)
+    request = Request(LIST_URL)
+    storage.store_response(spider, request, Response(url=LIST_URL, status=200))
+    storage.db.execute("UPDATE responses SET stored_at = ?", (time() - 1000,))
+
+    response = storage.retrieve_response(spider, request)
+
+    assert b"Date" not in response.headers
+    assert not policy.is_cached_response_fresh(response, request)
+    assert not policy.is_cached_response_fresh(response, Request(LIST_URL))
+    assert policy.is_cached_response_fresh(cached_response(LIST_URL, 60), Request(LIST_URL))
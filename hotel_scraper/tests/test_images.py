@@ -0,0 +1,62 @@
+import io
+import os
+import pytest
+from hotel_scraper.images import InvalidImage, process_image, variant_path
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def jpeg_bytes(size=(400, 300), **params):
+    """Encode a plain JPEG image of the given size."""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 10, 10)).save(buffer, "JPEG", **params)
+    return buffer.getvalue()
+
+
+def test_variant_path_mirrors_layout():
+    """Test variants are stored under their kind with the original layout."""
+    path = os.path.join("images", "London", "Hotel_One.jpg")
+
+    assert variant_path("images", path, "thumbs/small") == os.path.join("images", "thumbs/small", "London", "Hotel_One.jpg")
+    assert variant_path("images", path, "webp", ".webp") == os.path.join("images", "webp", "London", "Hotel_One.webp")
+
+
+def test_process_image_stores_clean_image_and_variants(tmp_path):
+    """Test the original loses its metadata and gets thumbnails and a WebP copy."""
+    exif = Image.Exif()
+    exif[0x010F] = "CameraMaker"
+    body = jpeg_bytes(exif=exif.tobytes(), comment=b"private comment")
+    path = str(tmp_path / "London" / "Hotel_One.jpg")
+
+    result = process_image(body, path, str(tmp_path), {"small": (160, 120)}, webp_quality=80)
+
+    assert (result["width"], result["height"]) == (400, 300)
+    with open(path, "rb") as f:
+        stored = f.read()
+    assert b"CameraMaker" not in stored and b"private comment" not in stored
+    with Image.open(result["variants"]["small"]) as thumb:
+        assert thumb.size == (160, 120)
+    with Image.open(result["variants"]["webp"]) as webp:
+        assert webp.format == "WEBP"
+
+
+def test_process_image_applies_orientation(tmp_path):
+    """Test images rotated by their EXIF orientation are stored upright."""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    path = str(tmp_path / "Hotel.jpg")
+
+    result = process_image(jpeg_bytes(exif=exif.tobytes()), path, str(tmp_path))
+
+    assert (result["width"], result["height"]) == (300, 400)
+    with Image.open(path) as stored:
+        assert stored.size == (300, 400)
+
+
+@pytest.mark.parametrize("body", [jpeg_bytes()[:500], b"<html><body>Access Denied</body></html>"])
+def test_process_image_rejects_invalid_body(tmp_path, body):
+    """Test truncated and non-image bodies are rejected without writing."""
+    with pytest.raises(InvalidImage):
+        process_image(body, str(tmp_path / "Hotel.jpg"), str(tmp_path))
+
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,28 @@
+import pytest
+from itemadapter import ItemAdapter
+from hotel_scraper.items import HOTEL_FIELDS, HotelItem, HotelScraperItem
+
+
+def test_hotel_item_normalizes_dict_items():
+    """Test that plain dict items are normalized into typed hotel items."""
+    hotel = HotelItem.from_item({
+        "property_title": "Hotel One", "property_id": "42", "rating": "4.5", "price": "N/A",
+        "latitude": 1, "image_url": "", "city": "Dhaka", "unknown": "ignored",
+    })
+
+    assert (hotel.property_id, hotel.rating, hotel.latitude) == (42, 4.5, 1.0)
+    assert hotel.price is hotel.image_url is hotel.longitude is None
+    assert HotelItem.from_item(hotel) is hotel
+    with pytest.raises(ValueError):
+        HotelItem.from_item({"property_id": "forty-two"})
+
+
+def test_hotel_item_converts_assigned_fields():
+    """Test that fields set later through an item adapter are converted too."""
+    hotel = HotelItem(property_title="Hotel One")
+    adapter = ItemAdapter(hotel)
+    adapter["image_width"], adapter["image_path"] = "400", "N/A"
+
+    assert (hotel.image_width, hotel.image_path) == (400, None)
+    assert not hasattr(hotel, "__dict__")
+    assert set(HotelScraperItem.fields) == HOTEL_FIELDS
@@ -0,0 +1,86 @@
+import json
+import pytest
+from unittest.mock import Mock
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.exceptions import NotConfigured
+from hotel_scraper.extensions import CrawlMetrics
+from hotel_scraper.metrics import Histogram, MetricsRegistry
+
+
+@pytest.fixture
+def spider():
+    """Provide a mock spider with a logger."""
+    mock_spider = Mock()
+    mock_spider.logger = Mock()
+    return mock_spider
+
+
+def test_histogram_interpolates_quantiles():
+    """Test that quantiles are interpolated within the bucket they fall in."""
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 1.5, 3):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1.0) == 4
+    assert histogram.summary()["mean"] == 1.625
+
+
+def test_registry_renders_prometheus_text():
+    """Test that counters and histograms render in the Prometheus text format."""
+    registry = MetricsRegistry(prefix="test_")
+    registry.describe("items_total", "Items scraped.")
+    registry.inc("items_total", city='New "York"')
+    registry.inc("items_total", 2, city='New "York"')
+    registry.observe("stage_seconds", 0.3, buckets=(0.1, 1), stage="extract")
+
+    lines = registry.to_prometheus().splitlines()
+
+    assert lines[:3] == [
+        "# HELP test_items_total Items scraped.",
+        "# TYPE test_items_total counter",
+        'test_items_total{city="New \\"York\\""} 3',
+    ]
+    assert 'test_stage_seconds_bucket{stage="extract",le="0.1"} 0' in lines
+    assert 'test_stage_seconds_bucket{stage="extract",le="1"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="extract",le="+Inf"} 1' in lines
+    assert 'test_stage_seconds_count{stage="extract"} 1' in lines
+
+
+def test_metrics_extension_requires_setting():
+    """Test that the metrics extension is disabled unless METRICS_ENABLED is set."""
+    crawler = Mock(settings=Settings({"METRICS_ENABLED": False}))
+    with pytest.raises(NotConfigured):
+        CrawlMetrics.from_crawler(crawler)
+
+
+def test_metrics_extension_records_crawl(tmp_path, spider):
+    """Test that downloads, stages and failures are recorded and dumped as JSON."""
+    dump_file = tmp_path / "metrics.json"
+    ext = CrawlMetrics(http_enabled=False, dump_file=str(dump_file))
+    ext.spider_opened(spider)
+
+    request = Request("https://example.com/hotels", meta={"city_name": "Dhaka", "download_latency": 0.2})
+    ext.response_received(Response(request.url, body=b"x" * 100), request, spider)
+    image_request = Request("https://example.com/a.jpg", meta={"download_slot": "images"})
+    ext.response_received(Response(image_request.url, body=b"jpg", flags=["cached"]), image_request, spider)
+    ext.stage_finished(stage="extract", duration=0.01, size=100)
+    ext.stage_finished(stage="hotels", duration=0.02, city="Dhaka", count=5)
+    ext.item_scraped({"city": "Dhaka"}, None, spider)
+    ext.image_failed(url=image_request.url, reason="http_404", city="Dhaka")
+    ext.spider_closed(spider)
+
+    registry = ext.registry
+    assert registry.counter_value("responses_total", kind="html", status=200) == 1
+    assert registry.counter_value("response_bytes_total", kind="html", city="Dhaka") == 100
+    assert registry.counter_value("cache_hits_total", kind="image") == 1
+    assert registry.counter_value("stage_items_total", stage="hotels", city="Dhaka") == 5
+    assert registry.counter_value("image_failures_total", reason="http_404", city="Dhaka") == 1
+
+    summary = json.loads(dump_file.read_text())
+    assert summary["items"] == 1
+    histograms = {(entry["name"], tuple(entry["labels"].items())): entry for entry in summary["histograms"]}
+    assert histograms[("download_seconds", (("kind", "html"),))]["count"] == 1
+    assert histograms[("stage_bytes", (("stage", "extract"),))]["sum"] == 100
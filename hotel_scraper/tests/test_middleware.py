@@ -1,8 +1,19 @@
 import pytest
+from scrapy.exceptions import NotConfigured
 from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
 from scrapy.spiders import Spider
 from unittest.mock import Mock
-from hotel_scraper.middlewares import HotelScraperSpiderMiddleware, HotelScraperDownloaderMiddleware
+from scrapy.statscollectors import MemoryStatsCollector
+from twisted.internet.error import TimeoutError
+from hotel_scraper.middlewares import (
+    AimdThrottle,
+    CallbackProfilerMiddleware,
+    HotelScraperSpiderMiddleware,
+    HotelScraperDownloaderMiddleware,
+    retry_after_seconds,
+)
+from hotel_scraper.profiling import collapsed_stacks
 
 
 @pytest.fixture
@@ -115,3 +126,157 @@ def test_spider_opened_signal_downloader_middleware(spider):
     
     # Assert the spider logger is called with the correct message
     spider.logger.info.assert_called_with(f"Spider opened: {spider.name}")
+
+
+def test_aimd_throttle_ramps_up_then_backs_off():
+    """Test that healthy rounds lower the delay, then raise concurrency, and a 429 halves it."""
+    throttle = AimdThrottle(concurrency=1, delay=1.0, min_delay=0.5, max_concurrency=3, delay_step=0.25)
+    steps = [(throttle.response(200, 0.1), throttle.concurrency, throttle.delay) for _ in range(6)]
+
+    assert steps == [(True, 1, 0.75), (True, 1, 0.5), (True, 2, 0.5), (False, 2, 0.5), (True, 3, 0.5), (False, 3, 0.5)]
+    assert throttle.response(429, 0.1, retry_after=5) is True
+    assert (throttle.concurrency, throttle.delay) == (1, 5)
+    # Responses to requests sent before the backoff don't back off again
+    assert throttle.response(429, 0.1) is False
+    assert throttle.counts["rate_limited"] == 2 and throttle.counts["backoffs"] == 1
+
+
+def test_aimd_throttle_follows_latency_and_errors():
+    """Test that slow responses hold the throttle steady and very slow ones or errors back off."""
+    throttle = AimdThrottle(concurrency=4, delay=0.0, target_latency=1.0, smoothing=1.0)
+
+    assert throttle.response(200, 1.5) is False and throttle.concurrency == 4
+    assert throttle.response(200, 2.5) is True
+    assert (throttle.concurrency, throttle.delay) == (2, 0.25)
+    for _ in range(4):
+        throttle.response(200, 0.1)
+    assert throttle.error() is True and throttle.concurrency == 1
+
+
+def test_retry_after_seconds():
+    """Test parsing Retry-After as seconds or an HTTP date."""
+    assert retry_after_seconds(b"120") == 120
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry_after_seconds(b"soon") is None and retry_after_seconds(None) is None
+
+
+def test_downloader_middleware_requires_setting():
+    """Test that the throttle is not installed unless THROTTLE_ENABLED is set."""
+    crawler = Mock(settings=Settings({"THROTTLE_ENABLED": False}))
+    with pytest.raises(NotConfigured):
+        HotelScraperDownloaderMiddleware.from_crawler(crawler)
+
+
+def test_downloader_middleware_throttles_slots_by_kind(spider):
+    """Test that image and page responses adjust their own download slots and stats."""
+    settings = Settings({
+        "THROTTLE_ENABLED": True, "DOWNLOAD_DELAY": 3, "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+        "DOWNLOAD_SLOTS": {"images": {"concurrency": 8, "delay": 0}},
+    })
+    crawler = Mock(settings=settings)
+    crawler.stats = MemoryStatsCollector(crawler)
+    slots = {"images": Mock(concurrency=8, delay=0), "uk.trip.com": Mock(concurrency=1, delay=3)}
+    crawler.engine.downloader.slots = slots
+    middleware = HotelScraperDownloaderMiddleware.from_crawler(crawler)
+
+    image = Request("https://ak-d.tripcdn.com/images/1.jpg", meta={"download_slot": "images", "download_latency": 0.1})
+    for _ in range(8):
+        middleware.process_response(image, HtmlResponse(image.url), spider)
+    page = Request("https://uk.trip.com/hotels/list?city=1",
+                   meta={"download_slot": "uk.trip.com", "download_latency": 0.5})
+    middleware.process_response(page, HtmlResponse(page.url, status=429, headers={"Retry-After": "10"}), spider)
+    middleware.process_exception(image, TimeoutError(), spider)
+
+    assert (slots["images"].concurrency, slots["images"].delay) == (4, 0.25)
+    assert (slots["uk.trip.com"].concurrency, slots["uk.trip.com"].delay) == (1, 10)
+    stats = crawler.stats.get_stats()
+    assert stats["throttle/image/concurrency"] == 4 and stats["throttle/image/errors"] == 1
+    assert stats["throttle/html/delay"] == 10 and stats["throttle/html/rate_limited"] == 1
+
+
+def test_downloader_middleware_throttles_each_proxy_slot(spider):
+    """Test that a ban through one proxy leaves the slot of another proxy unchanged."""
+    settings = Settings({"THROTTLE_ENABLED": True, "DOWNLOAD_DELAY": 1, "CONCURRENT_REQUESTS_PER_DOMAIN": 2})
+    crawler = Mock(settings=settings)
+    crawler.stats = MemoryStatsCollector(crawler)
+    banned, other = "uk.trip.com@127.0.0.1:9001", "uk.trip.com@127.0.0.1:9002"
+    slots = {banned: Mock(concurrency=2, delay=1), other: Mock(concurrency=2, delay=1)}
+    crawler.engine.downloader.slots = slots
+    middleware = HotelScraperDownloaderMiddleware.from_crawler(crawler)
+
+    url = "https://uk.trip.com/hotels/list?city=1"
+    ok = Request(url, meta={"download_slot": other, "download_latency": 0.5})
+    middleware.process_response(ok, HtmlResponse(url), spider)
+    ban = Request(url, meta={"download_slot": banned, "download_latency": 0.5})
+    middleware.process_response(ban, HtmlResponse(url, status=403), spider)
+
+    assert (slots[banned].concurrency, slots[banned].delay) == (1, 2)
+    assert (slots[other].concurrency, slots[other].delay) == (2, 1)
+    stats = crawler.stats.get_stats()
+    assert stats["throttle/html/concurrency"] == 3 and stats["throttle/html/banned"] == 1
+    assert stats["throttle/html/responses"] == 2
+
+
+def parse_hotels(response):
+    """Stand-in spider callback for the profiler tests."""
+    for i in range(3):
+        yield {"hotel": sorted(range(1000), key=lambda x: -x)[i]}
+
+
+def test_profiler_middleware_requires_setting():
+    """Test that the profiler is not installed unless PROFILING_ENABLED is set."""
+    crawler = Mock(settings=Settings({"PROFILING_ENABLED": False}))
+    with pytest.raises(NotConfigured):
+        CallbackProfilerMiddleware.from_crawler(crawler)
+
+
+def test_profiler_middleware_passes_unsampled_output_through(spider):
+    """Test that callbacks which aren't sampled get their output untouched."""
+    middleware = CallbackProfilerMiddleware(sample_rate=0)
+    response = HtmlResponse(url="https://example.com", request=Request("https://example.com", callback=parse_hotels))
+    result = ["item1", "item2"]
+
+    assert middleware.process_spider_output(response, result, spider) is result
+    assert middleware.calls == {"parse_hotels": 1}
+    assert not middleware.profiles
+
+
+def test_profiler_middleware_writes_profiles(tmp_path, spider):
+    """Test that sampled callbacks are profiled and reported when the spider closes."""
+    spider.logger = Mock()
+    middleware = CallbackProfilerMiddleware(directory=str(tmp_path), sample_rate=1)
+    request = Request("https://example.com", callback=parse_hotels)
+    response = HtmlResponse(url="https://example.com", request=request)
+
+    for _ in range(2):
+        output = list(middleware.process_spider_output(response, parse_hotels(response), spider))
+        assert output == [{"hotel": 999}, {"hotel": 998}, {"hotel": 997}]
+    middleware.spider_closed(spider)
+
+    assert middleware.sampled == {"parse_hotels": 2}
+    assert (tmp_path / "test_spider.parse_hotels.prof").exists()
+    assert "parse_hotels" in (tmp_path / "test_spider.hotspots.txt").read_text()
+    stacks = (tmp_path / "test_spider.parse_hotels.collapsed").read_text().splitlines()
+    assert any(";parse_hotels (test_middleware.py:" in line and "sorted" in line for line in stacks)
+
+
+def test_collapsed_stacks_split_callee_time_between_callers():
+    """Test that a callee's self time is split between its callers' stacks."""
+    main, a, b, helper = ("m.py", 1, "main"), ("m.py", 5, "a"), ("m.py", 9, "b"), ("m.py", 13, "helper")
+    stats = {
+        # func: (primitive calls, calls, self time, cumulative time, callers)
+        main: (1, 1, 0.001, 0.010, {}),
+        a: (1, 1, 0.001, 0.004, {main: (1, 1, 0.001, 0.004)}),
+        b: (1, 1, 0.002, 0.005, {main: (1, 1, 0.002, 0.005)}),
+        helper: (2, 2, 0.006, 0.006, {a: (1, 1, 0.003, 0.003), b: (1, 1, 0.003, 0.003)}),
+    }
+
+    stacks = collapsed_stacks(stats, root="parse")
+
+    assert stacks == {
+        "parse;main (m.py:1)": 1000,
+        "parse;main (m.py:1);a (m.py:5)": 1000,
+        "parse;main (m.py:1);a (m.py:5);helper (m.py:13)": 3000,
+        "parse;main (m.py:1);b (m.py:9)": 2000,
+        "parse;main (m.py:1);b (m.py:9);helper (m.py:13)": 3000,
+    }
@@ -0,0 +1,56 @@
+from sqlalchemy import inspect, text
+from hotel_scraper.database import create_db_engine, engine_options
+from hotel_scraper.geo import encode_geohash
+from hotel_scraper.migrations import MIGRATIONS, migrate
+
+# The schema ``initialize_db.py`` created before migrations were recorded
+BASELINE_SCHEMA = (
+    "CREATE TABLE cities (id INTEGER PRIMARY KEY, name VARCHAR UNIQUE)",
+    "CREATE TABLE hotels (id INTEGER PRIMARY KEY, property_id INTEGER, name VARCHAR, rating FLOAT, "
+    "location VARCHAR, latitude FLOAT, longitude FLOAT, room_type VARCHAR, price FLOAT, image_path VARCHAR, "
+    "city_id INTEGER REFERENCES cities (id), city_name VARCHAR)",
+)
+
+
+def file_engine(tmp_path):
+    """Return an engine on a new SQLite file database."""
+    return create_db_engine(engine_options(environ={"DATABASE_URL": f"sqlite:///{tmp_path / 'old.db'}"}))
+
+
+def test_migrate_creates_a_new_database(tmp_path):
+    """Test that every migration runs once on an empty database."""
+    engine = file_engine(tmp_path)
+
+    assert migrate(engine) == [version for version, _, _ in MIGRATIONS]
+    assert migrate(engine) == []
+    indexes = {index["name"] for index in inspect(engine).get_indexes("hotels")}
+    assert {"ix_hotels_city_price", "ix_hotels_city_rating", "ix_hotels_geohash_location"} <= indexes
+    assert "uq_hotels_property_id" not in indexes
+    engine.dispose()
+
+
+def test_migrate_upgrades_a_baseline_database(tmp_path):
+    """Test that a database of the original schema is upgraded with its data."""
+    engine = file_engine(tmp_path)
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO cities (id, name) VALUES (1, 'Dhaka')"))
+        connection.execute(text(
+            "INSERT INTO hotels (id, property_id, name, price, rating, latitude, longitude, city_id) VALUES "
+            "(1, 7, 'Old', 90, 3.0, 23.81, 90.41, 1), (2, 7, 'New', 100, 4.0, 23.81, 90.41, 1), "
+            "(3, 8, 'Other', 50, 5.0, NULL, NULL, 1)"
+        ))
+
+    migrate(engine)
+
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("hotels")}
+    assert {"geohash", "retired", "last_seen_at", "content_hash"} <= columns
+    assert "ix_hotels_city_price" in {index["name"] for index in inspector.get_indexes("hotels")}
+    with engine.connect() as connection:
+        hotels = connection.execute(text("SELECT id, geohash FROM hotels ORDER BY id")).all()
+        stats = connection.execute(text("SELECT hotels, min_price, max_price FROM city_stats")).all()
+    assert hotels == [(2, encode_geohash(23.81, 90.41)), (3, None)]
+    assert stats == [(2, 50.0, 100.0)]
+    engine.dispose()
@@ -0,0 +1,580 @@
+import hashlib
+import io
+import os
+import pytest
+from concurrent.futures import Future
+from datetime import timezone
+from unittest.mock import Mock, patch
+from twisted.internet import defer, task
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, DropItem
+from scrapy.http import Response
+from scrapy.spiders import Spider
+from hotel_scraper import signals as hotel_signals
+from hotel_scraper.changes import HASHED_COLUMNS, content_hash
+from hotel_scraper.pipelines import ImageDownloadPipeline, HotelScraperPipeline, SnapshotExportPipeline
+from hotel_scraper.models import Base, City, CityStats, Hotel, HotelChange, ImageRecord
+from hotel_scraper.database import SessionLocal, get_engine
+from hotel_scraper.retry import HostUnavailable
+from hotel_scraper.spiders.city_hotels import CityAndHotelsSpider
+
+engine = get_engine()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema before running tests."""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def spider():
+    """Provide a mock spider with a logger."""
+    mock_spider = Mock(spec=Spider)
+    mock_spider.name = "test_spider"
+    mock_spider.logger = Mock()
+    return mock_spider
+
+
+@pytest.fixture
+def hotel_item():
+    """Provide a hotel item as yielded by the spider."""
+    return {
+        "property_title": "Hotel One",
+        "property_id": 42,
+        "rating": 4.5,
+        "location": "Near Airport",
+        "latitude": 1.23,
+        "longitude": "N/A",
+        "room_type": "Deluxe",
+        "price": "100",
+        "image_url": "http://example.com/image.jpg",
+        "city_name": "Test City",
+        "city": "Test City",
+    }
+
+
+def run_inline(func, *args):
+    """Stand-in for deferToThread that runs the call synchronously."""
+    return defer.maybeDeferred(func, *args)
+
+
+def fired(dfd):
+    """Return the result of an already fired Deferred."""
+    results = []
+    dfd.addBoth(results.append)
+    return results[0]
+
+
+def test_image_pipeline_downloads_image(tmp_path, spider, hotel_item):
+    """Test that the image is fetched through the engine and saved to disk."""
+    crawler = Mock()
+    crawler.engine.download.return_value = defer.succeed(
+        Response(url=hotel_item["image_url"], status=200, body=b"jpeg-bytes")
+    )
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path))
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        item = fired(pipeline.process_item(hotel_item, spider))
+
+    request = crawler.engine.download.call_args[0][0]
+    assert request.url == hotel_item["image_url"]
+    assert request.meta["download_slot"] == "images"
+    digest = hashlib.sha256(b"jpeg-bytes").hexdigest()
+    assert item["image_sha256"] == digest
+    assert item["image_path"] == os.path.join(str(tmp_path), digest[:2], digest[2:4], digest + ".jpg")
+    with open(item["image_path"], "rb") as f:
+        assert f.read() == b"jpeg-bytes"
+
+
+def test_image_pipeline_keeps_item_on_failure(tmp_path, spider, hotel_item):
+    """Test that a failed download leaves the item without an image path."""
+    crawler = Mock()
+    crawler.engine.download.return_value = defer.succeed(
+        Response(url=hotel_item["image_url"], status=404)
+    )
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path))
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        item = fired(pipeline.process_item(hotel_item, spider))
+
+    assert item["image_path"] is None
+    assert not os.listdir(tmp_path)
+    crawler.signals.send_catch_log.assert_called_once_with(
+        hotel_signals.image_failed, url=hotel_item["image_url"], reason="http_404", city="Test City"
+    )
+
+
+def test_image_pipeline_skips_missing_url(tmp_path, spider, hotel_item):
+    """Test that items without an image URL are passed straight through."""
+    crawler = Mock()
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path))
+    hotel_item["image_url"] = "N/A"
+
+    item = pipeline.process_item(hotel_item, spider)
+
+    assert item["image_path"] is None
+    crawler.engine.download.assert_not_called()
+
+
+class InlinePool:
+    """Stand-in for the process pool that runs jobs synchronously."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def inline_future(future):
+    """Stand-in for _deferred_from_future for already completed futures."""
+    try:
+        return defer.succeed(future.result())
+    except Exception as e:
+        return defer.fail(e)
+
+
+def test_image_pipeline_postprocesses_image(tmp_path, spider, hotel_item):
+    """Test that post-processed images record their dimensions and variants."""
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300)).save(buffer, "JPEG")
+    crawler = Mock()
+    crawler.engine.download.return_value = defer.succeed(
+        Response(url=hotel_item["image_url"], status=200, body=buffer.getvalue())
+    )
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path), postprocess=True,
+                                     thumbs={"small": (160, 120)}, webp_quality=80)
+    pipeline.pool = InlinePool()
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch("hotel_scraper.pipelines._deferred_from_future", inline_future):
+        item = fired(pipeline.process_item(hotel_item, spider))
+
+    assert item["image_path"].startswith(os.path.join(str(tmp_path), item["image_sha256"][:2]))
+    assert (item["image_width"], item["image_height"]) == (400, 300)
+    assert set(item["image_variants"]) == {"small", "webp"}
+    assert os.path.exists(item["image_variants"]["small"])
+
+
+def test_image_pipeline_discards_invalid_image(tmp_path, spider, hotel_item):
+    """Test that a body which doesn't decode is not stored as an image."""
+    pytest.importorskip("PIL.Image")
+    crawler = Mock()
+    crawler.engine.download.return_value = defer.succeed(
+        Response(url=hotel_item["image_url"], status=200, body=b"<html>Access Denied</html>")
+    )
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path), postprocess=True)
+    pipeline.pool = InlinePool()
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch("hotel_scraper.pipelines._deferred_from_future", inline_future):
+        item = fired(pipeline.process_item(hotel_item, spider))
+
+    assert item["image_path"] is None
+    assert not os.listdir(tmp_path)
+    crawler.signals.send_catch_log.assert_called_once_with(
+        hotel_signals.image_failed, url=hotel_item["image_url"], reason="invalid", city="Test City"
+    )
+
+
+def test_hotel_pipeline_saves_item(spider, hotel_item):
+    """Test that the database pipeline stores the hotel and its city."""
+    pipeline = HotelScraperPipeline(flush_interval=0)
+    pipeline.open_spider(spider)
+    hotel_item["image_path"] = "images/Test City/Hotel_One.jpg"
+    hotel_item["image_width"], hotel_item["image_height"] = 400, 300
+    hotel_item["image_variants"] = {"small": "images/thumbs/small/Test City/Hotel_One.jpg"}
+    pipeline.process_item(hotel_item, spider)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        hotel = session.query(Hotel).filter_by(property_id=42).one()
+        assert hotel.price == 100.0
+        assert hotel.longitude is None
+        assert hotel.image_path == "images/Test City/Hotel_One.jpg"
+        assert (hotel.image_width, hotel.image_height) == (400, 300)
+        assert hotel.image_variants == {"small": "images/thumbs/small/Test City/Hotel_One.jpg"}
+        city = session.query(City).filter_by(id=hotel.city_id).one()
+        assert city.name == "Test City"
+        assert city.updated_at is not None
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_flushes_in_batches(spider, hotel_item):
+    """Test that rows are buffered until the batch size is reached."""
+    crawler = Mock()
+    pipeline = HotelScraperPipeline(batch_size=3, flush_interval=0, crawler=crawler)
+    pipeline.open_spider(spider)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch.object(pipeline, "write_batch", wraps=pipeline.write_batch) as write_batch:
+        for property_id in range(100, 107):
+            pipeline.process_item(dict(hotel_item, property_id=property_id), spider)
+        assert [len(call.args[0]) for call in write_batch.call_args_list] == [3, 3]
+        assert len(pipeline.buffer) == 1
+
+        pipeline.flush()
+        assert [len(call.args[0]) for call in write_batch.call_args_list] == [3, 3, 1]
+
+    sent = crawler.signals.send_catch_log.call_args_list
+    flushes = [call.kwargs for call in sent if call.args[0] is hotel_signals.stage_finished]
+    assert [(flush["stage"], flush["count"]) for flush in flushes] == [("db_flush", 3), ("db_flush", 3), ("db_flush", 1)]
+    stored = [call.kwargs["items"] for call in sent if call.args[0] is hotel_signals.hotels_stored]
+    assert [[item["property_id"] for item in items] for items in stored] == [[100, 101, 102], [103, 104, 105], [106]]
+
+    session = SessionLocal()
+    try:
+        assert session.query(Hotel).filter(Hotel.property_id.between(100, 106)).count() == 7
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_drops_invalid_items(spider, hotel_item):
+    """Test that items that can't be stored are dropped rather than passed on."""
+    pipeline = HotelScraperPipeline(flush_interval=0)
+    pipeline.open_spider(spider)
+
+    for item in (dict(hotel_item, price="free"), dict(hotel_item, city=None)):
+        with pytest.raises(DropItem):
+            pipeline.process_item(item, spider)
+    assert pipeline.buffer == []
+
+
+def test_hotel_pipeline_retries_failed_batches(spider, hotel_item):
+    """Test that a failed batch is written again before later ones, and given up after its retries."""
+    crawler = Mock()
+    pipeline = HotelScraperPipeline(batch_size=100, flush_interval=0, crawler=crawler, flush_retries=1)
+    pipeline.open_spider(spider)
+    write_batch = pipeline.write_batch
+    failures = [RuntimeError("down")]
+    clock = task.Clock()
+
+    def flaky_write_batch(rows):
+        if failures:
+            raise failures.pop()
+        return write_batch(rows)
+
+    def later(_, delay, func, *args):
+        return task.deferLater(clock, delay, func, *args)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch("hotel_scraper.pipelines.deferLater", later), \
+            patch.object(pipeline, "write_batch", flaky_write_batch):
+        pipeline.process_item(dict(hotel_item, property_id=110, property_title="Old Name"), spider)
+        pipeline.flush()
+        # A newer row of the same hotel waits for the retry of the older one
+        pipeline.process_item(dict(hotel_item, property_id=110, property_title="New Name"), spider)
+        pipeline.flush()
+        clock.advance(pipeline.flush_retry_delay)
+        fired(pipeline.close_spider(spider))
+
+    with SessionLocal() as session:
+        assert session.query(Hotel).filter_by(property_id=110).one().name == "New Name"
+    sent = crawler.signals.send_catch_log.call_args_list
+    stored = [call.kwargs["items"] for call in sent if call.args[0] is hotel_signals.hotels_stored]
+    assert [[item["property_title"] for item in items] for items in stored] == [["Old Name"], ["New Name"]]
+
+    crawler.signals.send_catch_log.reset_mock()
+    pipeline.flush_retry_delay = 0
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch.object(pipeline, "write_batch", side_effect=RuntimeError("down")):
+        pipeline.process_item(dict(hotel_item, property_id=112), spider)
+        fired(pipeline.flush_all())
+    assert pipeline.buffer == [] and pipeline.counts["lost"] == 1 and pipeline.counts["flush_failed"] == 3
+    sent = crawler.signals.send_catch_log.call_args_list
+    assert not [call for call in sent if call.args[0] is hotel_signals.hotels_stored]
+    dropped = [call.kwargs["item"] for call in sent if call.args[0] is signals.item_dropped]
+    assert [item["property_id"] for item in dropped] == [112]
+
+
+def test_image_pipeline_reuses_indexed_image(tmp_path, spider, hotel_item):
+    """Test that an image URL stored by an earlier run is not downloaded again."""
+    stored = tmp_path / "ab" / "cd" / "abcd.jpg"
+    stored.parent.mkdir(parents=True)
+    stored.write_bytes(b"jpeg-bytes")
+    with engine.begin() as connection:
+        connection.execute(ImageRecord.__table__.insert(), {
+            "url": hotel_item["image_url"], "sha256": "abcd", "path": str(stored), "width": 400, "height": 300,
+        })
+    crawler = Mock()
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path))
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        item = fired(pipeline.process_item(hotel_item, spider))
+
+    assert item["image_path"] == str(stored)
+    assert item["image_width"] == 400
+    crawler.engine.download.assert_not_called()
+
+
+def test_image_pipeline_downloads_shared_url_once(tmp_path, spider, hotel_item):
+    """Test that hotels sharing an image URL wait for a single download."""
+    response = defer.Deferred()
+    crawler = Mock()
+    crawler.engine.download.return_value = response
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path))
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        first = pipeline.process_item(dict(hotel_item, image_url="http://example.com/chain.jpg"), spider)
+        second = pipeline.process_item(dict(hotel_item, image_url="http://example.com/chain.jpg", property_id=43), spider)
+        response.callback(Response(url="http://example.com/chain.jpg", status=200, body=b"jpeg-bytes"))
+        third = pipeline.process_item(dict(hotel_item, image_url="http://example.com/chain.jpg", property_id=44), spider)
+
+    paths = {fired(dfd)["image_path"] for dfd in (first, second, defer.maybeDeferred(lambda: third))}
+    assert len(paths) == 1 and None not in paths
+    assert crawler.engine.download.call_count == 1
+
+
+def test_hotel_pipeline_records_image_index(spider, hotel_item):
+    """Test that stored images are recorded in the URL index with the hotel."""
+    pipeline = HotelScraperPipeline(flush_interval=0)
+    pipeline.open_spider(spider)
+    hotel_item.update(image_url="http://example.com/indexed.jpg", image_path="images/ab/cd/abcd.jpg",
+                      image_sha256="abcd", property_id=45)
+    pipeline.process_item(hotel_item, spider)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        record = session.query(ImageRecord).filter_by(url="http://example.com/indexed.jpg").one()
+        assert (record.sha256, record.path) == ("abcd", "images/ab/cd/abcd.jpg")
+    finally:
+        session.close()
+
+
+def test_image_pipeline_downloads_failed_images_again_at_the_end(tmp_path, spider, hotel_item):
+    """Test that images that failed for a while are put off, then downloaded one first, then all."""
+    crawler = Mock()
+    crawler.engine.download.side_effect = [
+        defer.succeed(Response(url="http://example.com/a.jpg", status=503)),
+        defer.fail(HostUnavailable("Circuit open for example.com")),
+        defer.succeed(Response(url="http://example.com/gone.jpg", status=404)),
+        defer.succeed(Response(url="http://example.com/a.jpg", status=503)),
+        defer.succeed(Response(url="http://example.com/b.jpg", status=200, body=b"jpeg-b")),
+        defer.succeed(Response(url="http://example.com/a.jpg", status=200, body=b"jpeg-a")),
+    ]
+    pipeline = ImageDownloadPipeline(crawler, images_dir=str(tmp_path), defer_failed=True, retry_codes=[503])
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        items = [fired(pipeline.process_item(dict(hotel_item, image_url=f"http://example.com/{name}.jpg"), spider))
+                 for name in ("a", "b", "gone")]
+        assert [item["image_path"] for item in items] == [None, None, None]
+        assert list(pipeline.deferred) == ["http://example.com/a.jpg", "http://example.com/b.jpg"]
+
+        # A failed round waits for the next heartbeat
+        for _ in range(2):
+            with pytest.raises(DontCloseSpider):
+                pipeline.spider_idle(spider)
+        assert crawler.engine.download.call_count == 4
+        pipeline.next_round = 0
+        for _ in range(2):
+            with pytest.raises(DontCloseSpider):
+                pipeline.spider_idle(spider)
+        assert pipeline.spider_idle(spider) is None
+
+    assert crawler.engine.download.call_count == 6
+    recovered = [call.kwargs for call in crawler.signals.send_catch_log.call_args_list
+                 if call.args[0] is hotel_signals.image_recovered]
+    assert [(signal["url"], signal["info"]["sha256"]) for signal in recovered] == [
+        ("http://example.com/b.jpg", hashlib.sha256(b"jpeg-b").hexdigest()),
+        ("http://example.com/a.jpg", hashlib.sha256(b"jpeg-a").hexdigest()),
+    ]
+
+
+def test_hotel_pipeline_stores_images_recovered_at_the_end(spider, hotel_item):
+    """Test that hotels stored without their image get it once it is recovered."""
+    pipeline = HotelScraperPipeline(flush_interval=0)
+    pipeline.open_spider(spider)
+    url = "http://example.com/recovered.jpg"
+    pipeline.process_item(dict(hotel_item, image_url=url, image_path=None, property_id=46), spider)
+    pipeline.image_recovered(url=url, info={"sha256": "ef01", "path": "images/ef/01/ef01.jpg", "width": 640,
+                                            "height": 480, "variants": None})
+
+    touched = []
+    touch_cities = pipeline.touch_cities
+
+    def record_touch(connection, city_ids):
+        touched.append(set(city_ids))
+        touch_cities(connection, city_ids)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch.object(pipeline, "touch_cities", record_touch):
+        fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        hotel = session.query(Hotel).filter_by(property_id=46).one()
+        # Touched once for the batch and again for the recovered image
+        assert touched == [{hotel.city_id}, {hotel.city_id}]
+        assert (hotel.image_path, hotel.image_width, hotel.image_height) == ("images/ef/01/ef01.jpg", 640, 480)
+        assert hotel.content_hash == content_hash({column: getattr(hotel, column) for column in HASHED_COLUMNS})
+        assert session.query(ImageRecord).filter_by(url=url).one().sha256 == "ef01"
+        change = session.query(HotelChange).filter_by(property_id=46).order_by(HotelChange.id.desc()).first()
+        assert change.change == "updated" and change.fields["image_path"] == [None, "images/ef/01/ef01.jpg"]
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_upserts_by_property_id(spider, hotel_item):
+    """Test that a hotel seen again is updated rather than duplicated."""
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        for price in (100, 80):
+            pipeline = HotelScraperPipeline(flush_interval=0, incremental=True)
+            pipeline.open_spider(spider)
+            pipeline.process_item(dict(hotel_item, property_id=200, price=price), spider)
+            pipeline.process_item(dict(hotel_item, property_id=200, price=price + 1, longitude=103.85), spider)
+            pipeline.flush()
+
+    session = SessionLocal()
+    try:
+        hotels = session.query(Hotel).filter_by(property_id=200).all()
+        assert len(hotels) == 1
+        assert hotels[0].price == 81.0
+        assert hotels[0].geohash == "w21ygpvm2"
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_retires_unseen_hotels(spider, hotel_item):
+    """Test that hotels missing from consecutive crawls of their city are retired."""
+    item = dict(hotel_item, city="Retire City")
+    spider.completed_cities = {"Retire City"}
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        pipeline = HotelScraperPipeline(flush_interval=0, incremental=True, retire_after=2)
+        pipeline.open_spider(spider)
+        pipeline.process_item(dict(item, property_id=300), spider)
+        pipeline.process_item(dict(item, property_id=301), spider)
+        fired(pipeline.close_spider(spider))
+
+        for _ in range(2):
+            pipeline = HotelScraperPipeline(flush_interval=0, incremental=True, retire_after=2)
+            pipeline.open_spider(spider)
+            pipeline.process_item(dict(item, property_id=300), spider)
+            fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        kept = session.query(Hotel).filter_by(property_id=300).one()
+        gone = session.query(Hotel).filter_by(property_id=301).one()
+        assert (kept.missed_runs, kept.retired) == (0, False)
+        assert (gone.missed_runs, gone.retired) == (2, True)
+        assert session.query(CityStats).filter_by(city_id=kept.city_id).one().hotels == 1
+        change = session.query(HotelChange).filter_by(property_id=301).order_by(HotelChange.id.desc()).first()
+        assert (change.change, change.fields) == ("disappeared", {"retired": [False, True]})
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_skips_unchanged_hotels(spider, hotel_item):
+    """Test that only changed hotels are rewritten and recorded in the change feed."""
+    item = dict(hotel_item, city="Change City")
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        pipeline = HotelScraperPipeline(flush_interval=0, incremental=True)
+        pipeline.open_spider(spider)
+        pipeline.process_item(dict(item, property_id=500), spider)
+        pipeline.process_item(dict(item, property_id=501), spider)
+        fired(pipeline.close_spider(spider))
+
+        pipeline = HotelScraperPipeline(flush_interval=0, incremental=True)
+        pipeline.open_spider(spider)
+        pipeline.process_item(dict(item, property_id=500), spider)
+        pipeline.process_item(dict(item, property_id=501, price="120"), spider)
+        with patch.object(pipeline, "upsert_statement", wraps=pipeline.upsert_statement) as upsert:
+            fired(pipeline.close_spider(spider))
+
+    assert upsert.call_count == 1
+    assert (pipeline.counts["written"], pipeline.counts["unchanged"], pipeline.counts["updated"]) == (1, 1, 1)
+    session = SessionLocal()
+    try:
+        changes = (session.query(HotelChange).filter(HotelChange.property_id.in_([500, 501]))
+                   .order_by(HotelChange.id).all())
+        assert [(change.property_id, change.change) for change in changes] == [
+            (500, "inserted"), (501, "inserted"), (501, "updated"),
+        ]
+        assert changes[-1].fields == {"price": [100.0, 120.0]}
+        unchanged = session.query(Hotel).filter_by(property_id=500).one()
+        assert unchanged.last_seen_at.replace(tzinfo=timezone.utc) == pipeline.run_started
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_refreshes_city_stats(spider, hotel_item):
+    """Test that the aggregates of the cities in a batch are refreshed with it."""
+    pipeline = HotelScraperPipeline(flush_interval=0)
+    pipeline.open_spider(spider)
+    for property_id, price, rating in ((400, "10", "3.0"), (401, "20", "N/A"), (402, "40", "5.0"), (403, "N/A", "4.0")):
+        pipeline.process_item(dict(hotel_item, city="Stats City", property_id=property_id, price=price,
+                                   rating=rating), spider)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+        fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        city = session.query(City).filter_by(name="Stats City").one()
+        stats = session.query(CityStats).filter_by(city_id=city.id).one()
+        assert stats.hotels == 4
+        assert (stats.min_price, stats.median_price, stats.max_price) == (10.0, 20.0, 40.0)
+        assert (stats.p25_price, stats.p75_price, stats.p90_price) == (15.0, 30.0, 36.0)
+        assert (stats.min_rating, stats.avg_rating, stats.median_rating) == (3.0, 4.0, 4.0)
+    finally:
+        session.close()
+
+
+def test_hotel_pipeline_feed_across_runs_that_start_over(tmp_path, spider, hotel_item):
+    """Test that a crawl clearing the stored hotels records them as disappeared before storing them again."""
+    crawl = CityAndHotelsSpider()
+    crawl.images_dir = str(tmp_path / "images")
+    for _ in range(2):
+        crawl.clear_previous_data()
+        pipeline = HotelScraperPipeline(flush_interval=0)
+        pipeline.open_spider(spider)
+        pipeline.process_item(dict(hotel_item, property_id=600), spider)
+        with patch("hotel_scraper.pipelines.deferToThread", run_inline):
+            fired(pipeline.close_spider(spider))
+
+    session = SessionLocal()
+    try:
+        changes = session.query(HotelChange).filter_by(property_id=600).order_by(HotelChange.id).all()
+        assert [change.change for change in changes] == ["inserted", "disappeared", "inserted"]
+        assert session.query(Hotel).filter_by(property_id=600).count() == 1
+    finally:
+        session.close()
+
+
+def test_snapshot_pipeline_writes_partitioned_row_groups(tmp_path, spider, hotel_item):
+    """Test that hotels are exported in row groups per crawl date and city."""
+    ds = pytest.importorskip("pyarrow.dataset")
+    pipeline = SnapshotExportPipeline(export_dir=str(tmp_path), row_group_size=2, max_buffered_rows=3, crawl_id="crawl-1")
+    pipeline.open_spider(spider)
+
+    with patch("hotel_scraper.pipelines.deferToThread", run_inline), \
+            patch.object(pipeline.writer, "write", wraps=pipeline.writer.write) as write:
+        pipeline.process_item(dict(hotel_item, property_id=1, city="Dhaka"), spider)
+        pipeline.process_item(dict(hotel_item, property_id=2, city="Paris"), spider)
+        pipeline.process_item(dict(hotel_item, property_id=3, city="Dhaka"), spider)
+        assert [len(call.args[1]) for call in write.call_args_list] == [2]
+        pipeline.process_item(dict(hotel_item, property_id=4, city="Paris"), spider)
+        pipeline.process_item(dict(hotel_item, property_id=5, city="Rome", price="N/A"), spider)
+        pipeline.process_item(dict(hotel_item, property_id=6, city="Rome"), spider)
+        assert [len(call.args[1]) for call in write.call_args_list] == [2, 2, 2]
+        fired(pipeline.close_spider(spider))
+
+    table = ds.dataset(str(tmp_path), partitioning="hive").to_table().sort_by("property_id")
+    assert table.column("property_id").to_pylist() == [1, 2, 3, 4, 5, 6]
+    assert table.column("city").to_pylist() == ["Dhaka", "Paris", "Dhaka", "Paris", "Rome", "Rome"]
+    assert set(table.column("crawl_id").to_pylist()) == {"crawl-1"}
+    assert table.column("price").to_pylist()[4] is None
@@ -0,0 +1,168 @@
+import random
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+from twisted.internet.error import TimeoutError
+from unittest.mock import Mock
+from hotel_scraper.retry import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HostRetryMiddleware, HostUnavailable, RetryBudget, backoff_delay,
+)
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def middleware(clock):
+    """Provide a retry middleware on a test crawler, with a fake clock."""
+    crawler = get_crawler(Spider, {
+        "RETRY_TIMES": 2, "CIRCUIT_MIN_REQUESTS": 4, "CIRCUIT_OPEN_SECONDS": 30, "RETRY_BACKOFF_MAX": 10,
+    })
+    crawler.engine = Mock()
+    middleware = HostRetryMiddleware(crawler.settings, crawler.stats, crawler, clock=clock, rng=random.Random(7))
+    middleware.spider = Spider("test_spider")
+    middleware.spider.crawler = crawler
+    return middleware
+
+
+def test_backoff_delay_grows_with_jitter_up_to_the_cap():
+    """Test that the wait before a retry is random, below a doubling and capped bound."""
+    rng = random.Random(1)
+    delays = [[backoff_delay(retry, base=1.0, cap=10.0, rng=rng) for _ in range(200)] for retry in (1, 3, 6)]
+
+    assert all(0 <= delay <= 1 for delay in delays[0]) and max(delays[0]) > 0.9
+    assert all(0 <= delay <= 4 for delay in delays[1]) and max(delays[1]) > 3
+    assert all(0 <= delay <= 10 for delay in delays[2]) and max(delays[2]) > 9
+
+
+def test_circuit_breaker_opens_probes_and_closes(clock):
+    """Test that failures open the circuit, and that probes reopen it for longer or close it."""
+    breaker = CircuitBreaker(window=10, min_requests=4, error_ratio=0.5, open_seconds=30,
+                             max_open_seconds=50, clock=clock)
+    for ok in (True, False, True):
+        assert breaker.allow() and not breaker.record(ok)
+    assert breaker.record(False) and breaker.state == OPEN
+    assert not breaker.allow() and not breaker.ready()
+
+    clock.now = 30
+    assert breaker.ready() and breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    assert breaker.record(False) and breaker.state == OPEN and breaker.open_for == 50
+
+    clock.now = 79
+    assert not breaker.allow()
+    clock.now = 80
+    assert breaker.allow()
+    assert breaker.record(True) and breaker.state == CLOSED and breaker.open_for == 30
+    assert breaker.counts == {"opened": 2, "probes": 2, "rejected": 3}
+
+
+def test_retry_budget_earns_a_share_of_requests():
+    """Test that retries are limited to the reserve plus a share of the requests sent."""
+    budget = RetryBudget(ratio=0.25, reserve=1)
+    assert budget.spend() and not budget.spend()
+    for _ in range(4):
+        budget.request()
+    assert budget.spend() and not budget.spend()
+
+
+def test_middleware_retries_after_a_backoff(middleware):
+    """Test that a failed request is retried with a wait, and the wait is honoured."""
+    request = Request("https://uk.trip.com/hotels/list?city=1")
+    assert middleware.process_request(request, middleware.spider) is None
+
+    response = Response(request.url, status=503, headers={"Retry-After": "5"}, request=request)
+    retry = middleware.process_response(request, response, middleware.spider)
+
+    assert retry.meta["retry_times"] == 1 and 5 <= retry.meta["retry_delay"] <= 10
+    assert isinstance(middleware.process_request(retry, middleware.spider), Deferred)
+    assert "retry_delay" not in retry.meta
+    assert middleware.stats.get_value("retry/count") == 1
+
+
+def test_middleware_stops_retrying_when_the_budget_is_spent(middleware):
+    """Test that a host gets no more retries than its budget."""
+    middleware.budget_reserve = 1
+    request = Request("https://cdn.example.com/1.jpg", meta={"dont_defer": True})
+    middleware.process_request(request, middleware.spider)
+
+    assert middleware.process_exception(request, TimeoutError(), middleware.spider) is not None
+    assert middleware.process_exception(request, TimeoutError(), middleware.spider) is None
+    assert middleware.stats.get_value("retry/budget_exhausted") == 1
+
+
+def test_middleware_opens_the_circuit_of_a_failing_host_only(middleware, clock):
+    """Test that an open circuit turns requests to its host away and defers them to the end."""
+    for i in range(4):
+        request = Request(f"https://cdn.example.com/{i}.jpg", meta={"dont_retry": True})
+        middleware.process_request(request, middleware.spider)
+        middleware.process_exception(request, TimeoutError(), middleware.spider)
+
+    page = Request("https://cdn.example.com/5.jpg")
+    with pytest.raises(HostUnavailable):
+        middleware.process_request(page, middleware.spider)
+    assert middleware.process_request(Request("https://uk.trip.com/hotels/"), middleware.spider) is None
+    with pytest.raises(HostUnavailable):
+        middleware.process_request(Request("https://cdn.example.com/6.jpg", errback=Mock()), middleware.spider)
+    assert [request.url for request in middleware.deferred["cdn.example.com"]] == [page.url]
+    assert middleware.stats.get_value("circuit/cdn.example.com/state") == OPEN
+
+    # Nothing is sent until the circuit lets a probe through
+    with pytest.raises(DontCloseSpider):
+        middleware.spider_idle(middleware.spider)
+    middleware.crawler.engine.crawl.assert_not_called()
+    clock.now = 30
+    with pytest.raises(DontCloseSpider):
+        middleware.spider_idle(middleware.spider)
+    (probe,), _ = middleware.crawler.engine.crawl.call_args
+    assert probe.url == page.url and probe.dont_filter
+    assert middleware.deferred == {}
+    middleware.spider_idle(middleware.spider)
+
+
+def test_middleware_leaves_proxy_errors_to_the_proxy_pool(middleware):
+    """Test that network errors through a proxy are retried without opening the circuit of the host."""
+    for i in range(4):
+        request = Request(f"https://uk.trip.com/hotels/list?city={i}", meta={"proxy": "http://127.0.0.1:9001"})
+        middleware.process_request(request, middleware.spider)
+        retry = middleware.process_exception(request, TimeoutError(), middleware.spider)
+        assert retry is not None and retry.meta["retry_times"] == 1
+
+    assert middleware.breaker("uk.trip.com").state == CLOSED
+    assert middleware.process_request(Request("https://uk.trip.com/hotels/"), middleware.spider) is None
+
+
+def test_middleware_defers_requests_that_used_up_their_retries(middleware, clock):
+    """Test that a request out of retries is tried again once at the end, then given up."""
+    request = Request("https://uk.trip.com/hotels/list?city=1", meta={"retry_times": 2})
+    response = Response(request.url, status=500, request=request)
+    with pytest.raises(IgnoreRequest):
+        middleware.process_response(request, response, middleware.spider)
+    (deferred,) = middleware.deferred["uk.trip.com"]
+    assert deferred.meta["retry_times"] == 0 and deferred.meta["deferred"]
+
+    deferred.meta["retry_times"] = 2
+    assert middleware.process_response(deferred, response, middleware.spider) is response
+
+    middleware.deferred_timeout = 60
+    with pytest.raises(DontCloseSpider):
+        middleware.spider_idle(middleware.spider)
+    middleware.deferred["uk.trip.com"] = [deferred]
+    clock.now = 61
+    middleware.spider_idle(middleware.spider)
+    assert middleware.deferred == {} and middleware.stats.get_value("retry/deferred_dropped") == 1
@@ -0,0 +1,60 @@
+import os
+import time
+from scrapy import Request
+from hotel_scraper.seen import BloomDupeFilter, BloomFilter, ScalableBloomFilter
+
+
+def test_bloom_filter_persists_keys(tmp_path):
+    """Test that keys added to a filter file are found after reopening it."""
+    path = str(tmp_path / "filter.bloom")
+    bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+    assert bloom.add(42) and bloom.add("hotel") and not bloom.add(42)
+    bloom.close()
+
+    bloom = BloomFilter(path)
+    assert (42 in bloom, "hotel" in bloom, 43 in bloom) == (True, True, False)
+    assert (bloom.count, bloom.capacity) == (2, 1000)
+    bloom.close()
+
+
+def test_scalable_bloom_filter_grows_within_its_error_rate(tmp_path):
+    """Test that filters are added as keys arrive, keeping false positives rare."""
+    seen = ScalableBloomFilter(str(tmp_path), initial_capacity=1000, error_rate=0.01)
+    added = sum(seen.add(key) for key in range(10000))
+    false_positives = sum(key in seen for key in range(10000, 30000))
+
+    assert len(seen.filters) == 4
+    assert added >= 9900 and len(seen) == added
+    assert false_positives / 20000 < 0.01
+    assert all(key in seen for key in range(10000))
+    seen.close()
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_scalable_bloom_filter_forgets_keys_of_an_old_window(tmp_path):
+    """Test that a filter older than the window is cleared when opened."""
+    seen = ScalableBloomFilter(str(tmp_path), initial_capacity=10, max_age=60)
+    seen.add("a")
+    seen.close()
+    assert "a" in ScalableBloomFilter(str(tmp_path), max_age=60)
+
+    past = time.time() - 120
+    bloom = BloomFilter(str(tmp_path / "filter-000.bloom"))
+    bloom.created_at = past
+    bloom.close()
+    seen = ScalableBloomFilter(str(tmp_path), max_age=60)
+    assert "a" not in seen and seen.created_at.timestamp() > past
+    seen.close()
+
+
+def test_bloom_dupefilter_filters_requests_seen_by_an_earlier_run(tmp_path):
+    """Test that request fingerprints are remembered across runs of the window."""
+    dupefilter = BloomDupeFilter(ScalableBloomFilter(str(tmp_path), initial_capacity=100))
+    assert not dupefilter.request_seen(Request("https://uk.trip.com/hotels/list?city=1"))
+    assert dupefilter.request_seen(Request("https://uk.trip.com/hotels/list?city=1"))
+    dupefilter.close("finished")
+
+    dupefilter = BloomDupeFilter(ScalableBloomFilter(str(tmp_path), initial_capacity=100))
+    assert dupefilter.request_seen(Request("https://uk.trip.com/hotels/list?city=1"))
+    assert not dupefilter.request_seen(Request("https://uk.trip.com/hotels/list?city=2"))
+    dupefilter.close("finished")
@@ -0,0 +1,166 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+from twisted.internet import defer
+from twisted.web.test.requesthelper import DummyRequest
+from hotel_scraper.city_stats import refresh_all_city_stats
+from hotel_scraper.database import SessionLocal, get_engine
+from hotel_scraper.models import Base, City, Hotel, HotelChange
+from hotel_scraper.service import BadRequest, HotelQueries, QueryService, ResponseCache, decode_cursor
+
+engine = get_engine()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    """Create the database schema and 30 hotels in two cities."""
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    dhaka, paris = City(name="Dhaka"), City(name="Paris")
+    session.add_all([dhaka, paris])
+    session.flush()
+    for i in range(30):
+        city = dhaka if i % 3 else paris
+        # Prices repeat, so pages must break ties by id
+        session.add(Hotel(property_id=i, name=f"Hotel {i:02}", city_id=city.id, price=float(50 + i % 7 * 10),
+                          rating=None if i == 4 else 3 + i % 5 * 0.5, retired=i == 29))
+    session.commit()
+    session.close()
+    with engine.begin() as connection:
+        refresh_all_city_stats(connection)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def run_inline(func, *args, **kwargs):
+    """Stand-in for deferToThread that runs the call synchronously."""
+    return defer.succeed(func(*args, **kwargs))
+
+
+def get(service, path, **args):
+    """Send a GET request to the service and return the status and JSON body."""
+    request = DummyRequest([path.strip("/").encode()])
+    request.path = path.encode()
+    request.args = {key.encode(): [str(value).encode()] for key, value in args.items()}
+    with patch("hotel_scraper.service.deferToThread", run_inline):
+        service.render_GET(request)
+    assert request.finished
+    return request.responseCode or 200, json.loads(b"".join(request.written))
+
+
+def walk(queries, **params):
+    """Return every hotel id of a query, reading it page by page."""
+    ids, cursor = [], None
+    while True:
+        page = queries.hotels(cursor=cursor, limit=4, **params)
+        ids.extend(hotel["id"] for hotel in page["hotels"])
+        if page["next_cursor"] is None:
+            return ids
+        cursor = decode_cursor(page["next_cursor"], params.get("sort", "id"))
+
+
+@pytest.mark.parametrize("sort", ["id", "price", "-price", "rating", "-rating", "name"])
+def test_keyset_pages_match_a_single_query(sort):
+    """Test that walking the pages with cursors yields every hotel once, in order."""
+    queries = HotelQueries(engine)
+    expected = [hotel["id"] for hotel in queries.hotels(sort=sort, limit=100)["hotels"]]
+
+    assert walk(queries, sort=sort) == expected
+    assert len(expected) == (28 if "rating" in sort else 29)
+
+
+def test_decode_cursor_rejects_foreign_cursors():
+    """Test that cursors that are malformed or made for another sort are bad requests."""
+    cursor = HotelQueries(engine).hotels(sort="price", limit=2)["next_cursor"]
+
+    assert len(decode_cursor(cursor, "price")) == 2
+    for value, sort in (("not a cursor!", "price"), (cursor, "-price"), (cursor, "id")):
+        with pytest.raises(BadRequest):
+            decode_cursor(value, sort)
+
+
+def test_hotels_filters():
+    """Test the city, price range and rating floor filters."""
+    queries = HotelQueries(engine)
+    hotels = queries.hotels(city="Paris", min_price=60, max_price=90, min_rating=4, limit=100)["hotels"]
+
+    assert hotels and all(hotel["city"] == "Paris" for hotel in hotels)
+    assert all(60 <= hotel["price"] <= 90 and hotel["rating"] >= 4 for hotel in hotels)
+    assert queries.hotels(city="Nowhere")["hotels"] == []
+
+
+def test_response_cache_evicts_and_expires():
+    """Test that the cache drops the least recently used and expired entries."""
+    now = [0.0]
+    cache = ResponseCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", b"1", city="Dhaka")
+    cache.put("b", b"2", city="Paris")
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3")
+    assert cache.get("b") is None and cache.get("a") == b"1"
+
+    assert cache.invalidate({"Dhaka"}) == 2  # "a", and "c" which shows every city
+    now[0] = 11.0
+    cache.put("d", b"4")
+    now[0] = 22.0
+    assert cache.get("d") is None
+
+
+def test_service_serves_pages_and_rejects_bad_requests():
+    """Test the HTTP endpoints and their errors."""
+    service = QueryService(HotelQueries(engine), page_size=10)
+
+    status, body = get(service, "/hotels", city="Dhaka", sort="-price")
+    assert status == 200 and len(body["hotels"]) == 10
+    status, page = get(service, "/hotels", city="Dhaka", sort="-price", cursor=body["next_cursor"])
+    assert page["hotels"][0]["price"] <= body["hotels"][-1]["price"]
+    assert get(service, "/cities")[1][0] == {
+        "id": 1, "name": "Dhaka", "hotels": 19, "min_price": 50.0, "median_price": 80.0, "max_price": 110.0,
+        "avg_rating": pytest.approx(3.889, abs=1e-3),
+    }
+
+    assert get(service, "/hotels", sort="stars")[0] == 400
+    assert get(service, "/hotels", sort="price", cursor=body["next_cursor"])[0] == 400
+    assert get(service, "/hotels", limit="many")[0] == 400
+    assert get(service, "/rooms")[0] == 400
+
+
+def test_service_cache_is_invalidated_when_a_city_is_written():
+    """Test that cached responses of a city are dropped once its hotels are written."""
+    service = QueryService(HotelQueries(engine), invalidate_interval=0)
+    get(service, "/hotels", city="Paris")
+    get(service, "/hotels", city="Dhaka")
+    get(service, "/hotels", city="Paris")
+    assert (service.cache.hits, len(service.cache.entries)) == (1, 2)
+
+    session = SessionLocal()
+    session.query(City).filter_by(name="Paris").update({"updated_at": datetime.now(timezone.utc)})
+    session.commit()
+    session.close()
+    get(service, "/hotels", city="Dhaka")
+
+    assert service.cache.hits == 2
+    assert [key[1][0][1] for key in service.cache.entries] == ["Dhaka"]
+
+
+def test_service_serves_the_change_feed():
+    """Test that the change feed is read in pages after the last id seen."""
+    session = SessionLocal()
+    session.add_all([
+        HotelChange(property_id=i, change="updated", fields={"price": [50.0, 60.0]},
+                    changed_at=datetime.now(timezone.utc))
+        for i in range(3)
+    ])
+    session.commit()
+    session.close()
+    service = QueryService(HotelQueries(engine))
+
+    status, first = get(service, "/changes", limit=2)
+    assert status == 200 and [change["property_id"] for change in first["changes"]] == [0, 1]
+    assert first["changes"][0]["fields"] == {"price": [50.0, 60.0]}
+    _, second = get(service, "/changes", after=first["next_after"], limit=2)
+    assert [change["property_id"] for change in second["changes"]] == [2]
+    _, last = get(service, "/changes", after=second["next_after"])
+    assert last == {"changes": [], "next_after": second["next_after"]}
+    assert get(service, "/changes", since=1)[0] == 400
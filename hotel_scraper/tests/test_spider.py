@@ -1,12 +1,15 @@
 import os
-import shutil
 import pytest
 import tempfile
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from scrapy.http import Request, HtmlResponse
+from hotel_scraper.checkpoint import Checkpoint
+from hotel_scraper.seen import ScalableBloomFilter
 from hotel_scraper.spiders.city_hotels import CityAndHotelsSpider
 from hotel_scraper.models import Base, City, Hotel
-from hotel_scraper.database import engine, SessionLocal
+from hotel_scraper.database import SessionLocal, get_engine
+
+engine = get_engine()
 
 
 # Fixtures
@@ -55,6 +58,15 @@ def test_clear_previous_data(session, spider):
         assert os.path.exists(temp_dir)  # Ensure the temporary directory exists
 
 
+def test_spider_creates_its_engine_when_first_used():
+    """Test that a spider builds no engine until one is needed, and then the environment's."""
+    with patch("hotel_scraper.spiders.city_hotels.get_engine", return_value=engine) as get_engine_mock:
+        spider = CityAndHotelsSpider()
+        get_engine_mock.assert_not_called()
+        assert spider.engine is engine and spider.engine is engine
+    get_engine_mock.assert_called_once_with()
+
+
 def test_parse_with_valid_data(spider):
     """Test parsing main city data."""
     response = HtmlResponse(
@@ -73,8 +85,8 @@ def test_parse_with_valid_data(spider):
 
 
 
-def test_parse_city_hotels_with_valid_data(session, spider):
-    """Test parsing city hotels."""
+def test_parse_city_hotels_with_valid_data(spider):
+    """Test parsing city hotels into items."""
     # Create a mock request with meta data
     mock_request = Request(
         url="https://uk.trip.com/hotels/list?city=1",
@@ -95,17 +107,15 @@ def test_parse_city_hotels_with_valid_data(session, spider):
         request=mock_request  # Attach the mock request to the response
     )
 
-    spider.parse_city_hotels(response)
+    items = list(spider.parse_city_hotels(response))
 
-    # Assert city and hotel are saved
-    assert session.query(City).count() == 1
-    assert session.query(Hotel).count() == 1
-
-    hotel = session.query(Hotel).first()
-    assert hotel.name == "Hotel1"
-    assert hotel.price == 100.0
-    assert hotel.latitude == 1.23
-    assert hotel.longitude == 4.56
+    # Assert one item is yielded for the city, with the image left to the pipeline
+    assert len(items) == 1
+    assert items[0].property_title == "Hotel1"
+    assert items[0].city == "Test City"
+    assert items[0].image_url == "http://example.com/image.jpg"
+    assert items[0].price == 100
+    assert items[0].latitude == 1.23
 
 
 def test_extract_hotel_data(spider):
@@ -119,23 +129,194 @@ def test_extract_hotel_data(spider):
 
     extracted = spider.extract_hotel_data(hotel_data)
 
-    assert extracted["property_title"] == "Hotel1"
-    assert extracted["price"] == 100
-    assert extracted["latitude"] == 1.23
-    assert extracted["longitude"] == 4.56
+    assert extracted.property_title == "Hotel1"
+    assert extracted.price == 100
+    assert extracted.latitude == 1.23
+    assert extracted.longitude == 4.56
+
+
+def test_extract_hotel_data_normalizes_values(spider):
+    """Test that missing values become None and numbers are typed once."""
+    extracted = spider.extract_hotel_data({
+        "hotelBasicInfo": {"hotelName": "Hotel1", "hotelId": "77", "price": "120.5", "hotelImg": "N/A"},
+        "commentInfo": {"commentScore": ""},
+    })
+
+    assert (extracted.property_id, extracted.price) == (77, 120.5)
+    assert extracted.image_url is extracted.rating is extracted.latitude is extracted.city_name is None
+    with pytest.raises(ValueError):
+        spider.extract_hotel_data({"hotelBasicInfo": {"price": "free"}})
+
+
+def hotel_list_response(city_id, page, hotel_ids):
+    """Build a hotel list page response for the given hotel ids."""
+    hotels = b",".join(
+        b'{"hotelBasicInfo": {"hotelName": "Hotel%d", "hotelId": %d, "price": 100}}' % (i, i)
+        for i in hotel_ids
+    )
+    request = Request(
+        url=f"https://uk.trip.com/hotels/list?city={city_id}&page={page}",
+        meta={"city_name": "Test City", "city_id": city_id, "page": page},
+    )
+    return HtmlResponse(
+        url=request.url,
+        body=b'<script>window.IBU_HOTEL = {"initData": {"firstPageList": {"hotelList": [' + hotels + b']}}};</script>',
+        encoding="utf-8",
+        request=request,
+    )
+
+
+def test_parse_full_mode_schedules_every_city_in_order(spider):
+    """Test that full mode requests the first page of every city by id."""
+    spider.crawl_mode = "full"
+    response = HtmlResponse(
+        url="https://uk.trip.com/hotels/?locale=en-GB&curr=GBP",
+        body=(
+            b'<script>window.IBU_HOTEL = {"initData": {"htlsData": {"inboundCities": ['
+            b'{"name": "City10", "id": 10}, {"name": "City2", "id": "2"}, {"name": "City7", "id": 7},'
+            b'{"name": "City1", "id": 1}]}}};</script>'
+        ),
+        encoding="utf-8",
+    )
+
+    requests = list(spider.parse(response))
+
+    assert [r.meta["city_name"] for r in requests] == ["City1", "City2", "City7", "City10"]
+    assert all(r.meta["page"] == 1 and r.priority == 0 for r in requests)
+
+
+def test_parse_resumes_the_unfinished_cities_of_a_checkpointed_crawl(spider):
+    """Test that a resumed full crawl schedules unfinished cities only, from their next page."""
+    previous = Checkpoint(engine, "test-resume")
+    previous.open()
+    previous.page_parsed(1, "City1", 1, last=True)
+    previous.page_parsed(2, "City2", 1)
+    previous.save(previous.changes())
+    spider.crawl_mode = "full"
+    spider.checkpoint = Checkpoint(engine, "test-resume")
+    response = HtmlResponse(
+        url="https://uk.trip.com/hotels/?locale=en-GB&curr=GBP",
+        body=(
+            b'<script>window.IBU_HOTEL = {"initData": {"htlsData": {"inboundCities": ['
+            b'{"name": "City1", "id": 1}, {"name": "City2", "id": 2}, {"name": "City7", "id": 7}]}}};</script>'
+        ),
+        encoding="utf-8",
+    )
+
+    with patch.object(spider, "clear_previous_data") as clear_previous_data:
+        requests = list(spider.parse(response))
+    spider.checkpoint_timer.stop()
+
+    clear_previous_data.assert_not_called()
+    assert [(r.meta["city_name"], r.meta["page"], r.dont_filter) for r in requests] == \
+        [("City2", 2, True), ("City7", 1, True)]
+    assert spider.seen_since == previous.started_at
+
+
+def test_parse_city_hotels_follows_pages(spider):
+    """Test that full mode follows pagination with decreasing priority."""
+    spider.crawl_mode = "full"
+
+    output = list(spider.parse_city_hotels(hotel_list_response(1, 1, range(10))))
+
+    items, requests = output[:-1], output[-1:]
+    assert len(items) == 10
+    assert requests[0].url == "https://uk.trip.com/hotels/list?city=1&page=2"
+    assert requests[0].priority == -1
+
+
+def test_parse_city_hotels_stops_when_exhausted(spider):
+    """Test that pagination ends on a page with no new hotels."""
+    spider.crawl_mode = "full"
+    list(spider.parse_city_hotels(hotel_list_response(1, 1, [1, 2])))
+
+    output = list(spider.parse_city_hotels(hotel_list_response(1, 2, [1, 2])))
+
+    assert output == []
+    assert spider.completed_cities == {"Test City"}
+
+
+def test_parse_city_hotels_skips_hotels_seen_earlier_in_the_window(tmp_path):
+    """Test that hotels stored by an earlier run of the window are not yielded again."""
+    first = CityAndHotelsSpider()
+    first.seen_hotels = ScalableBloomFilter(str(tmp_path), initial_capacity=100)
+    items = list(first.parse_city_hotels(hotel_list_response(1, 1, [1, 2])))
+    assert [item.property_id for item in items] == [1, 2]
+    # Hotel 1 was never stored, e.g. its batch failed
+    first.remember_seen(items[1:])
+    first.closed("finished")
+
+    second = CityAndHotelsSpider()
+    second.crawl_mode = "full"
+    second.seen_hotels = ScalableBloomFilter(str(tmp_path), initial_capacity=100)
+    output = list(second.parse_city_hotels(hotel_list_response(1, 1, [1, 2, 3])))
+
+    # Hotel 2 still counts as new on the page, so pagination goes on
+    assert [item.property_id for item in output[:-1]] == [1, 3]
+    assert output[-1].url == "https://uk.trip.com/hotels/list?city=1&page=2"
+    assert second.seen_since == first.seen_hotels.created_at
+    second.closed("finished")
+
+
+def test_parse_city_hotels_respects_page_budget(spider):
+    """Test that pagination stops at the per-city page budget."""
+    spider.crawl_mode = "full"
+    spider.max_pages = 2
+
+    output = list(spider.parse_city_hotels(hotel_list_response(1, 2, [1, 2])))
+
+    assert len(output) == 2
+    assert spider.completed_cities == set()
+
+
+def test_parse_frontier_mode_seeds_frontier(spider):
+    """Test that frontier mode seeds the shared frontier instead of scheduling cities."""
+    spider.crawl_mode = "frontier"
+    spider.frontier = Mock(crawl="test-crawl")
+    spider.frontier_call = Mock()
+    response = HtmlResponse(
+        url="https://uk.trip.com/hotels/?locale=en-GB&curr=GBP",
+        body=(
+            b'<script>window.IBU_HOTEL = {"initData": {"htlsData": {"inboundCities": ['
+            b'{"name": "City1", "id": "1"}, {"name": "City2", "id": "2"}]}}};</script>'
+        ),
+        encoding="utf-8",
+    )
+
+    with patch.object(spider, "ensure_schema") as ensure_schema:
+        requests = list(spider.parse(response))
+
+    assert requests == []
+    ensure_schema.assert_called_once()
+    spider.frontier_call.assert_called_once_with(
+        spider.frontier.seed, [{"name": "City1", "id": "1"}, {"name": "City2", "id": "2"}]
+    )
 
 
-def test_download_image(spider):
-    """Test image download functionality."""
-    image_url = "https://via.placeholder.com/150"
-    city_name = "Test City"
-    hotel_name = "Test Hotel"
+def test_parse_city_hotels_completes_frontier_unit(spider):
+    """Test that frontier mode hands the next page to the frontier, and completes a unit once its hotels are stored."""
+    spider.crawl_mode = "frontier"
+    spider.frontier = Mock()
+    spider.frontier_call = Mock()
+    response = hotel_list_response(1, 1, [1, 2])
+    response.meta["frontier_unit"] = 42
 
-    # Download image
-    image_path = spider.download_image(image_url, city_name, hotel_name)
+    output = list(spider.parse_city_hotels(response))
 
-    # Assert image exists
-    assert os.path.exists(image_path)
+    assert len(output) == 2
+    spider.frontier_call.assert_called_once_with(spider.frontier.extend, 42, 2)
+    spider.unit_items_done(output[:1])
+    spider.unit_item_done({"property_id": 9})
+    # Failed in one pipeline and stored by another, the first hotel only counts once
+    spider.unit_item_done(output[0])
+    assert spider.frontier_call.call_count == 1
+    spider.unit_item_done(output[1])
+    spider.frontier_call.assert_called_with(spider.frontier.complete, 42)
+    assert spider.unit_pages == {}
 
-    # Cleanup
-    shutil.rmtree("images")
+    # A page whose hotels are all skipped or gone already is done at once
+    spider.frontier_call.reset_mock()
+    response = hotel_list_response(1, 2, [1, 2])
+    response.meta["frontier_unit"] = 43
+    assert list(spider.parse_city_hotels(response)) == []
+    spider.frontier_call.assert_called_once_with(spider.frontier.complete, 43, None)
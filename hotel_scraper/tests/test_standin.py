@@ -0,0 +1,61 @@
+import pytest
+from urllib.error import HTTPError
+from urllib.request import ProxyHandler, build_opener, urlopen
+from hotel_scraper.extractor import extract_ibu_hotel
+from hotel_scraper.tests.standin import StandInServer
+
+
+@pytest.fixture
+def server():
+    """Provide a running stand-in server."""
+    with StandInServer(cities=3, hotels_per_page=4, pages=2, payload_kb=64) as running:
+        yield running
+
+
+def fetch(url):
+    with urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+def test_standin_serves_homepage(server):
+    """Test that the homepage lists the configured cities."""
+    body = fetch(f"{server.base_url}/hotels/?locale=en-GB&curr=GBP")
+
+    cities = extract_ibu_hotel(body)["initData"]["htlsData"]["inboundCities"]
+    assert [city["id"] for city in cities] == [1, 2, 3]
+    assert len(body) > 64 * 1024
+
+
+def test_standin_serves_hotel_list_pages(server):
+    """Test hotel list pagination and image links."""
+    first = extract_ibu_hotel(fetch(f"{server.base_url}/hotels/list?city=2"))
+    last = extract_ibu_hotel(fetch(f"{server.base_url}/hotels/list?city=2&page=3"))
+
+    hotels = first["initData"]["firstPageList"]["hotelList"]
+    assert len(hotels) == 4
+    assert last["initData"]["firstPageList"]["hotelList"] == []
+    assert fetch(hotels[0]["hotelBasicInfo"]["hotelImg"]).startswith(b"\xff\xd8")
+
+
+def test_standin_injects_errors():
+    """Test that the configured error rate turns responses into 503s."""
+    with StandInServer(error_rate=1.0) as server:
+        with pytest.raises(HTTPError) as error:
+            fetch(f"{server.base_url}/hotels/list?city=1")
+    assert error.value.code == 503
+
+
+def test_standin_rate_limits_each_proxy_separately():
+    """Test that requests through each stand-in proxy count as another client's."""
+    with StandInServer(rate_limit=1, proxies=2) as server:
+        first, second = (build_opener(ProxyHandler({"http": url})) for url in server.proxy_urls)
+        statuses = []
+        for _ in range(3):
+            try:
+                with first.open(f"{server.base_url}/hotels/list?city=1", timeout=5) as response:
+                    statuses.append(response.status)
+            except HTTPError as e:
+                statuses.append(e.code)
+        with second.open(f"{server.base_url}/hotels/list?city=1", timeout=5) as response:
+            assert extract_ibu_hotel(response.read())["initData"]["firstPageList"]["hotelList"]
+    assert statuses[0] == 200 and 429 in statuses
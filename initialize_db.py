@@ -1,11 +1,12 @@
+from scrapy.utils.project import get_project_settings
 from sqlalchemy.exc import OperationalError
-from hotel_scraper.database import engine
-from hotel_scraper.models import Base
+from hotel_scraper.database import get_engine
+from hotel_scraper.migrations import migrate
 
 if __name__ == "__main__":
     try:
         print("Initializing database...")
-        Base.metadata.create_all(bind=engine)
-        print("Database initialized successfully.")
+        applied = migrate(get_engine(get_project_settings()))
+        print(f"Database initialized successfully, {len(applied)} migrations applied.")
     except OperationalError as e:
         print(f"Database initialization failed: {e}")